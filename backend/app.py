@@ -1,12 +1,34 @@
-from flask import Flask, request, jsonify, send_from_directory
+# gevent模式需要在导入其他模块之前完成 monkey patch
+import async_server
+ASYNC_MODE = async_server.setup()
+
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from datetime import datetime
 import os
 import sys
 import json
+import time
+import base64
+from urllib.parse import quote
+from werkzeug.datastructures import ContentRange
 from models import db
-from terminal import TerminalManager
+from terminal import TerminalManager, SSHConnection
+from ssh_pool import SSHTransportPool
+from login_probe import run_probe, format_login_info
+from sftp_transfer import UploadManager, DownloadManager, TransferError
+from task_pool import BackgroundTaskPool
+from device_events import DeviceChangeFeed, DEVICES_ROOM
+from expiry_scheduler import ExpiryScheduler
+from audit_writer import AuditWriter
+from audit_retention import AuditRetention
+from audit_search import AuditSearch, after_cursor, encode_cursor
+import audit_counts
+from bulk_import import bulk_import, ImportRowError
+from table_versions import TableVersions
+from db_backend import DatabaseBackend, seconds_between
+import usage_rollup
 
 # 读取配置文件
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -23,12 +45,45 @@ print(f"配置文件存在: {os.path.exists(config_path)}")
 
 # 默认配置
 DEFAULT_CONFIG = {
-    "server": {"host": "0.0.0.0", "port": 3001, "debug": True},
+    "server": {"host": "0.0.0.0", "port": 3001, "debug": True, "async_mode": "gevent"},
     "admin": {"username": "admin", "password": "admin123"},
-    "database": {"path": "backend/device_manager.db"},
+    "database": {
+        "url": "",
+        "path": "backend/device_manager.db",
+        "pool": {"pool_size": 10, "max_overflow": 10, "pool_recycle": 1800, "pool_timeout": 30, "pool_pre_ping": True},
+        "sqlite": {
+            "journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout_ms": 5000,
+            "cache_size_kb": 20480, "mmap_size": 268435456, "temp_store": "MEMORY",
+            "wal_autocheckpoint": 1000, "checkpoint_interval": 60, "checkpoint_truncate_bytes": 67108864
+        }
+    },
     "user": {"default_password": "123456"},
     "device": {"max_devices_per_user": 1},  # 每个用户最多占用的设备数量
-    "socketio": {"ping_timeout": 120, "ping_interval": 25, "max_http_buffer_size": 1073741824},
+    "socketio": {"ping_timeout": 120, "ping_interval": 25, "max_http_buffer_size": 16777216},
+    "terminal": {
+        "output_coalesce_ms": 10, "output_max_batch_bytes": 65536, "recv_buffer_size": 32768,
+        "flow_control_policy": "block", "output_high_water_bytes": 1048576, "output_low_water_bytes": 524288
+    },
+    "ssh_pool": {
+        "max_transports_per_host": 4, "max_sessions_per_transport": 8,
+        "idle_timeout": 300, "keepalive_interval": 30
+    },
+    "login_probe": {"timeout": 15},
+    "background_tasks": {"max_workers": 4, "max_queue": 200, "shutdown_timeout": 10},
+    "upload": {"default_dir": "/tmp", "chunk_size": 1048576, "max_file_size": 1073741824},
+    "download": {"prefetch_window": 4194304, "request_size": 32768, "ticket_ttl": 600},
+    "device_feed": {"history_size": 1000},
+    "expiry": {"resync_interval": 300, "retry_delay": 30},
+    "audit": {
+        "batch_size": 200, "flush_interval": 0.5, "max_buffer": 10000, "shutdown_timeout": 10,
+        "read_flush_timeout": 0.1
+    },
+    "audit_retention": {
+        "default_days": 30, "action_types": {}, "batch_size": 1000, "pause": 0.05,
+        "archive_dir": "", "interval": 86400
+    },
+    "bulk_import": {"chunk_size": 1000, "max_rows": 50000},
+    "audit_search": {"count_limit": 10000, "count_time_limit_ms": 20, "count_cache_ttl": 30, "max_per_page": 200},
     "system": {"title": "设备使用管理系统"}  # 系统标题配置
 }
 
@@ -61,11 +116,11 @@ print(f"静态文件目录存在: {os.path.exists(static_folder)}")
 app = Flask(__name__, static_folder=static_folder, static_url_path='')
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-print(f"初始化SocketIO...")
+print(f"初始化SocketIO (运行模式: {ASYNC_MODE})...")
 socketio = SocketIO(
     app, 
     cors_allowed_origins="*",
-    async_mode='threading',
+    async_mode=ASYNC_MODE,
     logger=True,
     engineio_logger=True,
     max_http_buffer_size=CONFIG['socketio']['max_http_buffer_size'],
@@ -75,22 +130,53 @@ socketio = SocketIO(
 
 # 创建终端管理器
 print(f"初始化终端管理器...")
-terminal_manager = TerminalManager(socketio)
+# 后台任务池：占用设备时采集登录信息等任务
+background_tasks = BackgroundTaskPool(name='background', **CONFIG.get('background_tasks', {}))
+
+# SSH连接池：终端、登录信息采集和文件上传共用已认证的传输
+ssh_pool = SSHTransportPool(CONFIG.get('ssh_pool', {}))
+terminal_manager = TerminalManager(socketio, CONFIG.get('terminal', {}), ssh_pool=ssh_pool)
+
+# 分块上传管理器
+upload_manager = UploadManager(CONFIG.get('upload', {}))
+
+# 文件/目录下载管理器
+download_manager = DownloadManager(CONFIG.get('download', {}))
 
-# 配置数据库
-db_path = os.path.join(project_root, CONFIG['database']['path'])
-print(f"数据库路径: {db_path}")
-print(f"数据库目录: {os.path.dirname(db_path)}")
-os.makedirs(os.path.dirname(db_path), exist_ok=True)
+def abort_session_transfers(session_id):
+    """终端会话关闭（包括远端断开）时中止其上传、作废其下载凭证"""
+    upload_manager.abort_session(session_id)
+    download_manager.abort_session(session_id)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+terminal_manager.on_close = abort_session_transfers
+
+# 设备状态增量推送
+device_feed = DeviceChangeFeed(socketio, **CONFIG.get('device_feed', {}))
+
+# 记录每个Socket.IO客户端加入的终端房间: sid -> set(session_id)
+client_terminal_rooms = {}
+
+# 配置数据库（database.url 为空时使用 database.path 指定的SQLite文件）
+db_backend = DatabaseBackend(CONFIG, project_root)
+sqlite_tuning = db_backend.sqlite_tuning
+# 审计日志全文索引（SQLite FTS5）和总数缓存
+audit_search = AuditSearch(CONFIG.get('audit_search', {}))
+# 已知的审计日志操作类型（筛选下拉框），记录日志时登记
+action_types = audit_counts.ActionTypeRegistry()
+print(f"数据库: {db_backend.display_url}")
 
 # 初始化数据库
 print(f"初始化数据库...")
 try:
-    db.init_app(app)
-    print(f"✅ 数据库连接初始化成功")
+    db_backend.init_app(app, db)
+    if db_backend.is_sqlite:
+        print(f"✅ SQLite连接参数: journal_mode={sqlite_tuning.settings['journal_mode']}, "
+              f"synchronous={sqlite_tuning.settings['synchronous']}, "
+              f"busy_timeout={sqlite_tuning.settings['busy_timeout_ms']}ms")
+    print(f"✅ 数据库连接初始化成功（连接池: {db_backend.engine_options().get('pool_size', '无')}）")
+    # 记录每张表的变更版本，用于列表接口的ETag
+    table_versions = TableVersions()
+    table_versions.install()
 except Exception as e:
     print(f"❌ 数据库连接初始化失败: {e}")
     import traceback
@@ -98,18 +184,13 @@ except Exception as e:
     sys.exit(1)
 
 # 在数据库初始化后导入模型类（重要！确保模型能被正确注册）
-from models import Device, User, UsageRecord, AllowedUser, AuditLog, QuickCommand
+from models import Device, User, UsageRecord, UsageRecordLoginInfo, AllowedUser, AuditLog, QuickCommand
+from models import DeviceDailyUsage, DeviceHourlyUsage, UserDailyUsage
 
 # 创建数据库表
 print(f"创建数据库表...")
 try:
     with app.app_context():
-        # 确保数据库目录存在
-        db_dir = os.path.dirname(db_path)
-        if db_dir and not os.path.exists(db_dir):
-            os.makedirs(db_dir)
-            print(f"✅ 创建数据库目录: {db_dir}")
-        
         # 导入所有模型以确保它们被注册
         import models
         
@@ -132,6 +213,35 @@ try:
         if missing_tables:
             raise Exception(f"缺少必需的表: {', '.join(missing_tables)}")
         
+        # 登录信息已移到独立的压缩表，旧字段中还有数据说明尚未执行迁移
+        legacy_columns = [c['name'] for c in inspector.get_columns('usage_records')]
+        if 'login_info' in legacy_columns:
+            from sqlalchemy import text
+            legacy = db.session.execute(text(
+                "SELECT 1 FROM usage_records WHERE login_info IS NOT NULL LIMIT 1"
+            )).first()
+            if legacy:
+                print(f"⚠️ usage_records.login_info 中还有未迁移的登录信息，请运行 python3 migrate_db.py")
+        
+        if usage_rollup.needs_rebuild():
+            print(f"⚠️ 使用时长汇总尚未从历史记录生成，请运行 python3 migrate_db.py")
+        
+        # 审计日志全文索引
+        try:
+            fts_state = audit_search.init(db.engine)
+        except Exception as e:
+            fts_state = 'error'
+            print(f"⚠️ 审计日志全文索引不可用，搜索使用 LIKE: {e}")
+        if fts_state in ('ready', 'created'):
+            print(f"✅ 审计日志全文索引已就绪")
+        elif fts_state == 'missing':
+            print(f"⚠️ 审计日志全文索引未建立，搜索使用 LIKE，请运行 python3 migrate_db.py 生成")
+        
+        # 审计日志操作类型和每日计数
+        if audit_counts.needs_rebuild():
+            print(f"⚠️ 审计日志计数尚未从历史日志生成，请运行 python3 migrate_db.py")
+        print(f"✅ 已加载 {action_types.load()} 个审计日志操作类型")
+        
         # 创建默认管理员用户
         print(f"检查管理员用户...")
         admin_username = CONFIG['admin']['username']
@@ -162,21 +272,21 @@ print(f"{'='*40}\n")
 # ==================== 工具函数 ====================
 
 def clean_old_audit_logs():
-    """清理30天前的审计日志"""
+    """按保留策略分批清理过期的审计日志（见 audit_retention.py），返回删除的条数"""
     try:
-        from datetime import timedelta
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        
-        # 删除30天前的审计日志
-        deleted_count = AuditLog.query.filter(
-            AuditLog.created_at < thirty_days_ago
-        ).delete()
-        
-        if deleted_count > 0:
-            db.session.commit()
-            print(f"✅ 已清理 {deleted_count} 条30天前的审计日志")
-        
-        return deleted_count
+        summary = audit_retention.run()
+        if summary is None:
+            print(f"⚠️ 审计日志清理正在进行中，跳过本次")
+            return 0
+        
+        if summary['deleted'] > 0:
+            print(f"✅ 已清理 {summary['deleted']} 条过期审计日志（归档 {summary['archived']} 条），耗时 {summary['seconds']}秒")
+            for rule in summary['rules']:
+                if rule['deleted']:
+                    print(f"   • {rule['action_type']}（保留{rule['days']}天）: {rule['deleted']} 条，"
+                          f"{rule['batches']} 批，单批最长 {rule['max_batch_ms']}ms，耗时 {rule['seconds']}秒")
+        
+        return summary['deleted']
     except Exception as e:
         print(f"❌ 清理审计日志失败: {e}")
         db.session.rollback()
@@ -185,38 +295,63 @@ def clean_old_audit_logs():
 # ==================== 后台任务 ====================
 
 def start_background_tasks():
-    """启动后台定时任务"""
+    """启动后台定时任务（只在实际提供服务的进程中调用一次）"""
     import threading
     import time
     
+    # 设备到期调度
+    expiry_scheduler.start()
+    print(f"✅ 设备到期调度已启动")
+    
+    interval = audit_retention.settings['interval']
+    
     def cleanup_task():
-        """定期清理任务"""
+        """定期清理任务（启动时立即清理一次，分批执行不阻塞服务启动）"""
         while True:
             try:
-                # 每24小时清理一次30天前的审计日志
-                time.sleep(86400)  # 24小时 = 86400秒
                 with app.app_context():
                     clean_old_audit_logs()
             except Exception as e:
                 print(f"❌ 后台清理任务出错: {e}")
+            time.sleep(interval)
     
     # 启动清理线程
     cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
     cleanup_thread.start()
-    print(f"✅ 后台清理任务已启动（每24小时清理30天前的审计日志）")
-    
-    # 应用启动时立即清理一次
-    try:
-        with app.app_context():
-            clean_old_audit_logs()
-    except Exception as e:
-        print(f"❌ 初始清理失败: {e}")
+    print(f"✅ 后台清理任务已启动（每{interval}秒清理过期审计日志: {audit_retention.describe()}）")
+
+    # WAL定期检查点
+    if sqlite_tuning.start_checkpointer():
+        print(f"✅ WAL检查点任务已启动（每{sqlite_tuning.settings['checkpoint_interval']}秒）")
 
 # ==================== 辅助函数 ====================
 
+def conditional_response(tables, build, extra=None):
+    """
+    条件GET：以相关表的变更版本作为强ETag，与 If-None-Match 一致时返回304，不再查询和序列化
+
+    :param tables: 响应内容依赖的表名
+    :param build: 生成完整响应的函数
+    :param extra: 额外参与ETag计算的值（如随时间变化的字段）
+    """
+    # 先取版本号再查询：查询期间发生的提交会让下次请求的ETag不同
+    etag = table_versions.etag(*tables)
+    if extra is not None:
+        etag += f'-{extra}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = app.make_response(build())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag)
+    # 浏览器每次都带上ETag重新验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 def log_audit(action_type, operator, details=None, ip_address=None):
     """
-    记录审计日志
+    记录审计日志（放入缓冲区，由后台线程批量写入，不占用请求的数据库事务）
     
     :param action_type: 操作类型，如 'login', 'device_add', 'device_delete', 'user_add' 等
     :param operator: 操作人
@@ -229,44 +364,133 @@ def log_audit(action_type, operator, details=None, ip_address=None):
         
         details_json = json.dumps(details, ensure_ascii=False) if details else None
         
-        log = AuditLog(
-            action_type=action_type,
-            operator=operator,
-            ip_address=ip_address,
-            details=details_json
-        )
-        db.session.add(log)
-        db.session.commit()
+        action_types.add(action_type)
+        audit_writer.log({
+            'action_type': action_type,
+            'operator': operator,
+            'ip_address': ip_address,
+            'details': details_json,
+            'created_at': datetime.now()  # 以操作发生的时间为准，而不是写入时间
+        })
     except Exception as e:
         print(f"❌ 记录审计日志失败: {e}")
-        db.session.rollback()
 
-def check_and_release_expired_devices():
-    """检查并自动释放过期的设备"""
-    now = datetime.now()
-    expired_devices = Device.query.filter(
-        Device.status == 'occupied',
-        Device.occupy_until < now
-    ).all()
-    
-    for device in expired_devices:
-        device.status = 'available'
-        device.current_user = None
-        device.current_user_account = None
-        device.occupy_duration = 2
-        device.occupy_until = None
-        
-        # 更新使用记录
-        record = UsageRecord.query.filter_by(
-            device_id=device.id,
-            end_time=None
-        ).order_by(UsageRecord.start_time.desc()).first()
+def write_audit_logs(rows):
+    """在一个事务中批量插入审计日志并累加每日计数（由审计日志写入器调用）"""
+    with app.app_context():
+        try:
+            db.session.execute(AuditLog.__table__.insert(), rows)
+            audit_counts.apply(audit_counts.count_rows(rows))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+# 审计日志写入器：按条数或时间窗口攒批写入
+audit_writer = AuditWriter(write_audit_logs, **CONFIG.get('audit', {}))
+
+# 审计日志保留策略：按操作类型的保留天数分批清理
+audit_retention = AuditRetention(CONFIG.get('audit_retention', {}), project_root)
+
+def release_expired_devices(device_ids):
+    """
+    在一个事务中释放已到期的设备（由到期调度器调用）
+
+    :return: 实际释放的设备数量
+    """
+    with app.app_context():
+        now = datetime.now()
+        # 以数据库为准再确认一次：期间可能已被手动释放或重新占用
+        expired_devices = Device.query.filter(
+            Device.id.in_(device_ids),
+            Device.status == 'occupied',
+            Device.occupy_until <= now
+        ).all()
+        if not expired_devices:
+            return 0
+        
+        expired_ids = [d.id for d in expired_devices]
+        for device in expired_devices:
+            device.status = 'available'
+            device.current_user = None
+            device.current_user_account = None
+            device.occupy_duration = 2
+            device.occupy_until = None
+        
+        # 结束这些设备未结束的使用记录，并累加到使用时长汇总
+        usage_rollup.record_closed(usage_rollup.open_records_query().filter(
+            UsageRecord.device_id.in_(expired_ids)
+        ).all(), end=now)
+        UsageRecord.query.filter(
+            UsageRecord.device_id.in_(expired_ids),
+            UsageRecord.end_time.is_(None)
+        ).update({UsageRecord.end_time: now}, synchronize_session=False)
         
-        if record:
-            record.end_time = now
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        print(f"⏰ 已自动释放 {len(expired_devices)} 台到期设备: {', '.join(d.name for d in expired_devices)}")
+        publish_device_changes(expired_devices)
+        return len(expired_devices)
+
+def load_expiry_deadlines():
+    """加载所有占用中设备的到期时间（供到期调度器使用）"""
+    with app.app_context():
+        rows = db.session.query(Device.id, Device.occupy_until).filter(
+            Device.status == 'occupied',
+            Device.occupy_until.isnot(None)
+        ).all()
+        return [(device_id, occupy_until.timestamp()) for device_id, occupy_until in rows]
+
+def serialize_device(d):
+    """设备转为接口/推送使用的字典"""
+    device_data = {
+        'id': d.id,
+        'name': d.name,
+        'ip': d.ip,
+        'username': d.username,
+        'password': d.password,
+        'status': d.status,
+        'current_user': d.current_user,
+        'current_user_account': d.current_user_account,
+        'occupy_duration': d.occupy_duration,
+        'occupy_until': d.occupy_until.strftime('%Y-%m-%d %H:%M:%S') if d.occupy_until else None,
+        'ssh_connections': json.loads(d.ssh_connections) if d.ssh_connections else [],
+        'serial_connections': json.loads(d.serial_connections) if d.serial_connections else [],
+        'tags': json.loads(d.tags) if d.tags else [],
+        'created_at': d.created_at.strftime('%Y-%m-%d %H:%M:%S') if d.created_at else None
+    }
     
-    if expired_devices:
-        db.session.commit()
+    # 计算剩余时间（分钟）
+    if d.occupy_until and d.status == 'occupied':
+        remaining = (d.occupy_until - datetime.now()).total_seconds() / 60
+        device_data['remaining_minutes'] = max(0, int(remaining))
+    else:
+        device_data['remaining_minutes'] = 0
+    return device_data
+
+def publish_device_changes(devices):
+    """提交后推送设备的最新状态"""
+    try:
+        device_feed.publish([('upsert', d.id, serialize_device(d)) for d in devices])
+    except Exception as e:
+        print(f"❌ 推送设备变更失败: {e}")
+
+def publish_device_deletes(device_ids):
+    """提交后推送设备删除"""
+    try:
+        device_feed.publish([('delete', device_id, None) for device_id in device_ids])
+    except Exception as e:
+        print(f"❌ 推送设备变更失败: {e}")
+
+# 设备到期调度：按到期时间自动释放，列表接口只读
+expiry_scheduler = ExpiryScheduler(
+    release_expired_devices,
+    load_expiry_deadlines,
+    **CONFIG.get('expiry', {})
+)
 
 # ==================== 前端路由 ====================
 
@@ -288,6 +512,14 @@ def get_config():
         },
         'device': {
             'max_devices_per_user': CONFIG.get('device', {}).get('max_devices_per_user', 1)  # 获取每个用户最多占用设备数量
+        },
+        'upload': {
+            'default_dir': upload_manager.default_dir,
+            'max_file_size': upload_manager.max_file_size
+        },
+        'socketio': {
+            # 协程模式可承载大量WebSocket连接；开发服务器保持仅长轮询
+            'transports': ['polling', 'websocket'] if ASYNC_MODE != 'threading' else ['polling']
         }
     })
 
@@ -350,14 +582,26 @@ def update_device_limit():
 
 @app.route('/api/audit-logs', methods=['GET'])
 def get_audit_logs():
-    """获取审计日志列表"""
+    """
+    获取审计日志列表（按时间倒序）
+
+    翻页使用上一页返回的 next_cursor（键集分页，深翻页同样只读取一页）；不带 cursor 时仍支持 page 参数。
+    keyword 在操作人和详情中搜索，operator 只匹配操作人，有全文索引时走 FTS5（见 audit_search.py）。
+    总数最多精确计算到 count_limit 条（且有时间上限）并短时缓存，total_relation 为 eq（精确）、gte（至少）或 approx（估算），
+    无法走索引的短关键字筛选不计算总数（total 为 null）。
+    """
+    # 缓冲区中有日志时短暂等待写入，刚发生的操作通常也能查到（不保证，见 audit_writer.py）
+    audit_writer.flush_for_read()
+    
     # 获取分页参数
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 50, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), audit_search.settings['max_per_page'])
+    cursor = request.args.get('cursor', '').strip()
     
     # 获取筛选参数
     action_type = request.args.get('action_type', '').strip()
     operator = request.args.get('operator', '').strip()
+    keyword = request.args.get('keyword', '').strip()
     start_date = request.args.get('start_date', '').strip()
     end_date = request.args.get('end_date', '').strip()
     
@@ -368,11 +612,8 @@ def get_audit_logs():
     if action_type:
         query = query.filter(AuditLog.action_type == action_type)
     
-    # 按操作人筛选
-    if operator:
-        query = query.filter(AuditLog.operator.like(f'%{operator}%'))
-    
     # 按时间范围筛选
+    start_dt = end_dt = None
     if start_date:
         try:
             start_dt = datetime.strptime(start_date, '%Y-%m-%d')
@@ -388,14 +629,34 @@ def get_audit_logs():
         except ValueError:
             pass
     
-    # 按时间倒序排列
-    query = query.order_by(AuditLog.created_at.desc())
+    # 按操作人、关键字筛选
+    query, rowid, countable = audit_search.apply_text_filters(query, operator, keyword)
+    
+    # 按时间倒序排列，同一时间按ID倒序（全文搜索按ID倒序）
+    query = audit_search.order(query, rowid)
+    
+    # 总数（翻页时命中缓存）
+    filtered = bool(action_type or operator or keyword or start_dt or end_dt)
+    total = relation = None
+    if countable:
+        total, relation = audit_search.count(
+            (action_type, operator, keyword, start_dt, end_dt), query, filtered)
+    
+    if cursor:
+        try:
+            query = after_cursor(query, cursor, rowid)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+    elif page > 1:
+        query = query.offset((page - 1) * per_page)
     
-    # 分页
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    # 多取一条判断是否还有下一页
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
     
     logs = []
-    for log in pagination.items:
+    for log in items:
         log_data = {
             'id': log.id,
             'action_type': log.action_type,
@@ -408,23 +669,31 @@ def get_audit_logs():
     
     return jsonify({
         'logs': logs,
-        'total': pagination.total,
+        'total': total,
+        'total_relation': relation,
         'page': page,
         'per_page': per_page,
-        'pages': pagination.pages
+        'pages': (total + per_page - 1) // per_page if total is not None else None,
+        'has_more': has_more,
+        'next_cursor': encode_cursor(items[-1].created_at, items[-1].id) if has_more else None
     })
 
 @app.route('/api/audit-logs/action-types', methods=['GET'])
 def get_action_types():
-    """获取所有操作类型（用于筛选下拉框）"""
-    from sqlalchemy import distinct
-    
-    action_types = db.session.query(distinct(AuditLog.action_type)).all()
-    types = [t[0] for t in action_types if t[0]]
-    
-    return jsonify({
-        'action_types': sorted(types)
-    })
+    """
+    获取所有操作类型（用于筛选下拉框），从内存中的登记表读取
+
+    带 counts=1 或 start_date/end_date（YYYY-MM-DD，含当天）时同时返回时间范围内各类型的日志条数，
+    从每日计数表汇总，不扫描审计日志。
+    """
+    result = {'action_types': action_types.list()}
+    start_dt = parse_date_arg('start_date')
+    end_dt = parse_date_arg('end_date')
+    if request.args.get('counts') in ('1', 'true') or start_dt or end_dt:
+        audit_writer.flush_for_read()
+        result['counts'] = audit_counts.counts_between(
+            start_dt.date() if start_dt else None, end_dt.date() if end_dt else None)
+    return jsonify(result)
 
 @app.route('/api/admin/login', methods=['POST'])
 def admin_login():
@@ -452,70 +721,23 @@ def admin_login():
 
 @app.route('/api/devices', methods=['GET'])
 def get_devices():
-    """获取所有设备列表"""
-    # 检查并释放过期设备
-    check_and_release_expired_devices()
-    
-    devices = Device.query.all()
-    result = []
-    for d in devices:
-        device_data = {
-            'id': d.id,
-            'name': d.name,
-            'ip': d.ip,
-            'username': d.username,
-            'password': d.password,
-            'status': d.status,
-            'current_user': d.current_user,
-            'current_user_account': d.current_user_account,
-            'occupy_duration': d.occupy_duration,
-            'occupy_until': d.occupy_until.strftime('%Y-%m-%d %H:%M:%S') if d.occupy_until else None,
-            'ssh_connections': json.loads(d.ssh_connections) if d.ssh_connections else [],
-            'serial_connections': json.loads(d.serial_connections) if d.serial_connections else [],
-            'tags': json.loads(d.tags) if d.tags else [],
-            'created_at': d.created_at.strftime('%Y-%m-%d %H:%M:%S') if d.created_at else None
-        }
-        
-        # 计算剩余时间（分钟）
-        if d.occupy_until and d.status == 'occupied':
-            remaining = (d.occupy_until - datetime.now()).total_seconds() / 60
-            device_data['remaining_minutes'] = max(0, int(remaining))
-        else:
-            device_data['remaining_minutes'] = 0
-            
-        result.append(device_data)
-    
-    return jsonify(result)
+    """获取所有设备列表（到期释放由后台调度器完成，这里只读）"""
+    def build():
+        # 先读取版本号再查询：查询期间发生的变更版本号更大，客户端仍会应用
+        version = device_feed.current_version()
+        devices = Device.query.all()
+        response = jsonify([serialize_device(d) for d in devices])
+        response.headers['X-Devices-Version'] = version
+        return response
+    
+    # remaining_minutes 随时间变化，ETag按分钟更新
+    return conditional_response(('devices',), build, extra=int(time.time() // 60))
 
 @app.route('/api/devices/<int:device_id>', methods=['GET'])
 def get_device(device_id):
     """获取单个设备信息"""
     device = Device.query.get_or_404(device_id)
-    device_data = {
-        'id': device.id,
-        'name': device.name,
-        'ip': device.ip,
-        'username': device.username,
-        'password': device.password,
-        'status': device.status,
-        'current_user': device.current_user,
-        'current_user_account': device.current_user_account,
-        'occupy_duration': device.occupy_duration,
-        'occupy_until': device.occupy_until.strftime('%Y-%m-%d %H:%M:%S') if device.occupy_until else None,
-        'ssh_connections': json.loads(device.ssh_connections) if device.ssh_connections else [],
-        'serial_connections': json.loads(device.serial_connections) if device.serial_connections else [],
-        'tags': json.loads(device.tags) if device.tags else [],
-        'created_at': device.created_at.strftime('%Y-%m-%d %H:%M:%S') if device.created_at else None
-    }
-    
-    # 计算剩余时间（分钟）
-    if device.occupy_until and device.status == 'occupied':
-        remaining = (device.occupy_until - datetime.now()).total_seconds() / 60
-        device_data['remaining_minutes'] = max(0, int(remaining))
-    else:
-        device_data['remaining_minutes'] = 0
-        
-    return jsonify(device_data)
+    return jsonify(serialize_device(device))
 
 @app.route('/api/devices', methods=['POST'])
 def create_device():
@@ -533,6 +755,7 @@ def create_device():
     )
     db.session.add(device)
     db.session.commit()
+    publish_device_changes([device])
     
     # 记录审计日志
     log_audit('device_add', 'admin', {
@@ -564,6 +787,7 @@ def update_device(device_id):
         device.tags = json.dumps(data.get('tags', []))
     
     db.session.commit()
+    publish_device_changes([device])
     
     # 记录审计日志
     log_audit('device_update', 'admin', {
@@ -582,12 +806,18 @@ def delete_device(device_id):
     device_name = device.name
     device_ip = device.ip
     
-    # 先删除该设备的所有使用记录
+    # 先删除该设备的所有使用记录及其登录信息、使用时长汇总
+    usage_rollup.remove_devices([device_id])
+    UsageRecordLoginInfo.query.filter(UsageRecordLoginInfo.record_id.in_(
+        db.session.query(UsageRecord.id).filter(UsageRecord.device_id == device_id)
+    )).delete(synchronize_session=False)
     UsageRecord.query.filter_by(device_id=device_id).delete()
     
     # 再删除设备
     db.session.delete(device)
     db.session.commit()
+    expiry_scheduler.cancel(device_id)
+    publish_device_deletes([device_id])
     
     # 记录审计日志
     log_audit('device_delete', 'admin', {
@@ -614,14 +844,22 @@ def batch_delete_devices():
         # 获取要删除的设备名称（用于审计日志）
         devices_to_delete = Device.query.filter(Device.id.in_(device_ids)).all()
         device_names = [d.name for d in devices_to_delete]
+        deleted_ids = [d.id for d in devices_to_delete]
         
-        # 先删除这些设备的所有使用记录
+        # 先删除这些设备的所有使用记录及其登录信息、使用时长汇总
+        usage_rollup.remove_devices(deleted_ids)
+        UsageRecordLoginInfo.query.filter(UsageRecordLoginInfo.record_id.in_(
+            db.session.query(UsageRecord.id).filter(UsageRecord.device_id.in_(device_ids))
+        )).delete(synchronize_session=False)
         UsageRecord.query.filter(UsageRecord.device_id.in_(device_ids)).delete(synchronize_session=False)
         
         # 再批量删除设备
         deleted_count = Device.query.filter(Device.id.in_(device_ids)).delete(synchronize_session=False)
         
         db.session.commit()
+        for device_id in deleted_ids:
+            expiry_scheduler.cancel(device_id)
+        publish_device_deletes(deleted_ids)
         
         # 记录审计日志
         log_audit('device_batch_delete', 'admin', {
@@ -638,98 +876,127 @@ def batch_delete_devices():
         db.session.rollback()
         return jsonify({'message': f'删除失败: {str(e)}'}), 500
 
+def get_import_mode(data):
+    """导入模式：skip（默认，已存在的跳过）或 upsert（已存在的更新）"""
+    mode = str(data.get('mode') or 'skip').strip().lower()
+    if mode not in ('skip', 'upsert'):
+        raise ValueError('mode 只能是 skip 或 upsert')
+    return mode
+
+def build_device_import_row(item):
+    """
+    校验一条导入的设备数据
+
+    :return: (设备名称, 插入时的字段, 更新时的字段)，更新时只覆盖导入数据中提供的字段
+    """
+    name = str(item.get('name') or '').strip()
+    if not name:
+        raise ImportRowError('设备数据不完整（缺少名称）')
+    
+    update_values = {}
+    if 'connections' in item:
+        # 所有连接都存储在ssh_connections中，第一个IP作为主IP（用于旧的ip字段）
+        connections = item.get('connections') or []
+        if not isinstance(connections, list) or not all(isinstance(c, dict) for c in connections):
+            raise ImportRowError('连接信息格式错误')
+        primary_ip = next((c.get('ip') for c in connections if c.get('ip')), '')
+        update_values['ip'] = primary_ip or 'Unknown'
+        update_values['ssh_connections'] = json.dumps(connections)
+    for field in ('username', 'password'):
+        if field in item:
+            update_values[field] = str(item.get(field) or '')
+    if 'tags' in item:
+        tags = item.get('tags') or []
+        if not isinstance(tags, list):
+            raise ImportRowError('标签格式错误')
+        update_values['tags'] = json.dumps(tags)
+    
+    insert_values = {
+        'name': name,
+        'ip': 'Unknown',
+        'username': '',
+        'password': '',
+        'ssh_connections': json.dumps([]),
+        'serial_connections': json.dumps([]),  # 不再使用，保留空数组以兼容
+        'tags': json.dumps([]),
+        'status': 'available'
+    }
+    insert_values.update(update_values)
+    return name, insert_values, update_values
+
 @app.route('/api/devices/batch-import', methods=['POST'])
 def batch_import_devices():
-    """批量导入设备"""
-    data = request.json
+    """
+    批量导入设备（按设备名称判断是否已存在）
+
+    mode=skip（默认）跳过已存在的设备，mode=upsert 用导入数据更新已存在的设备；
+    导入数据内部重复、数据不完整的行逐行报告错误，不影响其他行（见 bulk_import.py）。
+    """
+    data = request.json or {}
     devices_data = data.get('devices', [])
     
     if not devices_data:
         return jsonify({'message': '没有要导入的设备数据'}), 400
-    
-    success_count = 0
-    fail_count = 0
-    error_messages = []
-    
-    for device_data in devices_data:
-        try:
-            name = device_data.get('name', '').strip()
-            
-            if not name:
-                fail_count += 1
-                error_messages.append(f'设备数据不完整（缺少名称）')
-                continue
-            
-            # 检查设备名称是否已存在
-            existing = Device.query.filter_by(name=name).first()
-            if existing:
-                fail_count += 1
-                error_messages.append(f'设备 {name} 已存在')
-                continue
-            
-            # 处理连接信息 - 所有连接都存储在ssh_connections中
-            connections = device_data.get('connections', [])
-            
-            # 从connections中提取第一个IP作为主IP（用于旧的ip字段）
-            primary_ip = ''
-            for conn in connections:
-                if not primary_ip and conn.get('ip'):
-                    primary_ip = conn.get('ip')
-            
-            device = Device(
-                name=name,
-                ip=primary_ip or 'Unknown',  # 使用第一个IP，或默认值
-                username=device_data.get('username', ''),
-                password=device_data.get('password', ''),
-                ssh_connections=json.dumps(connections),  # 所有连接都存在这里
-                serial_connections=json.dumps([]),  # 不再使用，保留空数组以兼容
-                tags=json.dumps(device_data.get('tags', [])),
-                status='available'
-            )
-            
-            db.session.add(device)
-            success_count += 1
-            
-        except Exception as e:
-            fail_count += 1
-            error_messages.append(f'设备导入失败: {str(e)}')
+    try:
+        mode = get_import_mode(data)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    settings = CONFIG.get('bulk_import', {})
+    if not isinstance(devices_data, list) or len(devices_data) > settings.get('max_rows', 50000):
+        return jsonify({'message': f"一次最多导入 {settings.get('max_rows', 50000)} 条设备数据"}), 400
     
     try:
-        db.session.commit()
-        
-        # 记录审计日志
-        log_audit('device_batch_import', 'admin', {
-            'imported_count': success_count,
-            'failed_count': fail_count,
-            'total_count': len(devices_data)
-        })
-        
+        result = bulk_import(Device, 'name', devices_data, build_device_import_row,
+                             upsert=(mode == 'upsert'), chunk_size=settings.get('chunk_size', 1000))
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'数据库提交失败: {str(e)}'}), 500
     
-    return jsonify({
-        'message': '批量导入完成',
-        'imported_count': success_count,
-        'failed_count': fail_count,
-        'errors': error_messages[:10]  # 只返回前10条错误信息
+    # 推送新增和更新的设备
+    names = result.inserted + result.updated
+    changed = []
+    for i in range(0, len(names), 500):
+        changed.extend(Device.query.filter(Device.name.in_(names[i:i + 500])).all())
+    publish_device_changes(changed)
+    
+    # 记录审计日志
+    log_audit('device_batch_import', 'admin', {
+        'mode': mode,
+        'imported_count': len(result.inserted),
+        'updated_count': len(result.updated),
+        'failed_count': len(result.errors),
+        'total_count': len(devices_data)
     })
+    
+    return jsonify(dict(
+        result.to_dict(),
+        message='批量导入完成',
+        imported_count=len(result.inserted),
+        errors=result.error_messages(10)  # 只返回前10条错误信息
+    ))
 
 # ==================== 设备占用 API ====================
 
-def get_linux_login_info(device):
-    """通过SSH获取Linux登录信息"""
+# 登录信息采集完成前使用记录中的占位文本
+LOGIN_INFO_PENDING = '正在后台获取登录信息...'
+
+def probe_linux_login_info(device):
+    """
+    通过SSH采集Linux登录信息（复用SSH连接池中的传输，所有命令一次执行）
+    
+    :return: (采集结果, 错误信息)，成功时错误信息为None
+    """
     import paramiko
     import socket
     
     # 如果设备没有配置SSH连接信息，返回提示信息
     if not device.ssh_connections:
-        return "该设备未配置SSH连接信息，无法获取登录信息"
+        return None, "该设备未配置SSH连接信息，无法获取登录信息"
     
     try:
         ssh_connections = json.loads(device.ssh_connections)
         if not ssh_connections:
-            return "该设备未配置SSH连接信息，无法获取登录信息"
+            return None, "该设备未配置SSH连接信息，无法获取登录信息"
         
         # 使用第一个SSH连接配置
         ssh_conn = ssh_connections[0]
@@ -739,96 +1006,120 @@ def get_linux_login_info(device):
         password = device.password
         
         if not all([host, username, password]):
-            return f"SSH连接配置不完整 (host={host}, port={port}, username={'已配置' if username else '未配置'}, password={'已配置' if password else '未配置'})"
-        
-        # 创建SSH客户端
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            return None, f"SSH连接配置不完整 (host={host}, port={port}, username={'已配置' if username else '未配置'}, password={'已配置' if password else '未配置'})"
         
         print(f"[DEBUG] 尝试SSH连接: {username}@{host}:{port}")
         
         # 连接超时设置为5秒
-        ssh.connect(
-            hostname=host,
-            port=port,
-            username=username,
-            password=password,
-            timeout=5,
-            banner_timeout=5,
-            auth_timeout=5
-        )
-        
-        print(f"[DEBUG] SSH连接成功，开始获取登录信息")
-        
-        # 1. 执行who命令获取当前登录用户
-        stdin, stdout, stderr = ssh.exec_command('who')
-        who_output = stdout.read().decode('utf-8', errors='ignore').strip()
-        
-        # 2. 执行w命令获取详细信息
-        stdin, stdout, stderr = ssh.exec_command('w')
-        w_output = stdout.read().decode('utf-8', errors='ignore').strip()
-        
-        # 3. 执行last -n 30命令获取最近30次登录历史（包含IP地址）
-        stdin, stdout, stderr = ssh.exec_command('last -n 30 -a')
-        last_output = stdout.read().decode('utf-8', errors='ignore').strip()
-        
-        # 4. 执行lastlog命令获取所有用户的最后登录信息
-        stdin, stdout, stderr = ssh.exec_command('lastlog | head -n 50')
-        lastlog_output = stdout.read().decode('utf-8', errors='ignore').strip()
-        
-        # 5. 执行who -a命令获取更详细的当前登录信息
-        stdin, stdout, stderr = ssh.exec_command('who -a')
-        who_a_output = stdout.read().decode('utf-8', errors='ignore').strip()
-        
-        # 关闭连接
-        ssh.close()
-        
-        print(f"[DEBUG] 成功执行所有命令，组合结果")
-        
-        # 组合信息
-        login_info_parts = []
-        
-        if who_output:
-            login_info_parts.append(f"=== 当前登录用户 (who) ===\n{who_output}")
-        
-        if who_a_output:
-            login_info_parts.append(f"\n=== 详细当前登录 (who -a) ===\n{who_a_output}")
-        
-        if w_output:
-            login_info_parts.append(f"\n=== 用户活动信息 (w) ===\n{w_output}")
-        
-        if last_output:
-            login_info_parts.append(f"\n=== 最近30次登录历史 (last -n 30 -a) ===\n{last_output}")
-        
-        if lastlog_output:
-            login_info_parts.append(f"\n=== 用户最后登录信息 (lastlog) ===\n{lastlog_output}")
-        
-        login_info = '\n'.join(login_info_parts) if login_info_parts else "未获取到登录信息（所有命令输出为空）"
-        print(f"[DEBUG] 登录信息长度: {len(login_info)} 字符")
-        return login_info
+        timeout = CONFIG.get('login_probe', {}).get('timeout', 15)
+        lease = ssh_pool.acquire(host, port, username, password, timeout=5)
+        try:
+            print(f"[DEBUG] SSH连接成功，开始获取登录信息")
+            # 池中的传输可能已满或已失效，换一条传输重试一次（采集命令只读，重试无副作用）
+            for attempt in range(2):
+                try:
+                    probe = run_probe(lease, timeout=timeout)
+                    break
+                except paramiko.ChannelException:
+                    # 共享传输上的会话数已达服务端上限（MaxSessions）
+                    lease.mark_full()
+                    lease.release()
+                    if attempt:
+                        raise
+                except (paramiko.SSHException, EOFError):
+                    # 传输已断开，从连接池中移除
+                    lease.discard()
+                    if attempt:
+                        raise
+                lease = ssh_pool.acquire(host, port, username, password, timeout=5)
+        finally:
+            lease.release()
+        
+        timings = ', '.join(f"{r['name']}={r['duration_ms']}ms/{r['status']}" for r in probe['results'])
+        print(f"[DEBUG] 登录信息采集完成，共 {probe['elapsed_ms']}ms: {timings}")
+        return probe, None
         
     except paramiko.AuthenticationException as e:
         error_msg = f"SSH认证失败 (用户名或密码错误): {str(e)}"
         print(f"[ERROR] {error_msg}")
-        return error_msg
+        return None, error_msg
     except socket.timeout as e:
         error_msg = f"SSH连接超时 (无法连接到 {host}:{port}): {str(e)}"
         print(f"[ERROR] {error_msg}")
-        return error_msg
+        return None, error_msg
     except (paramiko.SSHException, socket.error) as e:
         error_msg = f"SSH连接失败: {str(e)}"
         print(f"[ERROR] {error_msg}")
-        return error_msg
+        return None, error_msg
     except Exception as e:
         error_msg = f"获取登录信息时发生错误: {type(e).__name__}: {str(e)}"
         print(f"[ERROR] {error_msg}")
+        return None, error_msg
+
+def get_linux_login_info(device):
+    """通过SSH获取Linux登录信息（组合为文本保存到使用记录）"""
+    probe, error_msg = probe_linux_login_info(device)
+    if probe is None:
         return error_msg
+    
+    login_info = format_login_info(probe)
+    print(f"[DEBUG] 登录信息长度: {len(login_info)} 字符")
+    return login_info
+
+@app.route('/api/devices/<int:device_id>/login-probe', methods=['GET'])
+def probe_device_login_info(device_id):
+    """实时采集设备登录信息，返回每个命令的输出和耗时"""
+    device = Device.query.get_or_404(device_id)
+    probe, error_msg = probe_linux_login_info(device)
+    if probe is None:
+        return jsonify({'message': error_msg}), 502
+    return jsonify(probe)
+
+def pending_login_snapshots(device_id):
+    """该设备所有仍在等待登录信息的使用记录快照"""
+    return UsageRecordLoginInfo.query.join(
+        UsageRecord, UsageRecord.id == UsageRecordLoginInfo.record_id
+    ).filter(
+        UsageRecord.device_id == device_id,
+        UsageRecordLoginInfo.pending == True
+    ).all()
+
+def fetch_login_info_task(device_id):
+    """后台任务：获取设备登录信息，更新该设备所有等待登录信息的使用记录"""
+    with app.app_context():
+        try:
+            device = Device.query.get(device_id)
+            if not device:
+                print(f"[WARN] 未找到设备 {device_id}")
+                return
+            
+            print(f"[DEBUG] 开始异步获取设备 {device_id} 的登录信息")
+            login_info = get_linux_login_info(device)
+            print(f"[DEBUG] 登录信息获取结果: {login_info[:200] if login_info else 'None'}...")
+            
+            # 更新使用记录的登录信息快照
+            snapshots = pending_login_snapshots(device_id)
+            for snapshot in snapshots:
+                snapshot.text = login_info
+                snapshot.pending = False
+            db.session.commit()
+            print(f"[DEBUG] 登录信息已更新到 {len(snapshots)} 条记录")
+        except Exception as e:
+            print(f"[ERROR] 异步获取登录信息失败: {type(e).__name__}: {str(e)}")
+            db.session.rollback()
+            # 更新为错误信息
+            try:
+                for snapshot in pending_login_snapshots(device_id):
+                    snapshot.text = f"获取登录信息失败: {str(e)}"
+                    snapshot.pending = False
+                db.session.commit()
+            except Exception as e2:
+                print(f"[ERROR] 更新错误信息失败: {e2}")
 
 @app.route('/api/devices/<int:device_id>/occupy', methods=['POST'])
 def occupy_device(device_id):
     """占用设备"""
     from datetime import timedelta
-    import threading
     
     device = Device.query.get_or_404(device_id)
     
@@ -876,53 +1167,28 @@ def occupy_device(device_id):
     device.occupy_duration = duration
     device.occupy_until = datetime.now() + timedelta(hours=duration)
     
-    # 创建使用记录（先不设置登录信息）
+    # 创建使用记录（登录信息由后台任务采集后写入快照）
     record = UsageRecord(
         device_id=device_id,
         user_name=user_name,
         user_account=user_account,
         purpose=purpose,
-        start_time=datetime.now(),
-        login_info='正在后台获取登录信息...'
+        start_time=datetime.now()
     )
     
     db.session.add(record)
+    db.session.flush()
+    snapshot = UsageRecordLoginInfo(record_id=record.id, pending=True)
+    db.session.add(snapshot)
     db.session.commit()
+    expiry_scheduler.schedule(device.id, device.occupy_until.timestamp())
+    publish_device_changes([device])
     
-    record_id = record.id
-    
-    # 异步获取登录信息
-    def fetch_login_info_async():
-        """后台异步获取登录信息"""
-        with app.app_context():
-            try:
-                print(f"[DEBUG] 开始异步获取设备 {device_id} 的登录信息")
-                login_info = get_linux_login_info(device)
-                print(f"[DEBUG] 登录信息获取结果: {login_info[:200] if login_info else 'None'}...")
-                
-                # 更新使用记录
-                record = UsageRecord.query.get(record_id)
-                if record:
-                    record.login_info = login_info
-                    db.session.commit()
-                    print(f"[DEBUG] 登录信息已更新到记录 {record_id}")
-                else:
-                    print(f"[WARN] 未找到记录 {record_id}")
-            except Exception as e:
-                print(f"[ERROR] 异步获取登录信息失败: {type(e).__name__}: {str(e)}")
-                # 更新为错误信息
-                try:
-                    record = UsageRecord.query.get(record_id)
-                    if record:
-                        record.login_info = f"获取登录信息失败: {str(e)}"
-                        db.session.commit()
-                except Exception as e2:
-                    print(f"[ERROR] 更新错误信息失败: {e2}")
-    
-    # 启动后台线程获取登录信息
-    thread = threading.Thread(target=fetch_login_info_async)
-    thread.daemon = True
-    thread.start()
+    # 交给后台任务池获取登录信息，同一设备不会并发采集
+    if not background_tasks.submit(fetch_login_info_task, device_id, key=('login_info', device_id)):
+        snapshot.text = '后台任务繁忙，未获取登录信息'
+        snapshot.pending = False
+        db.session.commit()
     
     return jsonify({
         'message': '设备占用成功',
@@ -953,91 +1219,270 @@ def release_device(device_id):
     
     if record:
         record.end_time = datetime.now()
+        usage_rollup.record_closed([record])
     
     db.session.commit()
+    expiry_scheduler.cancel(device_id)
+    publish_device_changes([device])
     
     return jsonify({'message': '设备释放成功'})
 
 # ==================== 使用记录 API ====================
 
+# 使用记录列表每页默认条数与上限
+RECORDS_PAGE_SIZE = 50
+RECORDS_MAX_PAGE_SIZE = 500
+
+def record_sort_keys():
+    """
+    使用记录可排序的字段 -> (排序表达式, 游标值类型)
+    排序表达式都不为NULL，保证 (排序值, id) 的键集比较在各行之间是全序的
+    """
+    return {
+        'start_time': (UsageRecord.start_time, 'datetime'),
+        # 使用中的记录没有结束时间，按最晚处理
+        'end_time': (db.func.coalesce(UsageRecord.end_time, datetime(9999, 12, 31)), 'datetime'),
+        # 时长取整到秒，避免浮点误差让相同时长的记录比较结果不稳定
+        'duration': (db.func.coalesce(db.func.round(
+            seconds_between(UsageRecord.start_time, UsageRecord.end_time)
+        ), 0.0), 'float'),
+        'device_name': (db.func.coalesce(Device.name, ''), 'str'),
+        'user_name': (db.func.coalesce(UsageRecord.user_name, ''), 'str')
+    }
+
+def encode_records_cursor(sort_by, order, value, record_id):
+    """把最后一条记录的 (排序值, id) 编码为下一页的游标"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort_by, order, value, record_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_records_cursor(cursor, sort_by, order, value_type):
+    """解析游标，排序方式与游标不一致或格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, cursor_order, value, record_id = json.loads(raw)
+        if value_type == 'datetime':
+            value = datetime.fromisoformat(value)
+        elif value_type == 'float':
+            value = float(value)
+        record_id = int(record_id)
+    except Exception:
+        raise ValueError('无效的分页游标')
+    if (cursor_sort, cursor_order) != (sort_by, order):
+        raise ValueError('分页游标与排序方式不一致')
+    return value, record_id
+
+def parse_date_arg(name):
+    """解析 YYYY-MM-DD 格式的日期参数，格式错误时忽略"""
+    value = request.args.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+
+def query_records_page(device_id=None):
+    """
+    按请求参数查询一页使用记录（键集分页）
+
+    参数: limit, cursor, sort_by, order, device_id, user_account, start_date, end_date（按开始时间），
+    purpose（使用目的包含的文本）, q（在使用目的、使用人、账号和设备名称中搜索）
+    设备名称通过外连接一次取出；登录信息不在列表中返回，只标记是否存在。
+    """
+    limit = request.args.get('limit', RECORDS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit or RECORDS_PAGE_SIZE, RECORDS_MAX_PAGE_SIZE))
+    sort_by = request.args.get('sort_by', 'start_time')
+    order = 'asc' if request.args.get('order') == 'asc' else 'desc'
+    sort_keys = record_sort_keys()
+    if sort_by not in sort_keys:
+        raise ValueError(f'不支持的排序字段: {sort_by}')
+    sort_key, value_type = sort_keys[sort_by]
+
+    query = db.session.query(
+        UsageRecord.id,
+        UsageRecord.device_id,
+        Device.name.label('device_name'),
+        UsageRecord.user_name,
+        UsageRecord.user_account,
+        UsageRecord.purpose,
+        UsageRecord.start_time,
+        UsageRecord.end_time,
+        UsageRecordLoginInfo.record_id.isnot(None).label('has_login_info'),
+        sort_key.label('sort_value')
+    ).outerjoin(
+        Device, Device.id == UsageRecord.device_id
+    ).outerjoin(
+        UsageRecordLoginInfo, UsageRecordLoginInfo.record_id == UsageRecord.id
+    )
+
+    if device_id is None:
+        device_id = request.args.get('device_id', type=int)
+    if device_id is not None:
+        query = query.filter(UsageRecord.device_id == device_id)
+
+    user_account = request.args.get('user_account', '').strip()
+    if user_account:
+        query = query.filter(UsageRecord.user_account == user_account)
+
+    start_dt = parse_date_arg('start_date')
+    if start_dt:
+        query = query.filter(UsageRecord.start_time >= start_dt)
+    end_dt = parse_date_arg('end_date')
+    if end_dt:
+        from datetime import timedelta
+        query = query.filter(UsageRecord.start_time < end_dt + timedelta(days=1))
+
+    purpose = request.args.get('purpose', '').strip()
+    if purpose:
+        query = query.filter(UsageRecord.purpose.contains(purpose, autoescape=True))
+
+    keyword = request.args.get('q', '').strip()
+    if keyword:
+        query = query.filter(db.or_(
+            UsageRecord.purpose.contains(keyword, autoescape=True),
+            UsageRecord.user_name.contains(keyword, autoescape=True),
+            UsageRecord.user_account.contains(keyword, autoescape=True),
+            Device.name.contains(keyword, autoescape=True)
+        ))
+
+    cursor = request.args.get('cursor', '').strip()
+    if cursor:
+        value, last_id = decode_records_cursor(cursor, sort_by, order, value_type)
+        if order == 'desc':
+            query = query.filter(db.or_(sort_key < value, db.and_(sort_key == value, UsageRecord.id < last_id)))
+        else:
+            query = query.filter(db.or_(sort_key > value, db.and_(sort_key == value, UsageRecord.id > last_id)))
+
+    if order == 'desc':
+        query = query.order_by(sort_key.desc(), UsageRecord.id.desc())
+    else:
+        query = query.order_by(sort_key.asc(), UsageRecord.id.asc())
+
+    # 多取一条判断是否还有下一页
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    records = []
+    for r in rows:
+        duration = 0.00
+        if r.end_time and r.start_time:
+            duration = max(0.00, round((r.end_time - r.start_time).total_seconds() / 3600, 2))
+        records.append({
+            'id': r.id,
+            'device_id': r.device_id,
+            'device_name': r.device_name,
+            'user_name': r.user_name,
+            'user_account': r.user_account,
+            'purpose': r.purpose,
+            'start_time': r.start_time.strftime('%Y-%m-%d %H:%M:%S') if r.start_time else None,
+            'end_time': r.end_time.strftime('%Y-%m-%d %H:%M:%S') if r.end_time else None,
+            'duration': duration,
+            'has_login_info': bool(r.has_login_info)
+        })
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_records_cursor(sort_by, order, last.sort_value, last.id)
+
+    return {
+        'records': records,
+        'next_cursor': next_cursor,
+        'has_more': has_more,
+        'limit': limit,
+        'sort_by': sort_by,
+        'order': order
+    }
+
 @app.route('/api/records', methods=['GET'])
 def get_records():
-    """获取所有使用记录"""
-    records = UsageRecord.query.order_by(UsageRecord.start_time.desc()).all()
-    return jsonify([{
-        'id': r.id,
-        'device_id': r.device_id,
-        'device_name': r.device.name if r.device else None,
-        'user_name': r.user_name,
-        'user_account': r.user_account,
-        'purpose': r.purpose,
-        'start_time': r.start_time.strftime('%Y-%m-%d %H:%M:%S') if r.start_time else None,
-        'end_time': r.end_time.strftime('%Y-%m-%d %H:%M:%S') if r.end_time else None,
-        'duration': r.get_duration(),
-        'login_info': r.login_info
-    } for r in records])
+    """获取使用记录（分页、筛选、排序）"""
+    def build():
+        try:
+            return jsonify(query_records_page())
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+    
+    return conditional_response(('usage_records', 'devices'), build)
 
 @app.route('/api/records/<int:device_id>', methods=['GET'])
 def get_device_records(device_id):
-    """获取指定设备的使用记录"""
-    records = UsageRecord.query.filter_by(device_id=device_id).order_by(UsageRecord.start_time.desc()).all()
-    return jsonify([{
-        'id': r.id,
-        'device_id': r.device_id,
-        'device_name': r.device.name if r.device else None,
-        'user_name': r.user_name,
-        'user_account': r.user_account,
-        'purpose': r.purpose,
-        'start_time': r.start_time.strftime('%Y-%m-%d %H:%M:%S') if r.start_time else None,
-        'end_time': r.end_time.strftime('%Y-%m-%d %H:%M:%S') if r.end_time else None,
-        'duration': r.get_duration(),
-        'login_info': r.login_info
-    } for r in records])
+    """获取指定设备的使用记录（分页参数同 /api/records）"""
+    def build():
+        try:
+            return jsonify(query_records_page(device_id=device_id))
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+    
+    return conditional_response(('usage_records', 'devices'), build)
+
+@app.route('/api/records/<int:record_id>/login-info', methods=['GET'])
+def get_record_login_info(record_id):
+    """按需获取单条使用记录的登录信息"""
+    snapshot = UsageRecordLoginInfo.query.get(record_id)
+    if not snapshot:
+        if not db.session.query(UsageRecord.id).filter(UsageRecord.id == record_id).first():
+            return jsonify({'message': '记录不存在'}), 404
+        return jsonify({'id': record_id, 'login_info': None})
+    login_info = LOGIN_INFO_PENDING if snapshot.pending else snapshot.text
+    return jsonify({'id': record_id, 'login_info': login_info})
 
 # ==================== 报表统计 API ====================
 
 @app.route('/api/statistics', methods=['GET'])
 def get_statistics():
-    """获取统计数据"""
+    """获取统计数据（排行支持 start_date、end_date、department 筛选）"""
     total_devices = Device.query.count()
     available_devices = Device.query.filter_by(status='available').count()
     occupied_devices = Device.query.filter_by(status='occupied').count()
     total_records = UsageRecord.query.count()
     
+    # 排行的筛选条件：开始时间范围（YYYY-MM-DD）和部门（按使用人账号关联授权用户）
+    filters = []
+    start_dt = parse_date_arg('start_date')
+    if start_dt:
+        filters.append(UsageRecord.start_time >= start_dt)
+    end_dt = parse_date_arg('end_date')
+    if end_dt:
+        from datetime import timedelta
+        filters.append(UsageRecord.start_time < end_dt + timedelta(days=1))
+    department = request.args.get('department', '').strip()
+    if department:
+        filters.append(UsageRecord.user_account.in_(
+            db.session.query(AllowedUser.account).filter(AllowedUser.department == department)
+        ))
+    
     # 获取设备使用排行
     device_usage = db.session.query(
         Device.name,
         db.func.count(UsageRecord.id).label('usage_count')
-    ).join(UsageRecord).group_by(Device.id).order_by(db.desc('usage_count')).limit(10).all()
-    
-    # 获取使用人时长排行（统计所有记录，但只计算已结束记录的时长）
-    # 获取所有记录
-    all_records = UsageRecord.query.filter(
-        UsageRecord.user_name.isnot(None)
-    ).all()
-    
-    # 计算每个用户的总时长和使用次数
-    user_stats = {}
-    for record in all_records:
-        if record.user_name not in user_stats:
-            user_stats[record.user_name] = {'total_hours': 0, 'usage_count': 0}
-        
-        # 所有记录都算入使用次数
-        user_stats[record.user_name]['usage_count'] += 1
-        
-        # 只有已结束的记录才计算时长
-        if record.end_time:
-            duration = record.get_duration()
-            if duration:
-                user_stats[record.user_name]['total_hours'] += duration
-    
-    # 排序并取前10
-    user_duration_list = [
-        {'user_name': name, 'total_hours': round(stats['total_hours'], 2), 'usage_count': stats['usage_count']}
-        for name, stats in user_stats.items()
+    ).join(UsageRecord).filter(*filters).group_by(Device.id).order_by(db.desc('usage_count')).limit(10).all()
+    
+    # 获取使用人时长排行（在数据库中分组汇总）：所有记录都算入使用次数，只有已结束的记录计算时长；
+    # 按秒累加（单条不小于0）后再换算为小时，避免逐条取两位小数累积误差
+    elapsed = seconds_between(UsageRecord.start_time, UsageRecord.end_time)
+    record_seconds = db.case((elapsed > 0, elapsed), else_=0)
+    total_hours = (db.func.sum(
+        db.case((UsageRecord.end_time.isnot(None), record_seconds), else_=0)
+    ) / 3600).label('total_hours')
+    user_rows = db.session.query(
+        UsageRecord.user_name,
+        total_hours,
+        db.func.count(UsageRecord.id).label('usage_count')
+    ).filter(
+        UsageRecord.user_name.isnot(None), *filters
+    ).group_by(UsageRecord.user_name).order_by(db.desc('total_hours')).limit(10).all()
+    user_duration_ranking = [
+        {'user_name': row.user_name, 'total_hours': round(row.total_hours or 0, 2), 'usage_count': row.usage_count}
+        for row in user_rows
     ]
-    user_duration_list.sort(key=lambda x: x['total_hours'], reverse=True)
-    user_duration_ranking = user_duration_list[:10]
+    
+    departments = [row[0] for row in db.session.query(AllowedUser.department).filter(
+        AllowedUser.department.isnot(None), AllowedUser.department != ''
+    ).distinct().order_by(AllowedUser.department)]
     
     return jsonify({
         'total_devices': total_devices,
@@ -1045,7 +1490,135 @@ def get_statistics():
         'occupied_devices': occupied_devices,
         'total_records': total_records,
         'device_usage_ranking': [{'device_name': d[0], 'usage_count': d[1]} for d in device_usage],
-        'user_duration_ranking': user_duration_ranking
+        'user_duration_ranking': user_duration_ranking,
+        'departments': departments
+    })
+
+def rollup_date_range():
+    """汇总统计的日期范围（YYYY-MM-DD，含首尾），默认最近30天"""
+    from datetime import timedelta
+    end_dt = parse_date_arg('end_date') or datetime.now()
+    start_dt = parse_date_arg('start_date') or (end_dt - timedelta(days=29))
+    return start_dt.date(), end_dt.date()
+
+@app.route('/api/statistics/device-usage', methods=['GET'])
+def get_device_usage_statistics():
+    """设备使用汇总：每台设备每天的使用时长和区间利用率（读取汇总表，合并未结束的记录）"""
+    start_day, end_day = rollup_date_range()
+    if end_day < start_day:
+        return jsonify({'message': '结束日期不能早于开始日期'}), 400
+    device_id = request.args.get('device_id', type=int)
+    
+    query = DeviceDailyUsage.query.filter(DeviceDailyUsage.day >= start_day, DeviceDailyUsage.day <= end_day)
+    if device_id is not None:
+        query = query.filter(DeviceDailyUsage.device_id == device_id)
+    daily = {(row.device_id, row.day): [row.seconds, row.sessions] for row in query}
+    
+    live = usage_rollup.open_contributions(datetime.now(), device_id)
+    for key, (seconds, sessions) in live.device_daily.items():
+        if start_day <= key[1] <= end_day:
+            item = daily.setdefault(key, [0.0, 0])
+            item[0] += seconds
+            item[1] += sessions
+    
+    names = dict(db.session.query(Device.id, Device.name))
+    days = (end_day - start_day).days + 1
+    devices = {}
+    for (dev_id, day), (seconds, sessions) in sorted(daily.items(), key=lambda kv: kv[0][1]):
+        if dev_id not in names:
+            continue
+        item = devices.setdefault(dev_id, {
+            'device_id': dev_id, 'device_name': names[dev_id], 'hours': 0.0, 'sessions': 0, 'daily': []
+        })
+        item['hours'] += seconds / 3600
+        item['sessions'] += sessions
+        item['daily'].append({'date': day.isoformat(), 'hours': round(seconds / 3600, 2), 'sessions': sessions})
+    
+    result = sorted(devices.values(), key=lambda d: d['hours'], reverse=True)
+    for item in result:
+        item['utilization'] = round(item['hours'] / (days * 24) * 100, 1)
+        item['hours'] = round(item['hours'], 2)
+    return jsonify({
+        'start_date': start_day.isoformat(),
+        'end_date': end_day.isoformat(),
+        'days': days,
+        'devices': result
+    })
+
+@app.route('/api/statistics/hourly-usage', methods=['GET'])
+def get_hourly_usage_statistics():
+    """按一天中的小时（0-23）汇总设备使用时长和利用率"""
+    start_day, end_day = rollup_date_range()
+    if end_day < start_day:
+        return jsonify({'message': '结束日期不能早于开始日期'}), 400
+    device_id = request.args.get('device_id', type=int)
+    
+    query = db.session.query(
+        DeviceHourlyUsage.hour, db.func.sum(DeviceHourlyUsage.seconds)
+    ).filter(DeviceHourlyUsage.day >= start_day, DeviceHourlyUsage.day <= end_day)
+    if device_id is not None:
+        query = query.filter(DeviceHourlyUsage.device_id == device_id)
+    hourly = [0.0] * 24
+    for hour, seconds in query.group_by(DeviceHourlyUsage.hour):
+        hourly[hour] += seconds or 0
+    
+    live = usage_rollup.open_contributions(datetime.now(), device_id)
+    for (_, day, hour), seconds in live.device_hourly.items():
+        if start_day <= day <= end_day:
+            hourly[hour] += seconds
+    
+    days = (end_day - start_day).days + 1
+    device_count = 1 if device_id is not None else max(1, Device.query.count())
+    capacity = days * device_count * 3600
+    return jsonify({
+        'start_date': start_day.isoformat(),
+        'end_date': end_day.isoformat(),
+        'days': days,
+        'hours': [{
+            'hour': hour,
+            'hours': round(seconds / 3600, 2),
+            'utilization': round(seconds / capacity * 100, 1)
+        } for hour, seconds in enumerate(hourly)]
+    })
+
+@app.route('/api/statistics/department-usage', methods=['GET'])
+def get_department_usage_statistics():
+    """按部门汇总使用时长、使用次数和使用人数（部门取授权用户当前的部门）"""
+    start_day, end_day = rollup_date_range()
+    if end_day < start_day:
+        return jsonify({'message': '结束日期不能早于开始日期'}), 400
+    
+    users = {}
+    for key, seconds, sessions in db.session.query(
+        UserDailyUsage.user_key, db.func.sum(UserDailyUsage.seconds), db.func.sum(UserDailyUsage.sessions)
+    ).filter(UserDailyUsage.day >= start_day, UserDailyUsage.day <= end_day).group_by(UserDailyUsage.user_key):
+        users[key] = [seconds or 0, sessions or 0]
+    
+    live = usage_rollup.open_contributions(datetime.now())
+    for (key, day), (seconds, sessions) in live.user_daily.items():
+        if start_day <= day <= end_day:
+            item = users.setdefault(key, [0.0, 0])
+            item[0] += seconds
+            item[1] += sessions
+    
+    departments_of = dict(db.session.query(AllowedUser.account, AllowedUser.department))
+    departments = {}
+    for key, (seconds, sessions) in users.items():
+        if seconds <= 0 and sessions <= 0:
+            continue
+        name = departments_of.get(key) or '未填写'
+        item = departments.setdefault(name, {'department': name, 'hours': 0.0, 'sessions': 0, 'users': 0})
+        item['hours'] += seconds / 3600
+        item['sessions'] += sessions
+        item['users'] += 1
+    
+    result = sorted(departments.values(), key=lambda d: d['hours'], reverse=True)
+    for item in result:
+        item['hours'] = round(item['hours'], 2)
+    return jsonify({
+        'start_date': start_day.isoformat(),
+        'end_date': end_day.isoformat(),
+        'departments': result
     })
 
 # ==================== 用户管理 API ====================
@@ -1053,15 +1626,18 @@ def get_statistics():
 @app.route('/api/users', methods=['GET'])
 def get_allowed_users():
     """获取授权用户列表"""
-    users = AllowedUser.query.order_by(AllowedUser.created_at.desc()).all()
-    return jsonify([{
-        'id': u.id,
-        'account': u.account,
-        'chinese_name': u.chinese_name,
-        'department': u.department,
-        'password': u.password,  # 添加密码字段
-        'created_at': u.created_at.strftime('%Y-%m-%d %H:%M:%S')
-    } for u in users])
+    def build():
+        users = AllowedUser.query.order_by(AllowedUser.created_at.desc()).all()
+        return jsonify([{
+            'id': u.id,
+            'account': u.account,
+            'chinese_name': u.chinese_name,
+            'department': u.department,
+            'password': u.password,  # 添加密码字段
+            'created_at': u.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        } for u in users])
+    
+    return conditional_response(('allowed_users',), build)
 
 @app.route('/api/users', methods=['POST'])
 def add_allowed_user():
@@ -1233,84 +1809,93 @@ def batch_delete_users():
         db.session.rollback()
         return jsonify({'message': f'批量删除失败: {str(e)}'}), 500
 
+def build_user_import_row(item):
+    """
+    校验一条导入的授权用户数据
+
+    :return: (账号, 插入时的字段, 更新时的字段)，未填写的部门、密码插入时使用默认值，更新时不覆盖
+    """
+    account = str(item.get('account') or '').strip()
+    chinese_name = str(item.get('chinese_name') or '').strip()
+    department = str(item.get('department') or '').strip()
+    password = str(item.get('password') or '').strip()
+    
+    if not account or not chinese_name:
+        raise ImportRowError(f'账号 {account} 数据不完整')
+    
+    update_values = {'chinese_name': chinese_name}
+    if department:
+        update_values['department'] = department
+    if password:
+        update_values['password'] = password
+    insert_values = {
+        'account': account,
+        'chinese_name': chinese_name,
+        'department': department or '未填写',
+        'password': password or '123456'  # 如果没有提供密码，使用默认密码
+    }
+    return account, insert_values, update_values
+
 @app.route('/api/users/batch-import', methods=['POST'])
 def batch_import_users():
-    """批量导入授权用户"""
-    data = request.json
+    """
+    批量导入授权用户（按账号判断是否已存在）
+
+    mode=skip（默认）跳过已存在的账号，mode=upsert 用导入数据更新已存在的账号；
+    导入数据内部重复、数据不完整的行逐行报告错误，不影响其他行（见 bulk_import.py）。
+    """
+    data = request.json or {}
     users_data = data.get('users', [])
     
     if not users_data:
         return jsonify({'message': '没有要导入的用户数据'}), 400
-    
-    success_count = 0
-    fail_count = 0
-    error_messages = []
-    
-    for user_data in users_data:
-        try:
-            account = user_data.get('account', '').strip()
-            chinese_name = user_data.get('chinese_name', '').strip()
-            department = user_data.get('department', '').strip() or '未填写'
-            password = user_data.get('password', '').strip() or '123456'  # 如果没有提供密码，使用默认密码
-            
-            if not account or not chinese_name:
-                fail_count += 1
-                error_messages.append(f'账号 {account} 数据不完整')
-                continue
-            
-            # 检查账号是否已存在
-            existing = AllowedUser.query.filter_by(account=account).first()
-            if existing:
-                fail_count += 1
-                error_messages.append(f'账号 {account} 已存在')
-                continue
-            
-            user = AllowedUser(
-                account=account,
-                chinese_name=chinese_name,
-                department=department,
-                password=password  # 使用提供的密码或默认密码
-            )
-            db.session.add(user)
-            success_count += 1
-            
-        except Exception as e:
-            fail_count += 1
-            error_messages.append(f'导入失败: {str(e)}')
+    try:
+        mode = get_import_mode(data)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    settings = CONFIG.get('bulk_import', {})
+    if not isinstance(users_data, list) or len(users_data) > settings.get('max_rows', 50000):
+        return jsonify({'message': f"一次最多导入 {settings.get('max_rows', 50000)} 个用户"}), 400
     
     try:
-        db.session.commit()
-        
-        # 记录审计日志
-        log_audit('user_batch_import', 'admin', {
-            'success_count': success_count,
-            'fail_count': fail_count,
-            'total_count': len(users_data)
-        })
-        
+        result = bulk_import(AllowedUser, 'account', users_data, build_user_import_row,
+                             upsert=(mode == 'upsert'), chunk_size=settings.get('chunk_size', 1000))
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'数据库提交失败: {str(e)}'}), 500
     
-    return jsonify({
-        'message': '批量导入完成',
-        'success_count': success_count,
-        'fail_count': fail_count,
-        'errors': error_messages[:10]  # 只返回前10条错误信息
+    # 记录审计日志
+    log_audit('user_batch_import', 'admin', {
+        'mode': mode,
+        'success_count': len(result.inserted),
+        'updated_count': len(result.updated),
+        'fail_count': len(result.errors),
+        'total_count': len(users_data)
     })
+    
+    return jsonify(dict(
+        result.to_dict(),
+        message='批量导入完成',
+        success_count=len(result.inserted),
+        fail_count=len(result.errors),
+        errors=result.error_messages(10)  # 只返回前10条错误信息
+    ))
 
 # ==================== 快捷命令管理 ====================
 
 @app.route('/api/quick-commands', methods=['GET'])
 def get_quick_commands():
     """获取所有启用的快捷命令（所有用户可访问）"""
-    try:
-        commands = QuickCommand.query.filter_by(enabled=True).order_by(QuickCommand.order, QuickCommand.id).all()
-        return jsonify({
-            'commands': [cmd.to_dict() for cmd in commands]
-        })
-    except Exception as e:
-        return jsonify({'message': f'获取快捷命令失败: {str(e)}'}), 500
+    def build():
+        try:
+            commands = QuickCommand.query.filter_by(enabled=True).order_by(QuickCommand.order, QuickCommand.id).all()
+            return jsonify({
+                'commands': [cmd.to_dict() for cmd in commands]
+            })
+        except Exception as e:
+            return jsonify({'message': f'获取快捷命令失败: {str(e)}'}), 500
+    
+    return conditional_response(('quick_commands',), build)
 
 @app.route('/api/quick-commands/all', methods=['GET'])
 def get_all_quick_commands():
@@ -1320,13 +1905,16 @@ def get_all_quick_commands():
     if not token:
         return jsonify({'message': '未授权'}), 401
     
-    try:
-        commands = QuickCommand.query.order_by(QuickCommand.order, QuickCommand.id).all()
-        return jsonify({
-            'commands': [cmd.to_dict() for cmd in commands]
-        })
-    except Exception as e:
-        return jsonify({'message': f'获取快捷命令失败: {str(e)}'}), 500
+    def build():
+        try:
+            commands = QuickCommand.query.order_by(QuickCommand.order, QuickCommand.id).all()
+            return jsonify({
+                'commands': [cmd.to_dict() for cmd in commands]
+            })
+        except Exception as e:
+            return jsonify({'message': f'获取快捷命令失败: {str(e)}'}), 500
+    
+    return conditional_response(('quick_commands',), build)
 
 @app.route('/api/quick-commands', methods=['POST'])
 def create_quick_command():
@@ -1423,7 +2011,27 @@ def delete_quick_command(command_id):
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查"""
-    return jsonify({'status': 'ok'})
+    return jsonify({'status': 'ok', 'async_mode': ASYNC_MODE})
+
+@app.route('/api/terminal/stats', methods=['GET'])
+def get_terminal_stats():
+    """获取终端会话统计（每个会话推送的字节数）"""
+    return jsonify({
+        'sessions': terminal_manager.get_stats(),
+        'ssh_pool': ssh_pool.get_stats()
+    })
+
+@app.route('/api/tasks/stats', methods=['GET'])
+def get_task_stats():
+    """获取后台任务池指标（队列深度、任务耗时等）、到期调度器、审计日志写入/清理/检索及数据库连接池/检查点状态"""
+    return jsonify(dict(
+        background_tasks.get_stats(),
+        expiry=expiry_scheduler.get_stats(),
+        audit=audit_writer.get_stats(),
+        audit_retention=audit_retention.get_stats(),
+        audit_search=audit_search.get_stats(),
+        database=db_backend.get_stats(db.engine)
+    ))
 
 # ==================== WebSocket事件处理 ====================
 
@@ -1437,6 +2045,38 @@ def handle_connect():
 def handle_disconnect():
     """客户端断开"""
     print('Client disconnected')
+    # 离开该客户端加入的所有终端房间
+    for session_id in client_terminal_rooms.pop(request.sid, set()):
+        leave_room(session_id)
+
+@socketio.on('devices_subscribe')
+def handle_devices_subscribe(data):
+    """
+    订阅设备状态变更
+
+    客户端携带已应用到的 epoch/version，返回需要补发的变更；
+    无法补齐时返回 resync，客户端需重新获取完整设备列表。
+    """
+    join_room(DEVICES_ROOM)
+    data = data or {}
+    try:
+        version = int(data.get('version'))
+    except (TypeError, ValueError):
+        version = None
+    changes = device_feed.changes_since(data.get('epoch'), version)
+    if changes is None:
+        return {'resync': True, 'epoch': device_feed.epoch}
+    return {'epoch': device_feed.epoch, 'changes': changes}
+
+def join_terminal_room(session_id):
+    """当前客户端加入终端会话房间，终端输出只推送给房间成员"""
+    join_room(session_id)
+    client_terminal_rooms.setdefault(request.sid, set()).add(session_id)
+
+def leave_terminal_room(session_id):
+    """当前客户端离开终端会话房间"""
+    leave_room(session_id)
+    client_terminal_rooms.get(request.sid, set()).discard(session_id)
 
 @socketio.on('ssh_connect')
 def handle_ssh_connect(data):
@@ -1449,10 +2089,13 @@ def handle_ssh_connect(data):
     
     print(f"SSH连接请求: {username}@{host}:{port}")
     
+    # 先加入房间，保证连接建立后的首批输出（登录提示等）不丢失
+    join_terminal_room(session_id)
     success, message = terminal_manager.create_ssh_connection(session_id, host, port, username, password)
     if success:
         emit('terminal_connected', {'session_id': session_id, 'type': 'ssh', 'message': message})
     else:
+        leave_terminal_room(session_id)
         emit('terminal_error', {'session_id': session_id, 'error': message})
 
 @socketio.on('telnet_connect')
@@ -1464,12 +2107,33 @@ def handle_telnet_connect(data):
     
     print(f"Telnet连接请求: {host}:{port}")
     
+    join_terminal_room(session_id)
     success, message = terminal_manager.create_telnet_connection(session_id, host, port)
     if success:
         emit('terminal_connected', {'session_id': session_id, 'type': 'telnet', 'message': message})
     else:
+        leave_terminal_room(session_id)
         emit('terminal_error', {'session_id': session_id, 'error': message})
 
+@socketio.on('terminal_attach')
+def handle_terminal_attach(data):
+    """重新加入终端房间（Socket.IO断线重连后客户端sid会变化）"""
+    session_id = data.get('session_id')
+    if session_id in terminal_manager.connections:
+        join_terminal_room(session_id)
+        # 断线期间发出的输出不会再被确认，重置流控状态
+        terminal_manager.reset_flow_control(session_id)
+
+@socketio.on('terminal_ack')
+def handle_terminal_ack(data):
+    """客户端确认已渲染的终端输出（用于流控）"""
+    session_id = data.get('session_id')
+    size = data.get('size', 0)
+    try:
+        terminal_manager.ack_output(session_id, int(size))
+    except (TypeError, ValueError):
+        pass
+
 @socketio.on('terminal_input')
 def handle_terminal_input(data):
     """处理终端输入"""
@@ -1482,8 +2146,10 @@ def handle_terminal_input(data):
 def handle_close_terminal(data):
     """关闭终端连接"""
     session_id = data.get('session_id')
+    # 关闭后由 on_close 中止该会话的上传和下载凭证
     terminal_manager.close_connection(session_id)
     emit('terminal_closed', {'session_id': session_id})
+    leave_terminal_room(session_id)
 
 @socketio.on('resize_terminal')
 def handle_resize_terminal(data):
@@ -1496,99 +2162,177 @@ def handle_resize_terminal(data):
     if terminal_manager and hasattr(terminal_manager, 'resize_terminal'):
         terminal_manager.resize_terminal(session_id, cols, rows)
 
-@socketio.on('upload_file')
-def handle_upload_file(data):
-    """处理文件上传到远程服务器"""
-    import base64
-    
+def get_sftp_connection(session_id):
+    """获取支持SFTP的终端连接，不满足条件时抛出TransferError"""
+    conn = terminal_manager.connections.get(session_id)
+    if not conn:
+        raise TransferError('终端连接不存在')
+    # 只有SSH支持SFTP
+    if not isinstance(conn, SSHConnection):
+        raise TransferError('仅SSH连接支持文件传输')
+    if not conn.lease or not conn.connected:
+        raise TransferError('SSH连接未建立')
+    return conn
+
+@socketio.on('upload_start')
+def handle_upload_start(data):
+    """开始分块上传（携带upload_id时为续传），返回upload_id和起始偏移"""
     session_id = data.get('session_id')
-    filename = data.get('filename')
-    filedata = data.get('filedata')
-    filesize = data.get('filesize', 0)
-    
-    if not all([session_id, filename, filedata]):
-        emit('terminal_output', {
-            'session_id': session_id,
-            'data': '\r\n❌ 错误: 文件上传参数不完整\r\n'
-        })
-        return
-    
+    # 只有已加入该终端房间的客户端才能上传文件到设备
+    if session_id not in client_terminal_rooms.get(request.sid, set()):
+        return {'error': '终端连接不存在'}
     try:
-        # 解析base64数据
-        if ',' in filedata:
-            filedata = filedata.split(',')[1]
-        
-        file_bytes = base64.b64decode(filedata)
-        
-        # 获取SSH连接
-        conn = terminal_manager.connections.get(session_id)
-        if not conn:
-            emit('terminal_output', {
-                'session_id': session_id,
-                'data': '\r\n❌ 错误: 终端连接不存在\r\n'
-            })
-            return
-        
-        # 检查是否是SSH连接（只有SSH支持SFTP）
-        if not hasattr(conn, 'client') or not hasattr(conn, 'channel'):
-            emit('terminal_output', {
-                'session_id': session_id,
-                'data': '\r\n❌ 错误: 仅SSH连接支持文件上传\r\n'
-            })
-            return
-        
-        if not conn.client or not conn.connected:
-            emit('terminal_output', {
-                'session_id': session_id,
-                'data': '\r\n❌ 错误: SSH连接未建立\r\n'
-            })
-            return
-        
-        # 使用SFTP上传文件
-        sftp = conn.client.open_sftp()
-        remote_path = f'/tmp/{filename}'
-        
-        # 写入文件
-        with sftp.file(remote_path, 'wb') as remote_file:
-            remote_file.write(file_bytes)
-        
-        sftp.close()
-        
-        emit('terminal_output', {
-            'session_id': session_id,
-            'data': f'\r\n✅ 文件上传成功: {remote_path} ({filesize} bytes)\r\n'
-        })
-        
+        conn = get_sftp_connection(session_id)
+        return upload_manager.start(
+            conn,
+            session_id,
+            data.get('filename'),
+            int(data.get('filesize', 0)),
+            remote_dir=data.get('remote_dir'),
+            upload_id=data.get('upload_id')
+        )
+    except TransferError as e:
+        return {'error': str(e)}
+    except (TypeError, ValueError):
+        return {'error': '文件上传参数不完整'}
     except Exception as e:
         import traceback
-        error_details = traceback.format_exc()
-        print(f"文件上传失败: {error_details}")
-        emit('terminal_output', {
-            'session_id': session_id,
-            'data': f'\r\n❌ 上传失败: {str(e)}\r\n'
-        })
+        print(f"文件上传失败: {traceback.format_exc()}")
+        return {'error': f'上传失败: {str(e)}'}
+
+@socketio.on('upload_chunk')
+def handle_upload_chunk(data):
+    """接收一个二进制数据块，直接写入远程文件"""
+    upload_id = data.get('upload_id')
+    chunk = data.get('data')
+    if not isinstance(chunk, (bytes, bytearray)):
+        return {'error': '数据块必须是二进制数据'}
+    
+    try:
+        progress = upload_manager.write_chunk(upload_id, int(data.get('offset', -1)), chunk)
+    except TransferError as e:
+        return {'error': str(e), 'offset': e.offset}
+    except Exception as e:
+        print(f"写入数据块失败: {e}")
+        return {'error': f'上传失败: {str(e)}'}
+    
+    emit('upload_progress', progress)
+    return {'offset': progress['offset']}
+
+@socketio.on('upload_finish')
+def handle_upload_finish(data):
+    """所有数据块发送完毕，确认写入并重命名为目标文件"""
+    try:
+        return upload_manager.finish(data.get('upload_id'))
+    except TransferError as e:
+        return {'error': str(e), 'offset': e.offset}
+    except Exception as e:
+        print(f"完成上传失败: {e}")
+        return {'error': f'上传失败: {str(e)}'}
+
+@socketio.on('upload_cancel')
+def handle_upload_cancel(data):
+    """取消上传并删除远程临时文件"""
+    upload_manager.cancel(data.get('upload_id'))
+    return {'cancelled': True}
+
+@socketio.on('download_request')
+def handle_download_request(data):
+    """申请下载远程文件或目录，返回浏览器可直接访问的下载地址"""
+    session_id = data.get('session_id')
+    # 只有已加入该终端房间的客户端才能申请下载
+    if session_id not in client_terminal_rooms.get(request.sid, set()):
+        return {'error': '终端连接不存在'}
+    try:
+        conn = get_sftp_connection(session_id)
+        ticket = download_manager.create_ticket(conn, session_id, data.get('path'))
+    except TransferError as e:
+        return {'error': str(e)}
+    except Exception as e:
+        print(f"申请下载失败: {e}")
+        return {'error': f'下载失败: {str(e)}'}
+    ticket['url'] = f"/api/downloads/{ticket['token']}"
+    return ticket
+
+@app.route('/api/downloads/<token>', methods=['GET'])
+def download_file(token):
+    """
+    流式下载远程文件（支持Range断点续传）或打包下载目录
+
+    数据经SFTP按窗口预读后直接写入响应，服务端不缓存整个文件。
+    """
+    try:
+        ticket = download_manager.get_ticket(token)
+        conn = get_sftp_connection(ticket.session_id)
+    except TransferError as e:
+        return jsonify({'message': str(e)}), 404
+
+    headers = {
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(ticket.name)}",
+        'Cache-Control': 'no-store'
+    }
+    try:
+        if ticket.is_dir:
+            return Response(download_manager.stream_tar(conn, ticket), mimetype='application/x-tar', headers=headers)
+
+        # 只处理单个区间；If-Range 与当前文件不一致时返回完整文件
+        start, stop = 0, ticket.size
+        byte_range = request.range
+        if_range = request.if_range
+        if if_range.etag and if_range.etag != ticket.etag:
+            byte_range = None
+        elif if_range.date and if_range.date.timestamp() < ticket.mtime:
+            byte_range = None
+        if byte_range and len(byte_range.ranges) == 1:
+            satisfiable = byte_range.range_for_length(ticket.size)
+            if not satisfiable:
+                return Response(status=416, headers={'Content-Range': f'bytes */{ticket.size}'})
+            start, stop = satisfiable
+
+        response = Response(
+            download_manager.stream_file(conn, ticket, start, stop),
+            status=206 if (start, stop) != (0, ticket.size) else 200,
+            mimetype='application/octet-stream',
+            headers=headers
+        )
+        response.content_length = stop - start
+        response.accept_ranges = 'bytes'
+        response.set_etag(ticket.etag)
+        response.last_modified = datetime.utcfromtimestamp(ticket.mtime)
+        if response.status_code == 206:
+            response.content_range = ContentRange('bytes', start, stop, ticket.size)
+        return response
+    except TransferError as e:
+        return jsonify({'message': str(e)}), 404
 
 if __name__ == '__main__':
     try:
-        # 启动后台任务
-        start_background_tasks()
-        
         # 从配置文件读取服务器配置
         server_config = CONFIG['server']
+        
+        # 启动后台任务：debug 模式下 Werkzeug 重载器的父进程只负责监视文件并重启子进程，
+        # 不提供服务，在其中启动会多出一个到期调度器抢先释放设备，服务进程收不到变更
+        if not server_config['debug'] or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_tasks()
         print(f"\n{'='*50}")
         print(f"🚀 启动设备管理系统")
         print(f"{'='*50}")
         print(f"📍 主机: {server_config['host']}")
         print(f"📍 端口: {server_config['port']}")
+        print(f"⚙️ 运行模式: {ASYNC_MODE}")
         print(f"👤 管理员: {CONFIG['admin']['username']}")
         print(f"{'='*50}\n")
         
+        run_options = {}
+        if ASYNC_MODE == 'threading':
+            # Werkzeug开发服务器仅用于开发调试
+            run_options['allow_unsafe_werkzeug'] = True
         socketio.run(
             app, 
             debug=server_config['debug'], 
             host=server_config['host'], 
             port=server_config['port'], 
-            allow_unsafe_werkzeug=True
+            **run_options
         )
     except Exception as e:
         import traceback
@@ -0,0 +1,49 @@
+"""
+服务运行模式
+
+- threading: Werkzeug开发服务器，每个长轮询、WebSocket和后台线程都占用一个系统线程
+- gevent: 协程模式（gevent.pywsgi），Socket.IO连接、paramiko传输和终端读取都由协程调度，
+  单进程即可承载上千个并发WebSocket连接
+
+gevent模式需要在导入其他模块之前 monkey patch 标准库，因此 app.py 最先调用 setup()。
+"""
+import json
+import os
+
+SUPPORTED_MODES = ('threading', 'gevent')
+DEFAULT_MODE = 'gevent'
+
+config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.json')
+
+
+def read_async_mode():
+    """读取 config.json 中的 server.async_mode（此时完整配置尚未加载）"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            mode = json.load(f).get('server', {}).get('async_mode', DEFAULT_MODE)
+    except Exception:
+        mode = DEFAULT_MODE
+    if mode not in SUPPORTED_MODES:
+        print(f"⚠️ 不支持的运行模式 {mode}，可选: {', '.join(SUPPORTED_MODES)}，使用 threading")
+        mode = 'threading'
+    return mode
+
+
+def setup():
+    """根据配置选择运行模式并完成 monkey patch，返回实际使用的模式"""
+    mode = read_async_mode()
+    if mode == 'gevent':
+        try:
+            from gevent import monkey
+        except ImportError:
+            print("⚠️ 未安装gevent，回退到 threading 模式 (pip install gevent)")
+            return 'threading'
+        monkey.patch_all()
+        try:
+            # PostgreSQL驱动psycopg2的网络I/O不经过Python socket，需要单独让出协程
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            pass
+    return mode
+
@@ -0,0 +1,132 @@
+"""
+审计日志操作类型登记和每日计数
+
+- ActionTypeRegistry: 已知操作类型的内存集合，log_audit 记录日志时登记，启动时从计数表加载，
+  筛选下拉框直接读取，不再对 audit_logs 全表执行 SELECT DISTINCT
+- audit_action_daily_counts: 每个操作类型每天的日志条数，写入器批量插入日志时在同一个事务中累加，
+  保留策略分批删除时扣减，按时间范围统计各类型条数只需读取汇总行
+
+历史日志通过 rebuild() 生成计数，完成后写入 data_markers 标记；migrate_db.py 在没有标记时自动执行
+（不能以计数表是否为空判断：升级后第一次登录就会写入计数行）。生成之前操作类型下拉框同时查询审计日志。
+"""
+import threading
+from collections import Counter
+from datetime import date
+from models import db, AuditLog, AuditActionDailyCount, DataMarker
+from usage_rollup import increment
+
+# 已从历史日志生成计数的标记
+BACKFILL_MARKER = 'audit_counts_backfilled'
+
+
+def count_rows(rows):
+    """一批日志按 (操作类型, 日期) 计数，rows 为字典或带 action_type/created_at 属性的行"""
+    counter = Counter()
+    for row in rows:
+        action_type, created_at = (row['action_type'], row['created_at']) if isinstance(row, dict) \
+            else (row.action_type, row.created_at)
+        if action_type and created_at:
+            counter[(action_type, created_at.date())] += 1
+    return counter
+
+
+def apply(counter, sign=1):
+    """把计数写入计数表（调用方负责提交事务），sign=-1 时扣减"""
+    for (action_type, day), count in sorted(counter.items()):
+        increment(AuditActionDailyCount, {'action_type': action_type, 'day': day}, {'count': sign * count})
+    if sign < 0 and counter:
+        # 当天该类型的日志已全部清理，删除计数行
+        AuditActionDailyCount.query.filter(
+            AuditActionDailyCount.day.in_({day for _, day in counter}), AuditActionDailyCount.count <= 0
+        ).delete(synchronize_session=False)
+
+
+def counts_between(start_day=None, end_day=None):
+    """
+    时间范围内各操作类型的日志条数
+
+    :param start_day: 开始日期（含），None 表示不限
+    :param end_day: 结束日期（含），None 表示不限
+    :return: {操作类型: 条数}
+    """
+    total = db.func.sum(AuditActionDailyCount.count)
+    query = db.session.query(AuditActionDailyCount.action_type, total)
+    if start_day:
+        query = query.filter(AuditActionDailyCount.day >= start_day)
+    if end_day:
+        query = query.filter(AuditActionDailyCount.day <= end_day)
+    rows = query.group_by(AuditActionDailyCount.action_type).all()
+    return {action_type: int(count) for action_type, count in rows if count and count > 0}
+
+
+def is_backfilled():
+    """是否已从历史日志生成计数"""
+    return DataMarker.get(BACKFILL_MARKER) is not None
+
+
+def needs_rebuild():
+    """
+    是否需要从历史日志生成计数（尚无生成标记且已有审计日志）
+
+    还没有审计日志时没有历史数据需要生成，直接写入标记，之后的日志都在写入时累加
+    """
+    if is_backfilled():
+        return False
+    if db.session.query(AuditLog.id).first() is not None:
+        return True
+    DataMarker.set(BACKFILL_MARKER, '0')
+    db.session.commit()
+    return False
+
+
+def rebuild():
+    """
+    清空计数表并按 (操作类型, 日期) 汇总全部审计日志重新生成，同时写入生成标记（在一个事务中完成）
+
+    :return: 生成的计数行数
+    """
+    day = db.func.date(AuditLog.created_at)
+    rows = db.session.query(AuditLog.action_type, day, db.func.count(AuditLog.id)).filter(
+        AuditLog.created_at.isnot(None)).group_by(AuditLog.action_type, day).all()
+    AuditActionDailyCount.query.delete(synchronize_session=False)
+    items = [
+        # SQLite 的 date() 返回 'YYYY-MM-DD' 字符串
+        {'action_type': action_type, 'day': value if isinstance(value, date) else date.fromisoformat(value),
+         'count': count}
+        for action_type, value, count in rows if action_type
+    ]
+    for i in range(0, len(items), 5000):
+        db.session.execute(AuditActionDailyCount.__table__.insert(), items[i:i + 5000])
+    DataMarker.set(BACKFILL_MARKER, str(len(items)))
+    db.session.commit()
+    return len(items)
+
+
+class ActionTypeRegistry:
+    """已知操作类型（进程内）"""
+    def __init__(self):
+        self.types = set()
+        self.lock = threading.Lock()
+
+    def add(self, action_type):
+        """登记一个操作类型（集合中已有时只做一次查找）"""
+        if action_type and action_type not in self.types:
+            with self.lock:
+                self.types = self.types | {action_type}
+
+    def load(self):
+        """
+        从计数表加载（需在应用上下文中调用），尚未从历史日志生成计数时合并审计日志中的类型
+
+        :return: 加载的操作类型数量
+        """
+        types = {row[0] for row in db.session.query(AuditActionDailyCount.action_type).distinct()}
+        if not is_backfilled():
+            types |= {row[0] for row in db.session.query(AuditLog.action_type).distinct() if row[0]}
+        with self.lock:
+            self.types = self.types | types
+        return len(types)
+
+    def list(self):
+        """排序后的操作类型列表"""
+        return sorted(self.types)
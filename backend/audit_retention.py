@@ -0,0 +1,153 @@
+"""
+审计日志保留策略
+
+按操作类型配置保留天数（action_types 中未列出的类型使用 default_days，天数不大于0表示永久保留），
+过期日志分批删除：每批按 (created_at, id) 键集取出最多 batch_size 条的ID，在一个短事务中按ID删除，
+批次之间停顿 pause 秒让出写锁，大量过期日志也不会长时间阻塞占用/释放等写操作。
+
+配置了 archive_dir 时，删除前把过期日志按日期追加到压缩归档文件 audit-YYYY-MM-DD.jsonl.gz
+（每行一条JSON，可用 zcat 查看）。归档在删除提交之前写入，中断后重跑可能产生少量重复行，不会丢失。
+删除的条数在同一个事务中从每日计数表扣减（见 audit_counts.py）。
+"""
+import gzip
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from models import db, AuditLog
+import audit_counts
+
+DEFAULT_SETTINGS = {
+    'default_days': 30,
+    'action_types': {},  # 操作类型 -> 保留天数，如 {"user_login_failed": 7}
+    'batch_size': 1000,
+    'pause': 0.05,  # 秒
+    'archive_dir': '',  # 为空表示不归档，相对路径相对项目根目录
+    'interval': 86400  # 后台任务执行间隔（秒）
+}
+
+ARCHIVE_COLUMNS = ('id', 'action_type', 'operator', 'ip_address', 'details', 'created_at')
+
+
+class AuditRetention:
+    """审计日志分批清理"""
+    def __init__(self, config=None, project_root=''):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(config or {})
+        archive_dir = self.settings['archive_dir']
+        self.archive_dir = os.path.join(project_root, archive_dir) if archive_dir else None
+        self.lock = threading.Lock()
+        self.running = False
+        self.last_summary = None
+
+    def rules(self, now):
+        """[(名称, 筛选条件, 保留天数)]"""
+        typed = self.settings['action_types']
+        rules = []
+        for name, days in sorted(typed.items()):
+            if days and days > 0:
+                rules.append((name, db.and_(
+                    AuditLog.action_type == name, AuditLog.created_at < now - timedelta(days=days)
+                ), days))
+        days = self.settings['default_days']
+        if days and days > 0:
+            condition = AuditLog.created_at < now - timedelta(days=days)
+            if typed:
+                condition = db.and_(condition, AuditLog.action_type.notin_(list(typed)))
+            rules.append(('*', condition, days))
+        return rules
+
+    def run(self):
+        """
+        执行一次清理（需在应用上下文中调用），同一时间只允许一次
+
+        :return: 本次运行的汇总，已有清理在运行时返回 None
+        """
+        with self.lock:
+            if self.running:
+                return None
+            self.running = True
+        try:
+            started = time.monotonic()
+            now = datetime.now()
+            summary = {'started_at': now.strftime('%Y-%m-%d %H:%M:%S'), 'rules': [], 'deleted': 0, 'archived': 0}
+            for name, condition, days in self.rules(now):
+                summary['rules'].append(self._run_rule(name, condition, days))
+            summary['deleted'] = sum(rule['deleted'] for rule in summary['rules'])
+            summary['archived'] = sum(rule['archived'] for rule in summary['rules'])
+            summary['seconds'] = round(time.monotonic() - started, 2)
+            self.last_summary = summary
+            return summary
+        finally:
+            with self.lock:
+                self.running = False
+
+    def _run_rule(self, name, condition, days):
+        """按一条规则分批删除"""
+        started = time.monotonic()
+        result = {'action_type': name, 'days': days, 'deleted': 0, 'archived': 0, 'batches': 0,
+                  'max_batch_ms': 0}
+        batch_size = self.settings['batch_size']
+        last = None  # 上一批最后一条的 (created_at, id)，从其后继续，不再重复扫描按类型保留的较旧日志
+        while True:
+            query = db.session.query(*(getattr(AuditLog, c) for c in ARCHIVE_COLUMNS)).filter(condition)
+            if last is not None:
+                query = query.filter(db.or_(
+                    AuditLog.created_at > last[0], db.and_(AuditLog.created_at == last[0], AuditLog.id > last[1])
+                ))
+            rows = query.order_by(AuditLog.created_at, AuditLog.id).limit(batch_size).all()
+            if not rows:
+                db.session.rollback()
+                break
+            last = (rows[-1].created_at, rows[-1].id)
+
+            batch_started = time.monotonic()
+            try:
+                if self.archive_dir:
+                    result['archived'] += self._archive(rows)
+                deleted = AuditLog.query.filter(AuditLog.id.in_([row.id for row in rows])).delete(
+                    synchronize_session=False)
+                audit_counts.apply(audit_counts.count_rows(rows), sign=-1)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            result['deleted'] += deleted
+            result['batches'] += 1
+            result['max_batch_ms'] = max(result['max_batch_ms'], int((time.monotonic() - batch_started) * 1000))
+            if len(rows) < batch_size:
+                break
+            time.sleep(self.settings['pause'])
+        result['seconds'] = round(time.monotonic() - started, 2)
+        return result
+
+    def _archive(self, rows):
+        """按日期追加到压缩归档文件，返回写入的行数"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        by_day = defaultdict(list)
+        for row in rows:
+            item = {column: getattr(row, column) for column in ARCHIVE_COLUMNS}
+            item['created_at'] = row.created_at.strftime('%Y-%m-%d %H:%M:%S') if row.created_at else None
+            by_day[row.created_at.strftime('%Y-%m-%d') if row.created_at else 'unknown'].append(item)
+        for day, items in by_day.items():
+            path = os.path.join(self.archive_dir, f'audit-{day}.jsonl.gz')
+            # 每次追加一个gzip成员，gzip/zcat 会依次解压所有成员
+            with gzip.open(path, 'at', encoding='utf-8') as f:
+                for item in items:
+                    f.write(json.dumps(item, ensure_ascii=False) + '\n')
+        return len(rows)
+
+    def describe(self):
+        """保留策略的文字说明"""
+        parts = [f"{name} {days}天" if days and days > 0 else f"{name} 永久保留"
+                 for name, days in sorted(self.settings['action_types'].items())]
+        default_days = self.settings['default_days']
+        parts.append(f"其他 {default_days}天" if default_days and default_days > 0 else "其他 永久保留")
+        return '，'.join(parts)
+
+    def get_stats(self):
+        """最近一次运行的汇总"""
+        with self.lock:
+            return {'running': self.running, 'last_run': self.last_summary}
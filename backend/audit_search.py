@@ -0,0 +1,231 @@
+"""
+审计日志检索
+
+- 全文索引：SQLite 下为 audit_logs 的 operator、details 建立 FTS5 外部内容索引 audit_logs_fts
+  （trigram 分词，支持中文和任意子串，不区分大小写），由触发器随 audit_logs 的插入/删除/更新同步维护，
+  批量写入和分批清理都不需要额外处理。关键字不足3个字符时 trigram 无法匹配，回退到 LIKE。
+  其他数据库或索引尚未建立时同样使用 LIKE。
+- 分页：按 (created_at, id) 倒序的键集游标，翻到多深都只读取一页的数据；全文搜索按索引的 rowid
+  （即日志ID，与写入时间顺序一致）倒序，匹配结果按顺序产出，取够一页即停止
+- 总数：最多数到 count_limit 条、最多花费 count_time_limit_ms 毫秒（超出时显示“超过N条”，
+  不筛选时按ID范围估算），结果按筛选条件缓存 count_cache_ttl 秒；无法使用索引的短关键字筛选不计算总数
+
+已有数据库通过 migrate_db.py 建立索引并从现有日志生成（日志较多时需要一些时间）；
+新建的空数据库在应用启动时自动建立。
+"""
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import inspect
+from models import db, AuditLog
+
+FTS_TABLE = 'audit_logs_fts'
+MIN_TERM_LENGTH = 3  # trigram 分词能匹配的最短关键字
+
+DEFAULT_SETTINGS = {
+    'count_limit': 10000,
+    'count_time_limit_ms': 20,  # 计算总数的时间上限，超时返回已数到的条数
+    'count_cache_ttl': 30,  # 秒
+    'max_per_page': 200
+}
+
+CREATE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "operator, details, content='audit_logs', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON audit_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, operator, details) VALUES (new.id, new.operator, new.details); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON audit_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, operator, details) "
+    "VALUES ('delete', old.id, old.operator, old.details); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON audit_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, operator, details) "
+    "VALUES ('delete', old.id, old.operator, old.details); "
+    f"INSERT INTO {FTS_TABLE}(rowid, operator, details) VALUES (new.id, new.operator, new.details); END",
+)
+
+
+def encode_cursor(created_at, log_id):
+    """把一页最后一条日志的 (created_at, id) 编码为下一页的游标"""
+    raw = json.dumps([created_at.isoformat() if created_at else None, log_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, log_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(log_id)
+    except Exception:
+        raise ValueError('无效的分页游标')
+
+
+def after_cursor(query, cursor, rowid=None):
+    """
+    倒序排列时取游标之后的日志
+
+    :param rowid: 全文搜索时按索引的 rowid（即日志ID）排序，只按ID定位
+    """
+    created_at, log_id = decode_cursor(cursor)
+    if rowid is not None:
+        return query.filter(rowid < log_id)
+    # created_at <= 游标值 让查询从索引中游标的位置开始扫描，而不是从头跳过前面的页
+    return query.filter(AuditLog.created_at <= created_at, db.or_(
+        AuditLog.created_at < created_at, db.and_(AuditLog.created_at == created_at, AuditLog.id < log_id)
+    ))
+
+
+def quote_term(term):
+    """FTS5 字符串：双引号包围，内部双引号写两次，关键字中的运算符按普通字符匹配"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+class AuditSearch:
+    """审计日志全文索引和总数缓存"""
+    def __init__(self, config=None):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(config or {})
+        self.available = False  # 全文索引是否可用
+        self.lock = threading.Lock()
+        self.counts = {}  # 筛选条件 -> (总数, 关系, 过期时间)
+        self.stats = {'fts_queries': 0, 'like_queries': 0, 'count_hits': 0, 'count_misses': 0,
+                      'last_count_ms': 0}
+
+    @staticmethod
+    def exists(engine):
+        return FTS_TABLE in inspect(engine).get_table_names()
+
+    def create(self, engine, rebuild=True):
+        """
+        建立全文索引和同步触发器（仅SQLite），rebuild 为 True 时从现有日志重新生成索引
+
+        :return: 是否可用
+        """
+        if engine.dialect.name != 'sqlite':
+            self.available = False
+            return False
+        with engine.begin() as conn:
+            for sql in CREATE_SQL:
+                conn.exec_driver_sql(sql)
+            if rebuild:
+                conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        self.available = True
+        return True
+
+    def init(self, engine):
+        """
+        应用启动时调用：已有索引直接使用；没有索引且审计日志为空时直接建立
+
+        :return: 'ready'、'created'、'missing'（需要运行 migrate_db.py）或 'unsupported'
+        """
+        if engine.dialect.name != 'sqlite':
+            return 'unsupported'
+        if self.exists(engine):
+            # 旧版本建立索引时可能缺少触发器，CREATE ... IF NOT EXISTS 补齐
+            self.create(engine, rebuild=False)
+            return 'ready'
+        with engine.connect() as conn:
+            empty = conn.exec_driver_sql("SELECT 1 FROM audit_logs LIMIT 1").first() is None
+        if empty:
+            self.create(engine, rebuild=False)
+            return 'created'
+        return 'missing'
+
+    def apply_text_filters(self, query, operator='', keyword=''):
+        """
+        按操作人、关键字（匹配操作人或详情）筛选
+
+        使用全文索引时查询从 audit_logs_fts 出发并按其 rowid 倒序排列：FTS5 按 rowid 顺序逐条产出匹配结果，
+        取够一页即可停止，常见关键字也不需要先找出全部匹配再排序。日志按时间顺序写入，ID顺序与时间顺序一致。
+        :return: (查询, rowid列（未使用全文索引时为 None）, 是否可以低成本计算总数)
+        """
+        match = []
+        countable = True
+        if operator:
+            if self.available and len(operator) >= MIN_TERM_LENGTH:
+                match.append(f"operator : {quote_term(operator)}")
+            else:
+                query = query.filter(AuditLog.operator.like(f'%{operator}%'))
+                countable = False
+        if keyword:
+            if self.available and len(keyword) >= MIN_TERM_LENGTH:
+                match.append(quote_term(keyword))
+            else:
+                query = query.filter(db.or_(AuditLog.operator.like(f'%{keyword}%'),
+                                            AuditLog.details.like(f'%{keyword}%')))
+                countable = False
+        if operator or keyword:
+            with self.lock:
+                self.stats['fts_queries' if match else 'like_queries'] += 1
+        if not match:
+            return query, None, countable
+        fts = db.table(FTS_TABLE, db.column('rowid'))
+        query = query.join(fts, fts.c.rowid == AuditLog.id).filter(
+            db.literal_column(FTS_TABLE).op('MATCH')(' AND '.join(match)))
+        return query, fts.c.rowid, countable
+
+    @staticmethod
+    def order(query, rowid=None):
+        """按时间倒序（同一时间按ID倒序），全文搜索时按索引的 rowid 倒序"""
+        if rowid is not None:
+            return query.order_by(rowid.desc())
+        return query.order_by(AuditLog.created_at.desc(), AuditLog.id.desc())
+
+    def count(self, key, query, filtered):
+        """
+        计算（或从缓存读取）筛选结果的总数
+
+        :param key: 可哈希的筛选条件，作为缓存键
+        :param query: 已按 order() 排序的查询，计数时沿用同样的执行计划按顺序逐条产出
+        :return: (总数, 关系)，关系为 'eq' 精确、'gte' 至少、'approx' 估算
+        """
+        now = time.monotonic()
+        with self.lock:
+            cached = self.counts.get(key)
+            if cached and cached[2] > now:
+                self.stats['count_hits'] += 1
+                return cached[0], cached[1]
+
+        started = time.monotonic()
+        limit = self.settings['count_limit']
+        deadline = started + self.settings['count_time_limit_ms'] / 1000
+        # 逐批取出匹配的ID计数（SQLite按需产出结果行），超过条数或时间上限即停止
+        total, truncated = 0, False
+        # 通过连接执行（ORM结果会先取出全部行）
+        result = db.session.connection().execute(query.with_entities(AuditLog.id).limit(limit + 1).statement)
+        try:
+            while True:
+                rows = result.fetchmany(200)
+                total += len(rows)
+                if not rows:
+                    break
+                if total > limit or time.monotonic() > deadline:
+                    truncated = True
+                    break
+        finally:
+            result.close()
+        relation = 'eq'
+        if truncated:
+            if filtered:
+                total, relation = min(total, limit), 'gte'
+            else:
+                # 日志按时间顺序写入、从最旧的开始清理，ID范围与实际条数很接近
+                # max 和 min 分开查询才能各自直接读取主键的一端，放在一条语句中会扫描全表
+                max_id = db.session.query(db.func.max(AuditLog.id)).scalar()
+                min_id = db.session.query(db.func.min(AuditLog.id)).scalar()
+                total, relation = max_id - min_id + 1, 'approx'
+
+        with self.lock:
+            self.stats['count_misses'] += 1
+            self.stats['last_count_ms'] = int((time.monotonic() - started) * 1000)
+            if len(self.counts) >= 1000:
+                self.counts.clear()
+            self.counts[key] = (total, relation, now + self.settings['count_cache_ttl'])
+        return total, relation
+
+    def get_stats(self):
+        """检索指标"""
+        with self.lock:
+            return dict(self.stats, fts_available=self.available, cached_counts=len(self.counts))
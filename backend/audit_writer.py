@@ -0,0 +1,172 @@
+"""
+审计日志异步写入模块
+
+log_audit 只把日志放入进程内的有界缓冲区，由后台线程攒批后在一个事务中批量插入：
+- 缓冲区达到 batch_size 条，或最早的一条已等待 flush_interval 秒时写入一批
+- 缓冲区满时丢弃新日志并计数，请求不会因为审计日志阻塞或失败
+- 写入失败时整批放回缓冲区，retry_delay 秒后重试
+- 进程退出时在 shutdown_timeout 秒内写完缓冲区中的日志
+查询接口不保证立即看到刚记录的日志：只有缓冲区中有日志时才最多等待 read_flush_timeout 秒，
+超时后直接查询，剩余日志在 flush_interval 秒内写入后可见。
+"""
+import atexit
+import threading
+import time
+from collections import deque
+
+
+class AuditWriter:
+    """审计日志批量写入器"""
+    def __init__(self, write_fn, batch_size=200, flush_interval=0.5, max_buffer=10000,
+                 retry_delay=2, delay_warn_ms=5000, shutdown_timeout=10, read_flush_timeout=0.1):
+        """
+        :param write_fn: write_fn(rows) 在一个事务中插入一批日志（字典列表）
+        :param read_flush_timeout: 查询前等待缓冲区写入的最长时间（秒），见 flush_for_read()
+        :param delay_warn_ms: 从记录到写入超过该时间的日志计为延迟
+        """
+        self.write_fn = write_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.retry_delay = retry_delay
+        self.delay_warn_ms = delay_warn_ms
+        self.shutdown_timeout = shutdown_timeout
+        self.read_flush_timeout = read_flush_timeout
+        self.buffer = deque()  # (入队时间, 日志)
+        self.writing = 0  # 正在写入的条数
+        self.cond = threading.Condition()
+        self._thread = None
+        self._retry_at = 0
+        self._flushing = 0  # 正在等待 flush() 的调用方数量，此时不再攒批
+        self.shutting_down = False
+        self.stats = {
+            'queued': 0,
+            'written': 0,
+            'dropped': 0,
+            'delayed': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'last_batch_ms': 0,
+            'max_latency_ms': 0
+        }
+        atexit.register(self.shutdown)
+
+    def log(self, row):
+        """
+        放入一条日志
+
+        :return: False 表示缓冲区已满或正在关闭，日志被丢弃
+        """
+        with self.cond:
+            if self.shutting_down or len(self.buffer) >= self.max_buffer:
+                self.stats['dropped'] += 1
+                return False
+            self.buffer.append((time.monotonic(), row))
+            self.stats['queued'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+            # 第一条日志开始计时，攒够一批时立即写入
+            if len(self.buffer) == 1 or len(self.buffer) >= self.batch_size:
+                self.cond.notify_all()
+        return True
+
+    def flush(self, timeout=5):
+        """等待缓冲区中的日志全部写入，返回是否在超时前完成"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            if self._thread is None:
+                return not self.buffer
+            self._flushing += 1
+            self.cond.notify_all()
+            try:
+                while self.buffer or self.writing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self.cond.wait(remaining)
+            finally:
+                self._flushing -= 1
+        return True
+
+    def has_pending(self):
+        """缓冲区中是否有尚未写入的日志（不加锁，只用于判断是否需要等待）"""
+        return bool(self.buffer)
+
+    def flush_for_read(self):
+        """
+        查询前调用：缓冲区为空时立即返回，不等待正在进行的批量写入；
+        否则最多等待 read_flush_timeout 秒，查询请求不会长时间阻塞在审计日志写入上
+        """
+        if not self.has_pending():
+            return True
+        return self.flush(timeout=self.read_flush_timeout)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    now = time.monotonic()
+                    if now < self._retry_at and not self.shutting_down:
+                        self.cond.wait(self._retry_at - now)
+                        continue
+                    if self.buffer:
+                        waited = now - self.buffer[0][0]
+                        if (len(self.buffer) >= self.batch_size or waited >= self.flush_interval
+                                or self._flushing or self.shutting_down):
+                            break
+                        self.cond.wait(self.flush_interval - waited)
+                    else:
+                        if self.shutting_down:
+                            return
+                        self.cond.wait()
+                batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+                self.writing = len(batch)
+
+            started = time.monotonic()
+            try:
+                self.write_fn([row for _, row in batch])
+            except Exception as e:
+                print(f"❌ 批量写入审计日志失败（{len(batch)} 条），{self.retry_delay}秒后重试: {e}")
+                with self.cond:
+                    self.stats['failed_batches'] += 1
+                    self.writing = 0
+                    # 放回缓冲区头部，超出容量的部分丢弃
+                    overflow = max(0, len(self.buffer) + len(batch) - self.max_buffer)
+                    self.stats['dropped'] += overflow
+                    self.buffer.extendleft(reversed(batch[overflow:]))
+                    self._retry_at = time.monotonic() + self.retry_delay
+                    self.cond.notify_all()
+                    if self.shutting_down:
+                        return
+                continue
+
+            now = time.monotonic()
+            with self.cond:
+                self.writing = 0
+                latency_ms = int((now - batch[0][0]) * 1000)
+                self.stats['written'] += len(batch)
+                self.stats['batches'] += 1
+                self.stats['last_batch_ms'] = int((now - started) * 1000)
+                self.stats['max_latency_ms'] = max(self.stats['max_latency_ms'], latency_ms)
+                self.stats['delayed'] += sum(1 for queued_at, _ in batch if (now - queued_at) * 1000 > self.delay_warn_ms)
+                self.cond.notify_all()
+
+    def shutdown(self):
+        """停止接收新日志，在超时时间内写完缓冲区"""
+        with self.cond:
+            if self.shutting_down:
+                return
+            self.shutting_down = True
+            self.cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(self.shutdown_timeout)
+        with self.cond:
+            if self.buffer:
+                print(f"⚠️ 进程退出时仍有 {len(self.buffer)} 条审计日志未写入")
+
+    def get_stats(self):
+        """写入器指标"""
+        with self.cond:
+            return dict(self.stats, pending=len(self.buffer) + self.writing)
@@ -0,0 +1,127 @@
+"""
+批量导入模块
+
+设备、授权用户一次导入上万条时：
+- 逐行校验，导入数据内部按唯一键去重（保留第一次出现的行，其余行报告为重复）
+- 用一次查询取出表中已有的全部键放入集合，不再逐行查询是否存在
+- 新增的行按 chunk_size 分块批量插入（executemany）；upsert 模式下已存在的行分块批量更新，否则报告为已存在
+- 每块在一个短事务中提交，某块失败时回滚该块并逐行重试，定位出错的行，其余行照常导入
+每行的错误带上行号返回，个别行失败不影响整批。
+"""
+from sqlalchemy import bindparam
+from models import db
+
+
+class ImportRowError(Exception):
+    """单行数据无效"""
+    pass
+
+
+class BulkImportResult:
+    """导入结果"""
+    def __init__(self, total):
+        self.total = total
+        self.inserted = []  # 新增的键
+        self.updated = []   # 更新的键
+        self.existing = []  # 非 upsert 模式下已存在而跳过的键
+        self.errors = []    # (行号, 键, 错误信息)
+
+    def fail(self, row, key, message):
+        self.errors.append((row, key, message))
+
+    def error_messages(self, limit=None):
+        """'第N行 键: 错误' 形式的错误信息"""
+        errors = sorted(self.errors)[:limit]
+        return [f"第{row}行{' ' + str(key) if key else ''}: {message}" for row, key, message in errors]
+
+    def to_dict(self, error_limit=100):
+        return {
+            'total_count': self.total,
+            'inserted_count': len(self.inserted),
+            'updated_count': len(self.updated),
+            'failed_count': len(self.errors),
+            'existing_keys': self.existing,
+            'row_errors': [{'row': row, 'key': key, 'message': message}
+                       for row, key, message in sorted(self.errors)[:error_limit]]
+        }
+
+
+def bulk_import(model, key, items, build, upsert=False, chunk_size=1000):
+    """
+    批量导入（需在应用上下文中调用，每块单独提交）
+
+    :param model: 模型类，如 AllowedUser
+    :param key: 唯一键字段名，如 'account'
+    :param items: 导入数据（字典列表）
+    :param build: build(item) -> (键, 插入时的字段, 更新时的字段)，数据无效时抛出 ImportRowError
+    :param upsert: 为 True 时更新已存在的行，否则报告为已存在
+    :return: BulkImportResult
+    """
+    table = model.__table__
+    key_column = table.c[key]
+    result = BulkImportResult(len(items))
+
+    # 逐行校验并在导入数据内部去重
+    rows = []  # (行号, 键, 插入字段, 更新字段)
+    first_row = {}
+    for row, item in enumerate(items, start=1):
+        try:
+            if not isinstance(item, dict):
+                raise ImportRowError('数据格式错误')
+            value, insert_values, update_values = build(item)
+        except ImportRowError as e:
+            result.fail(row, None, str(e))
+            continue
+        if value in first_row:
+            result.fail(row, value, f'与第{first_row[value]}行重复')
+            continue
+        first_row[value] = row
+        rows.append((row, value, insert_values, update_values))
+
+    # 一次查询取出已有的键
+    existing = {value for value, in db.session.query(key_column)}
+    new_rows = [r for r in rows if r[1] not in existing]
+    existing_rows = [r for r in rows if r[1] in existing]
+    if not upsert:
+        for row, value, _, _ in existing_rows:
+            result.fail(row, value, '已存在')
+            result.existing.append(value)
+        existing_rows = []
+
+    _run_chunks(table.insert(), [(row, value, insert_values) for row, value, insert_values, _ in new_rows],
+                chunk_size, result, result.inserted)
+
+    # 按更新字段分组，同一组使用同一条 UPDATE 语句批量执行
+    groups = {}
+    for row, value, _, update_values in existing_rows:
+        groups.setdefault(tuple(sorted(update_values)), []).append((row, value, update_values))
+    for columns, group in groups.items():
+        if not columns:
+            result.updated.extend(value for _, value, _ in group)
+            continue
+        statement = table.update().where(key_column == bindparam('_key')).values(
+            {name: bindparam(name) for name in columns})
+        _run_chunks(statement, [(row, value, dict(update_values, _key=value)) for row, value, update_values in group],
+                    chunk_size, result, result.updated)
+    return result
+
+
+def _run_chunks(statement, rows, chunk_size, result, done):
+    """分块执行，失败的块逐行重试"""
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        try:
+            db.session.execute(statement, [params for _, _, params in chunk])
+            db.session.commit()
+            done.extend(value for _, value, _ in chunk)
+            continue
+        except Exception:
+            db.session.rollback()
+        for row, value, params in chunk:
+            try:
+                db.session.execute(statement, [params])
+                db.session.commit()
+                done.append(value)
+            except Exception as e:
+                db.session.rollback()
+                result.fail(row, value, str(getattr(e, 'orig', None) or e))
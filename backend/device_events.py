@@ -0,0 +1,65 @@
+"""
+设备状态变更推送模块
+
+设备被占用、释放、到期、编辑或删除后，通过Socket.IO向 'devices' 房间推送增量变更，
+每条变更带单调递增的版本号。客户端只在首次加载（或无法补齐时）请求完整设备列表，
+之后按版本号顺序应用增量；断线重连时凭最后的版本号从最近的变更历史中补齐。
+"""
+import threading
+import uuid
+from collections import deque
+
+DEVICES_ROOM = 'devices'
+
+
+class DeviceChangeFeed:
+    """设备变更版本与历史"""
+    def __init__(self, socketio, history_size=1000):
+        self.socketio = socketio
+        # 版本号只在进程内递增，服务重启后客户端通过epoch变化得知需要全量刷新
+        self.epoch = uuid.uuid4().hex[:12]
+        self.version = 0
+        self.history = deque(maxlen=history_size)
+        self.lock = threading.Lock()
+
+    def current_version(self):
+        """当前版本，格式为 epoch:version（全量列表接口在查询之前读取）"""
+        with self.lock:
+            return f'{self.epoch}:{self.version}'
+
+    def publish(self, changes):
+        """
+        发布一批变更
+
+        :param changes: [(op, device_id, device_data)]，op 为 'upsert' 或 'delete'
+        """
+        if not changes:
+            return
+        with self.lock:
+            items = []
+            for op, device_id, device in changes:
+                self.version += 1
+                item = {'version': self.version, 'op': op, 'id': device_id, 'device': device}
+                self.history.append(item)
+                items.append(item)
+            # 在锁内发送，保证客户端按版本号顺序收到
+            self.socketio.emit('devices_changed', {
+                'epoch': self.epoch,
+                'changes': items
+            }, to=DEVICES_ROOM)
+
+    def changes_since(self, epoch, version):
+        """
+        客户端已应用到 version 时需要补发的变更
+
+        :return: 变更列表；服务已重启或历史已被覆盖而无法补齐时返回 None
+        """
+        with self.lock:
+            if epoch != self.epoch or version is None or version > self.version:
+                return None
+            if version == self.version:
+                return []
+            if not self.history or self.history[0]['version'] > version + 1:
+                return None
+            return [item for item in self.history if item['version'] > version]
+
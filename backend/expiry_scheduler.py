@@ -0,0 +1,169 @@
+"""
+设备到期调度模块
+
+以最小堆保存所有已占用设备的到期时间，后台线程只在最早的到期时间到达时醒来，
+把所有已到期的设备交给释放回调在一个事务中批量释放。占用/释放/删除时更新堆，
+列表接口不再需要在每次请求中扫描并提交。
+"""
+import heapq
+import threading
+import time
+
+
+class ExpiryScheduler:
+    """设备到期调度器"""
+    def __init__(self, release_fn, load_fn=None, resync_interval=300, retry_delay=30):
+        """
+        :param release_fn: release_fn(device_ids) -> 实际释放的设备数，在一个事务中释放已到期设备
+        :param load_fn: load_fn() -> [(device_id, 到期时间戳)]，启动及定期校准时从数据库加载
+        :param resync_interval: 定期从数据库重新加载的间隔（秒），兜底处理其他进程/脚本直接修改的数据
+        :param retry_delay: 释放失败后重试的间隔（秒）
+        """
+        self.release_fn = release_fn
+        self.load_fn = load_fn
+        self.resync_interval = resync_interval
+        self.retry_delay = retry_delay
+        self.heap = []  # (到期时间戳, device_id)
+        self.deadlines = {}  # device_id -> 当前有效的到期时间戳，堆中不一致的条目视为已作废
+        self.cond = threading.Condition()
+        self._thread = None
+        self._next_resync = 0
+        self._changes = None  # 重新加载期间发生的 schedule/cancel，加载完成后覆盖到结果上
+        self.stats = {
+            'released': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'last_batch_ms': 0,
+            'max_lateness_ms': 0
+        }
+
+    def start(self):
+        """加载当前占用中的设备并启动调度线程"""
+        with self.cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='expiry-scheduler', daemon=True)
+        self.resync()
+        self._thread.start()
+
+    def schedule(self, device_id, deadline):
+        """设置（或更新）设备的到期时间戳"""
+        with self.cond:
+            if self._changes is not None:
+                self._changes[device_id] = deadline
+            self.deadlines[device_id] = deadline
+            heapq.heappush(self.heap, (deadline, device_id))
+            # 新的到期时间更早时唤醒调度线程重新计算等待时间
+            if self.heap[0] == (deadline, device_id):
+                self.cond.notify()
+
+    def cancel(self, device_id):
+        """设备已释放或删除"""
+        with self.cond:
+            if self._changes is not None:
+                self._changes[device_id] = None
+            self.deadlines.pop(device_id, None)
+            self._compact()
+
+    def resync(self):
+        """从数据库重新加载所有到期时间"""
+        if not self.load_fn:
+            return
+        with self.cond:
+            self._changes = {}
+        try:
+            items = self.load_fn()
+        except Exception as e:
+            print(f"❌ 加载设备到期时间失败: {e}")
+            with self.cond:
+                self._changes = None
+                self._next_resync = time.monotonic() + self.retry_delay
+            return
+        with self.cond:
+            deadlines = dict(items)
+            for device_id, deadline in self._changes.items():
+                if deadline is None:
+                    deadlines.pop(device_id, None)
+                else:
+                    deadlines[device_id] = deadline
+            self._changes = None
+            self.deadlines = deadlines
+            self.heap = [(deadline, device_id) for device_id, deadline in self.deadlines.items()]
+            heapq.heapify(self.heap)
+            self._next_resync = time.monotonic() + self.resync_interval
+            self.cond.notify()
+
+    def _compact(self):
+        """作废条目过多时重建堆（调用方需持有锁）"""
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(deadline, device_id) for device_id, deadline in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def _pop_due(self, now):
+        """取出所有已到期的设备（调用方需持有锁）"""
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, device_id = heapq.heappop(self.heap)
+            if self.deadlines.get(device_id) == deadline:
+                del self.deadlines[device_id]
+                due.append((device_id, deadline))
+        return due
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    now = time.time()
+                    due = self._pop_due(now)
+                    if due:
+                        break
+                    if self.resync_interval and time.monotonic() >= self._next_resync:
+                        break
+                    timeout = self.resync_interval or 60
+                    if self.heap:
+                        timeout = min(timeout, self.heap[0][0] - now)
+                    # 墙上时钟可能被调整，最多等待60秒后重新计算
+                    self.cond.wait(max(0.01, min(timeout, 60)))
+
+            if not due:
+                self.resync()
+                continue
+
+            device_ids = [device_id for device_id, _ in due]
+            # 相对最早到期时间的延迟
+            lateness_ms = int((time.time() - min(deadline for _, deadline in due)) * 1000)
+            started = time.monotonic()
+            try:
+                released = self.release_fn(device_ids)
+            except Exception as e:
+                print(f"❌ 自动释放到期设备失败: {e}")
+                retry_at = time.time() + self.retry_delay
+                with self.cond:
+                    self.stats['failed_batches'] += 1
+                    for device_id in device_ids:
+                        # 期间已重新占用（有了新的到期时间）的设备按新的时间调度
+                        if device_id not in self.deadlines:
+                            self.deadlines[device_id] = retry_at
+                            heapq.heappush(self.heap, (retry_at, device_id))
+                continue
+
+            with self.cond:
+                self.stats['released'] += released or 0
+                self.stats['batches'] += 1
+                self.stats['last_batch_ms'] = int((time.monotonic() - started) * 1000)
+                self.stats['max_lateness_ms'] = max(self.stats['max_lateness_ms'], lateness_ms)
+
+    def get_stats(self):
+        """调度器指标"""
+        with self.cond:
+            next_deadline = None
+            while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            if self.heap:
+                next_deadline = round(self.heap[0][0] - time.time(), 1)
+            return dict(
+                self.stats,
+                scheduled=len(self.deadlines),
+                heap_size=len(self.heap),
+                next_expiry_in_seconds=next_deadline
+            )
@@ -0,0 +1,136 @@
+"""
+登录信息采集模块
+
+把 who / w / last / lastlog 等采集命令合并成一个远程脚本，在一个通道里一次执行完，
+通过带随机标记的分隔行拆分各命令的输出，并记录每个命令的耗时。
+"""
+import socket
+import time
+import uuid
+
+# (名称, 命令, 标题)
+COLLECTORS = [
+    ('who', 'who', '当前登录用户 (who)'),
+    ('who_a', 'who -a', '详细当前登录 (who -a)'),
+    ('w', 'w', '用户活动信息 (w)'),
+    ('last', 'last -n 30 -a', '最近30次登录历史 (last -n 30 -a)'),
+    ('lastlog', 'lastlog | head -n 50', '用户最后登录信息 (lastlog)'),
+]
+
+
+def build_script(collectors, marker):
+    """生成一次执行所有采集命令的shell脚本"""
+    lines = []
+    for name, command, _ in collectors:
+        lines.append(f"echo '{marker} BEGIN {name}'")
+        # 与逐条执行时一样只采集标准输出
+        lines.append(f"{{ {command} ; }} 2>/dev/null")
+        lines.append(f"echo \"{marker} END {name} $?\"")
+    return '\n'.join(lines)
+
+
+def run_probe(lease, collectors=COLLECTORS, timeout=15):
+    """
+    在借出的SSH传输上执行采集
+
+    :param lease: ssh_pool.SSHLease
+    :param collectors: 采集命令列表
+    :param timeout: 整体截止时间（秒），超时后未完成的命令标记为 timeout
+    :return: {'results': [...], 'elapsed_ms': int, 'timed_out': bool}
+    """
+    marker = f'__DM_PROBE_{uuid.uuid4().hex[:12]}__'
+    results = {
+        name: {
+            'name': name,
+            'command': command,
+            'title': title,
+            'output': '',
+            'exit_status': None,
+            'duration_ms': None,
+            'status': 'pending'
+        }
+        for name, command, title in collectors
+    }
+
+    start = time.monotonic()
+    deadline = start + timeout
+    timed_out = False
+    current = None  # 正在输出的采集项
+    current_lines = []
+    current_started = None
+    pending = b''
+
+    def handle_line(raw):
+        nonlocal current, current_lines, current_started
+        line = raw.decode('utf-8', errors='ignore').rstrip('\r')
+        if line.startswith(marker):
+            parts = line[len(marker):].split()
+            now = time.monotonic()
+            if len(parts) >= 2 and parts[0] == 'BEGIN' and parts[1] in results:
+                current = results[parts[1]]
+                current['status'] = 'running'
+                current_lines = []
+                current_started = now
+            elif len(parts) >= 2 and parts[0] == 'END' and current and parts[1] == current['name']:
+                current['output'] = '\n'.join(current_lines).strip()
+                current['exit_status'] = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else None
+                current['duration_ms'] = int((now - current_started) * 1000)
+                current['status'] = 'ok'
+                current = None
+            return
+        if current:
+            current_lines.append(line)
+
+    channel = lease.open_session(timeout=timeout)
+    try:
+        channel.exec_command(build_script(collectors, marker))
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            channel.settimeout(remaining)
+            try:
+                data = channel.recv(32768)
+            except socket.timeout:
+                timed_out = True
+                break
+            if not data:
+                break
+            pending += data
+            *lines, pending = pending.split(b'\n')
+            for raw in lines:
+                handle_line(raw)
+        if pending and not timed_out:
+            handle_line(pending)
+    finally:
+        channel.close()
+
+    # 未完成的采集项：保留已收到的部分输出
+    now = time.monotonic()
+    for result in results.values():
+        if result['status'] == 'running':
+            result['output'] = '\n'.join(current_lines).strip()
+            result['duration_ms'] = int((now - current_started) * 1000)
+        if result['status'] in ('pending', 'running'):
+            result['status'] = 'timeout' if timed_out else 'error'
+
+    return {
+        'results': [results[name] for name, _, _ in collectors],
+        'elapsed_ms': int((now - start) * 1000),
+        'timed_out': timed_out
+    }
+
+
+def format_login_info(probe):
+    """把采集结果组合为保存到使用记录中的文本"""
+    parts = [f"=== {r['title']} ===\n{r['output']}" for r in probe['results'] if r['output']]
+    if not parts:
+        return "未获取到登录信息（所有命令输出为空）"
+
+    timings = []
+    for r in probe['results']:
+        duration = f"{r['duration_ms']}ms" if r['duration_ms'] is not None else '-'
+        timings.append(f"{r['command']}: {duration} {r['status']}")
+    parts.append(f"=== 采集耗时 (共 {probe['elapsed_ms']}ms) ===\n" + '\n'.join(timings))
+    return '\n\n'.join(parts)
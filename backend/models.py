@@ -1,11 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import zlib
 
 db = SQLAlchemy()
 
 class Device(db.Model):
     """设备模型"""
     __tablename__ = 'devices'
+    __table_args__ = (
+        db.Index('ix_devices_current_user_account_status', 'current_user_account', 'status'),  # 占用数量检查
+        db.Index('ix_devices_status_occupy_until', 'status', 'occupy_until'),  # 到期设备加载与释放
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)  # 设备名称
@@ -44,6 +49,13 @@ class User(db.Model):
 class UsageRecord(db.Model):
     """使用记录模型"""
     __tablename__ = 'usage_records'
+    __table_args__ = (
+        db.Index('ix_usage_records_device_id_end_time_start_time', 'device_id', 'end_time', 'start_time'),  # 释放设备时查找未结束的记录
+        db.Index('ix_usage_records_device_id_start_time', 'device_id', 'start_time'),  # 设备使用记录列表
+        db.Index('ix_usage_records_user_account_start_time', 'user_account', 'start_time'),  # 按使用人筛选
+        db.Index('ix_usage_records_start_time', 'start_time'),  # 记录列表分页、按日期筛选
+        db.Index('ix_usage_records_end_time', 'end_time'),  # 所有未结束的记录
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     device_id = db.Column(db.Integer, db.ForeignKey('devices.id'), nullable=False)
@@ -52,7 +64,8 @@ class UsageRecord(db.Model):
     purpose = db.Column(db.Text)  # 使用目的
     start_time = db.Column(db.DateTime, default=datetime.now)
     end_time = db.Column(db.DateTime)
-    login_info = db.Column(db.Text)  # Linux登录信息（通过who/w命令获取）
+    # Linux登录信息已移到 usage_record_login_info 表（压缩存储，按需读取）；
+    # 旧数据库中保留的 login_info 字段由 migrate_db.py 迁移后清空
     
     def get_duration(self):
         """计算使用时长（小时）"""
@@ -65,6 +78,98 @@ class UsageRecord(db.Model):
     def __repr__(self):
         return f'<UsageRecord {self.id} - Device {self.device_id}>'
 
+class UsageRecordLoginInfo(db.Model):
+    """使用记录的Linux登录信息快照（zlib压缩，按记录ID按需读取）"""
+    __tablename__ = 'usage_record_login_info'
+    
+    record_id = db.Column(db.Integer, db.ForeignKey('usage_records.id'), primary_key=True)
+    content = db.Column(db.LargeBinary)  # zlib压缩的UTF-8文本
+    pending = db.Column(db.Boolean, default=False)  # 后台仍在采集登录信息
+    
+    @staticmethod
+    def compress(text):
+        """压缩登录信息文本"""
+        return zlib.compress(text.encode('utf-8'), 6) if text else None
+    
+    @property
+    def text(self):
+        """解压后的登录信息文本"""
+        return zlib.decompress(self.content).decode('utf-8') if self.content else ''
+    
+    @text.setter
+    def text(self, value):
+        self.content = self.compress(value)
+    
+    def __repr__(self):
+        return f'<UsageRecordLoginInfo {self.record_id}>'
+
+class DeviceDailyUsage(db.Model):
+    """设备每日使用汇总（由已结束的使用记录按自然日切分累加）"""
+    __tablename__ = 'device_daily_usage'
+    __table_args__ = (
+        db.Index('ix_device_daily_usage_day', 'day'),
+    )
+    
+    device_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    seconds = db.Column(db.Float, nullable=False, default=0)  # 当天的使用秒数
+    sessions = db.Column(db.Integer, nullable=False, default=0)  # 当天开始的使用次数
+    
+    def __repr__(self):
+        return f'<DeviceDailyUsage {self.device_id} {self.day}>'
+
+class DeviceHourlyUsage(db.Model):
+    """设备每小时使用汇总"""
+    __tablename__ = 'device_hourly_usage'
+    __table_args__ = (
+        db.Index('ix_device_hourly_usage_day', 'day'),
+    )
+    
+    device_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True)  # 0-23
+    seconds = db.Column(db.Float, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DeviceHourlyUsage {self.device_id} {self.day} {self.hour}>'
+
+class UserDailyUsage(db.Model):
+    """使用人每日使用汇总（部门在查询时通过授权用户关联）"""
+    __tablename__ = 'user_daily_usage'
+    __table_args__ = (
+        db.Index('ix_user_daily_usage_day', 'day'),
+    )
+    
+    user_key = db.Column(db.String(100), primary_key=True)  # 使用人账号（旧记录没有账号时为中文名）
+    day = db.Column(db.Date, primary_key=True)
+    user_name = db.Column(db.String(100))  # 使用人中文名
+    seconds = db.Column(db.Float, nullable=False, default=0)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<UserDailyUsage {self.user_key} {self.day}>'
+
+class DataMarker(db.Model):
+    """数据标记 - 记录一次性的数据生成（如从历史记录生成汇总）是否已完成"""
+    __tablename__ = 'data_markers'
+
+    name = db.Column(db.String(50), primary_key=True)  # 标记名称
+    value = db.Column(db.String(200))  # 说明（如生成的记录数）
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+    @classmethod
+    def get(cls, name):
+        """读取标记，不存在时返回 None"""
+        return cls.query.get(name)
+
+    @classmethod
+    def set(cls, name, value=None):
+        """写入标记（调用方负责提交事务）"""
+        db.session.merge(cls(name=name, value=value, updated_at=datetime.now()))
+
+    def __repr__(self):
+        return f'<DataMarker {self.name}>'
+
 class AllowedUser(db.Model):
     """授权用户模型 - 只有在此列表中的用户才能占用设备"""
     __tablename__ = 'allowed_users'
@@ -82,6 +187,9 @@ class AllowedUser(db.Model):
 class AuditLog(db.Model):
     """审计日志模型 - 记录系统操作日志"""
     __tablename__ = 'audit_logs'
+    __table_args__ = (
+        db.Index('ix_audit_logs_action_type_created_at', 'action_type', 'created_at'),  # 按操作类型筛选
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     action_type = db.Column(db.String(50), nullable=False)  # 操作类型：login, device_add, device_delete, user_add等
@@ -93,6 +201,20 @@ class AuditLog(db.Model):
     def __repr__(self):
         return f'<AuditLog {self.id} - {self.action_type}>'
 
+class AuditActionDailyCount(db.Model):
+    """审计日志每日各操作类型的条数（随日志写入累加、随清理扣减）"""
+    __tablename__ = 'audit_action_daily_counts'
+    __table_args__ = (
+        db.Index('ix_audit_action_daily_counts_day', 'day'),
+    )
+    
+    action_type = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<AuditActionDailyCount {self.action_type} {self.day}>'
+
 class QuickCommand(db.Model):
     """快捷命令模型 - 用于SSH终端的自定义快捷按钮"""
     __tablename__ = 'quick_commands'
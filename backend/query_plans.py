@@ -0,0 +1,98 @@
+"""
+热点查询执行计划检查
+
+对释放设备、到期释放、占用检查、记录列表、审计日志筛选等热点查询执行 EXPLAIN QUERY PLAN，
+确认它们都走索引：不能出现不带索引的全表扫描（SCAN 表名），声明了 sorted 的查询
+也不能出现 USE TEMP B-TREE（排序由索引完成）。migrate_db.py 创建索引后调用 check_query_plans()。
+仅支持 SQLite。
+"""
+import re
+from datetime import datetime, timedelta, date
+from models import db, Device, UsageRecord, AuditLog, DeviceDailyUsage, DeviceHourlyUsage, UserDailyUsage
+from audit_search import AuditSearch, after_cursor, encode_cursor
+
+
+def hot_queries():
+    """[(名称, 查询, 排序是否应由索引完成)]"""
+    now = datetime.now()
+    today = date.today()
+    cursor = encode_cursor(now - timedelta(days=3), 1000)
+    queries = [
+        ('释放设备：查找未结束的使用记录',
+         UsageRecord.query.filter_by(device_id=1, end_time=None).order_by(UsageRecord.start_time.desc()).limit(1), True),
+        ('到期释放：结束到期设备的使用记录',
+         UsageRecord.query.filter(UsageRecord.device_id.in_([1, 2, 3]), UsageRecord.end_time.is_(None)), False),
+        ('统计：所有未结束的使用记录',
+         UsageRecord.query.filter(UsageRecord.end_time.is_(None)), False),
+        ('占用设备：当前用户已占用数量',
+         Device.query.filter_by(current_user_account='user', status='occupied'), False),
+        ('到期调度：加载占用中设备的到期时间',
+         db.session.query(Device.id, Device.occupy_until).filter(
+             Device.status == 'occupied', Device.occupy_until.isnot(None)), False),
+        ('到期释放：确认已到期的设备',
+         Device.query.filter(Device.status == 'occupied', Device.occupy_until <= now), False),
+        ('使用记录列表：按开始时间分页',
+         UsageRecord.query.filter(UsageRecord.start_time < now).order_by(
+             UsageRecord.start_time.desc(), UsageRecord.id.desc()).limit(51), True),
+        ('使用记录列表：指定设备',
+         UsageRecord.query.filter(UsageRecord.device_id == 1).order_by(
+             UsageRecord.start_time.desc(), UsageRecord.id.desc()).limit(51), True),
+        ('使用记录列表：指定使用人',
+         UsageRecord.query.filter(UsageRecord.user_account == 'user').order_by(
+             UsageRecord.start_time.desc(), UsageRecord.id.desc()).limit(51), True),
+        ('审计日志：按操作类型和时间筛选',
+         AuditLog.query.filter(AuditLog.action_type == 'device_add', AuditLog.created_at >= now - timedelta(days=7)
+                               ).order_by(AuditLog.created_at.desc()).limit(50), True),
+        ('审计日志：游标翻页',
+         after_cursor(AuditLog.query.order_by(AuditLog.created_at.desc(), AuditLog.id.desc()), cursor).limit(51), True),
+        ('审计日志：按操作类型游标翻页',
+         after_cursor(AuditLog.query.filter(AuditLog.action_type == 'device_add').order_by(
+             AuditLog.created_at.desc(), AuditLog.id.desc()), cursor).limit(51), True),
+        ('审计日志：按时间分批清理',
+         AuditLog.query.filter(AuditLog.created_at < now - timedelta(days=30)).order_by(
+             AuditLog.created_at, AuditLog.id).limit(1000), True),
+        ('审计日志：按操作类型分批清理',
+         AuditLog.query.filter(AuditLog.action_type == 'user_login_failed', AuditLog.created_at < now - timedelta(days=7)
+                               ).order_by(AuditLog.created_at, AuditLog.id).limit(1000), True),
+        ('使用汇总：设备每日', DeviceDailyUsage.query.filter(
+            DeviceDailyUsage.day >= today - timedelta(days=29), DeviceDailyUsage.day <= today), False),
+        ('使用汇总：设备每小时', DeviceHourlyUsage.query.filter(
+            DeviceHourlyUsage.day >= today - timedelta(days=29), DeviceHourlyUsage.day <= today), False),
+        ('使用汇总：使用人每日', UserDailyUsage.query.filter(
+            UserDailyUsage.day >= today - timedelta(days=29), UserDailyUsage.day <= today), False),
+    ]
+    if AuditSearch.exists(db.engine):
+        search = AuditSearch()
+        search.available = True
+        query, rowid, _ = search.apply_text_filters(AuditLog.query, operator='admin', keyword='device')
+        queries.append(('审计日志：全文搜索', search.order(query, rowid).limit(51), True))
+    return queries
+
+
+def explain(query):
+    """返回查询计划的 detail 列"""
+    statement = query.statement if hasattr(query, 'statement') else query
+    # 展开 IN 列表等参数，得到可以直接执行的SQL
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.construct_params()
+    if compiled.positiontup:
+        params = tuple(params[name] for name in compiled.positiontup)
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def check_query_plans():
+    """
+    检查所有热点查询
+
+    :return: [(名称, 是否通过, 查询计划)]
+    """
+    results = []
+    for name, query, sorted_by_index in hot_queries():
+        plan = explain(query)
+        ok = not any(re.fullmatch(r'SCAN (TABLE )?\w+', detail.strip()) for detail in plan)
+        if sorted_by_index and any('USE TEMP B-TREE' in detail for detail in plan):
+            ok = False
+        results.append((name, ok, plan))
+    return results
@@ -0,0 +1,422 @@
+"""
+SFTP文件传输模块
+
+分块、可续传的上传：浏览器按块发送二进制数据，每块直接以流水线方式写入
+远程的 .part 临时文件，全部完成后再重命名为目标文件，服务端不缓存整个文件。
+
+下载：通过一次性申请的下载凭证以HTTP流式返回远程文件（支持Range断点续传），
+目录打包为tar流返回；按窗口批量预读，内存中最多只保留一个窗口的数据。
+"""
+import posixpath
+import stat
+import tarfile
+import threading
+import time
+import uuid
+
+
+class TransferError(Exception):
+    """文件传输错误"""
+    def __init__(self, message, offset=None):
+        super().__init__(message)
+        self.offset = offset  # 偏移量不一致时，告诉客户端应从哪里继续
+
+
+class SFTPUpload:
+    """一次进行中的上传"""
+    def __init__(self, upload_id, session_id, sftp, remote_path, filesize, offset):
+        self.upload_id = upload_id
+        self.session_id = session_id
+        self.sftp = sftp
+        self.remote_path = remote_path
+        self.part_path = remote_path + '.part'
+        self.filesize = filesize
+        self.offset = offset
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.last_active = time.monotonic()
+        # 续传时在原有临时文件末尾继续写
+        self.file = sftp.open(self.part_path, 'r+b' if offset else 'wb')
+        if offset:
+            self.file.seek(offset)
+        # 流水线写：不逐个等待服务端确认，关闭文件时统一检查结果
+        self.file.set_pipelined(True)
+
+    def close(self):
+        for obj in (self.file, self.sftp):
+            try:
+                obj.close()
+            except Exception:
+                pass
+
+
+class UploadManager:
+    """管理所有进行中的上传"""
+    def __init__(self, config=None):
+        config = config or {}
+        self.default_dir = config.get('default_dir', '/tmp')
+        self.chunk_size = config.get('chunk_size', 1048576)
+        self.max_file_size = config.get('max_file_size', 1073741824)
+        self.uploads = {}  # upload_id -> SFTPUpload
+        self.lock = threading.Lock()
+
+    def resolve_path(self, filename, remote_dir=None):
+        """计算远程目标路径（文件名只取最后一段，防止路径穿越）"""
+        name = posixpath.basename((filename or '').replace('\\', '/'))
+        if not name or name in ('.', '..'):
+            raise TransferError('文件名无效')
+        remote_dir = (remote_dir or self.default_dir).strip() or self.default_dir
+        if not remote_dir.startswith('/'):
+            raise TransferError(f'上传目录必须是绝对路径: {remote_dir}')
+        return posixpath.join(posixpath.normpath(remote_dir), name)
+
+    def start(self, conn, session_id, filename, filesize, remote_dir=None, upload_id=None):
+        """
+        开始或续传一次上传
+
+        :return: {'upload_id', 'offset', 'chunk_size', 'remote_path'}
+        """
+        if filesize < 0 or filesize > self.max_file_size:
+            raise TransferError(f'文件大小超过限制 (最大 {self.max_file_size} 字节)')
+
+        # 同一连接内断线重连：直接返回已写入的位置；其他终端会话的上传不能接管
+        if upload_id:
+            with self.lock:
+                upload = self.uploads.get(upload_id)
+            if upload:
+                if upload.session_id != session_id:
+                    raise TransferError('上传任务不属于当前终端')
+                upload.last_active = time.monotonic()
+                return self._describe(upload)
+
+        remote_path = self.resolve_path(filename, remote_dir)
+        sftp = conn.open_sftp()
+        try:
+            offset = 0
+            if upload_id:
+                # 服务端状态已丢失时，根据远程临时文件大小续传
+                try:
+                    offset = min(sftp.stat(remote_path + '.part').st_size, filesize)
+                except IOError:
+                    offset = 0
+            upload = SFTPUpload(upload_id or uuid.uuid4().hex, session_id, sftp, remote_path, filesize, offset)
+        except IOError as e:
+            sftp.close()
+            raise TransferError(f'无法写入远程文件 {remote_path}: {e}')
+        except Exception:
+            sftp.close()
+            raise
+
+        with self.lock:
+            old = self.uploads.get(upload.upload_id)
+            # 打开文件期间其他终端会话以同一ID开始了上传
+            conflict = old is not None and old.session_id != session_id
+            if not conflict:
+                self.uploads[upload.upload_id] = upload
+        if conflict:
+            upload.close()
+            raise TransferError('上传任务不属于当前终端')
+        if old:
+            old.close()
+        return self._describe(upload)
+
+    def write_chunk(self, upload_id, offset, data):
+        """写入一个数据块，返回上传进度"""
+        upload = self._get(upload_id)
+        with upload.lock:
+            if offset != upload.offset:
+                raise TransferError(f'数据块偏移不一致 (期望 {upload.offset}, 收到 {offset})', offset=upload.offset)
+            if upload.offset + len(data) > upload.filesize:
+                raise TransferError('数据超出文件大小', offset=upload.offset)
+            upload.file.write(data)
+            upload.offset += len(data)
+            upload.last_active = time.monotonic()
+            return {
+                'upload_id': upload.upload_id,
+                'session_id': upload.session_id,
+                'offset': upload.offset,
+                'total': upload.filesize
+            }
+
+    def finish(self, upload_id):
+        """完成上传：等待所有流水线写入确认后把临时文件重命名为目标文件"""
+        upload = self._get(upload_id)
+        with upload.lock:
+            if upload.offset != upload.filesize:
+                raise TransferError(f'文件尚未传输完成 ({upload.offset}/{upload.filesize})', offset=upload.offset)
+            try:
+                upload.file.close()
+                try:
+                    upload.sftp.posix_rename(upload.part_path, upload.remote_path)
+                except IOError:
+                    # 不支持posix-rename扩展的服务器：先删除已有目标文件再重命名
+                    try:
+                        upload.sftp.remove(upload.remote_path)
+                    except IOError:
+                        pass
+                    upload.sftp.rename(upload.part_path, upload.remote_path)
+            except IOError as e:
+                raise TransferError(f'写入远程文件失败: {e}')
+            finally:
+                self._discard(upload)
+            return {
+                'remote_path': upload.remote_path,
+                'size': upload.filesize,
+                'duration': round(time.monotonic() - upload.started_at, 2)
+            }
+
+    def cancel(self, upload_id, remove_part=True):
+        """取消上传并删除临时文件"""
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+        if not upload:
+            return
+        with upload.lock:
+            try:
+                upload.file.close()
+                if remove_part:
+                    upload.sftp.remove(upload.part_path)
+            except Exception:
+                pass
+            self._discard(upload)
+
+    def abort_session(self, session_id):
+        """终端关闭时关闭该会话的所有上传（保留临时文件以便续传）"""
+        with self.lock:
+            upload_ids = [u.upload_id for u in self.uploads.values() if u.session_id == session_id]
+        for upload_id in upload_ids:
+            self.cancel(upload_id, remove_part=False)
+
+    def _get(self, upload_id):
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+        if not upload:
+            raise TransferError('上传不存在或已结束')
+        return upload
+
+    def _discard(self, upload):
+        with self.lock:
+            if self.uploads.get(upload.upload_id) is upload:
+                del self.uploads[upload.upload_id]
+        upload.close()
+
+    def _describe(self, upload):
+        return {
+            'upload_id': upload.upload_id,
+            'offset': upload.offset,
+            'chunk_size': self.chunk_size,
+            'remote_path': upload.remote_path
+        }
+
+
+class DownloadTicket:
+    """下载凭证：绑定终端会话和远程路径，供浏览器直接发起HTTP下载"""
+    def __init__(self, token, session_id, path, name, size, mtime, is_dir):
+        self.token = token
+        self.session_id = session_id
+        self.path = path
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.is_dir = is_dir
+        self.created_at = time.monotonic()
+
+    @property
+    def etag(self):
+        """由大小和修改时间生成，续传时用于判断文件是否已变化"""
+        return f'{self.size:x}-{self.mtime:x}'
+
+
+class DownloadManager:
+    """管理下载凭证并生成下载数据流"""
+    def __init__(self, config=None):
+        config = config or {}
+        # 每个窗口内的读请求一次性发出（流水线），读完一个窗口再发下一个
+        self.prefetch_window = config.get('prefetch_window', 4194304)
+        self.request_size = config.get('request_size', 32768)
+        self.ticket_ttl = config.get('ticket_ttl', 600)
+        self.tickets = {}  # token -> DownloadTicket
+        self.lock = threading.Lock()
+
+    def create_ticket(self, conn, session_id, path):
+        """
+        检查远程路径并生成下载凭证
+
+        :return: {'token', 'name', 'size', 'is_dir'}
+        """
+        path = (path or '').strip()
+        if not path.startswith('/'):
+            raise TransferError(f'下载路径必须是绝对路径: {path}')
+        path = posixpath.normpath(path)
+
+        sftp = conn.open_sftp()
+        try:
+            attr = sftp.stat(path)
+        except IOError as e:
+            raise TransferError(f'无法访问远程路径 {path}: {e}')
+        finally:
+            sftp.close()
+
+        is_dir = stat.S_ISDIR(attr.st_mode or 0)
+        if not is_dir and not stat.S_ISREG(attr.st_mode or 0):
+            raise TransferError(f'只支持下载普通文件或目录: {path}')
+        name = posixpath.basename(path) or 'root'
+        ticket = DownloadTicket(
+            uuid.uuid4().hex,
+            session_id,
+            path,
+            name + '.tar' if is_dir else name,
+            0 if is_dir else attr.st_size,
+            int(attr.st_mtime or 0),
+            is_dir
+        )
+        with self.lock:
+            self._prune()
+            self.tickets[ticket.token] = ticket
+        return {'token': ticket.token, 'name': ticket.name, 'size': ticket.size, 'is_dir': is_dir}
+
+    def get_ticket(self, token):
+        with self.lock:
+            self._prune()
+            ticket = self.tickets.get(token)
+        if not ticket:
+            raise TransferError('下载链接不存在或已过期')
+        return ticket
+
+    def abort_session(self, session_id):
+        """终端关闭时作废该会话的下载凭证（进行中的下载不受影响）"""
+        with self.lock:
+            for token in [t for t, ticket in self.tickets.items() if ticket.session_id == session_id]:
+                del self.tickets[token]
+
+    def _prune(self):
+        """删除过期凭证（调用方需持有锁）"""
+        now = time.monotonic()
+        for token in [t for t, ticket in self.tickets.items() if now - ticket.created_at > self.ticket_ttl]:
+            del self.tickets[token]
+
+    def stream_file(self, conn, ticket, start=0, stop=None):
+        """
+        流式读取文件的 [start, stop) 区间
+
+        返回生成器；响应结束或客户端断开时关闭SFTP会话。
+        """
+        stop = ticket.size if stop is None else stop
+        sftp = conn.open_sftp()
+        try:
+            remote_file = sftp.open(ticket.path, 'rb')
+        except IOError as e:
+            sftp.close()
+            raise TransferError(f'无法读取远程文件 {ticket.path}: {e}')
+
+        def generate():
+            try:
+                for data in self._read_range(remote_file, start, stop):
+                    yield data
+            finally:
+                remote_file.close()
+                sftp.close()
+        return generate()
+
+    def stream_tar(self, conn, ticket):
+        """把远程目录打包为tar流（边读边发，不在服务端生成临时文件）"""
+        sftp = conn.open_sftp()
+
+        def generate():
+            written = 0
+            try:
+                for path, arcname, attr in self._walk(sftp, ticket.path, ticket.name[:-len('.tar')]):
+                    for data in self._tar_member(sftp, path, arcname, attr):
+                        written += len(data)
+                        yield data
+                # 两个全零块表示归档结束，再补齐到tar记录大小
+                end = tarfile.BLOCKSIZE * 2
+                end += -(written + end) % tarfile.RECORDSIZE
+                yield tarfile.NUL * end
+            finally:
+                sftp.close()
+        return generate()
+
+    def _read_range(self, remote_file, start, stop):
+        """按窗口流水线读取：每个窗口的读请求一起发出，按顺序产出数据"""
+        pos = start
+        while pos < stop:
+            window_end = min(stop, pos + self.prefetch_window)
+            chunks = [
+                (offset, min(self.request_size, window_end - offset))
+                for offset in range(pos, window_end, self.request_size)
+            ]
+            try:
+                for data in remote_file.readv(chunks):
+                    if not data:
+                        return
+                    yield data
+                    pos += len(data)
+            except EOFError:
+                return  # 文件在读取过程中被截短
+            if pos < window_end:
+                return
+
+    def _walk(self, sftp, path, arcname):
+        """深度优先遍历远程目录，产出 (远程路径, tar成员名, 属性)；无权限的子目录跳过"""
+        yield path, arcname, sftp.stat(path)
+        try:
+            entries = sorted(sftp.listdir_attr(path), key=lambda a: a.filename)
+        except IOError as e:
+            print(f"⚠️ 跳过无法读取的目录 {path}: {e}")
+            return
+        for attr in entries:
+            child = posixpath.join(path, attr.filename)
+            child_arcname = posixpath.join(arcname, attr.filename)
+            if stat.S_ISDIR(attr.st_mode or 0):
+                yield from self._walk(sftp, child, child_arcname)
+            else:
+                yield child, child_arcname, attr
+
+    def _tar_member(self, sftp, path, arcname, attr):
+        """生成一个tar成员（头部 + 数据 + 补齐块）"""
+        mode = attr.st_mode or 0
+        info = tarfile.TarInfo(arcname)
+        info.mode = stat.S_IMODE(mode)
+        info.mtime = int(attr.st_mtime or 0)
+        info.uid = attr.st_uid or 0
+        info.gid = attr.st_gid or 0
+
+        remote_file = None
+        if stat.S_ISDIR(mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(mode):
+            info.type = tarfile.SYMTYPE
+            try:
+                info.linkname = sftp.readlink(path) or ''
+            except IOError as e:
+                print(f"⚠️ 跳过无法读取的符号链接 {path}: {e}")
+                return
+        elif stat.S_ISREG(mode):
+            info.size = attr.st_size or 0
+            try:
+                remote_file = sftp.open(path, 'rb')
+            except IOError as e:
+                print(f"⚠️ 跳过无法读取的文件 {path}: {e}")
+                return
+        else:
+            return  # 设备文件、管道等不打包
+
+        yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        if remote_file is None:
+            return
+
+        # 只发送列目录时的大小；文件变短或读取出错时用0补齐，保证归档结构完整
+        sent = 0
+        try:
+            for data in self._read_range(remote_file, 0, info.size):
+                sent += len(data)
+                yield data
+        except (IOError, EOFError) as e:
+            print(f"⚠️ 读取文件 {path} 中断，剩余部分以0填充: {e}")
+        finally:
+            remote_file.close()
+        if sent < info.size:
+            yield tarfile.NUL * (info.size - sent)
+        if info.size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - info.size % tarfile.BLOCKSIZE)
@@ -0,0 +1,149 @@
+"""
+SQLite 性能配置
+
+每个新建的数据库连接上执行 PRAGMA：
+- journal_mode=WAL: 读写互不阻塞，请求线程、登录信息采集和后台清理不再在回滚日志上串行
+- synchronous=NORMAL: WAL模式下只在检查点时 fsync，断电最多丢失最后几个事务，不会损坏数据库
+- busy_timeout: 写锁被占用时等待而不是立即报 "database is locked"
+- cache_size / mmap_size / temp_store: 页缓存、内存映射读取和临时表放在内存中
+
+WAL文件由 wal_autocheckpoint 自动回写，后台线程再按 checkpoint_interval 定期执行 PASSIVE 检查点
+（不阻塞读写）；WAL文件超过 checkpoint_truncate_bytes 时执行 TRUNCATE 检查点把文件截断。
+
+gevent模式下 busy_timeout 的等待会阻塞整个进程，写事务中不要做网络I/O，保持事务尽量短。
+"""
+import os
+import threading
+import time
+from sqlalchemy import event
+
+DEFAULT_SETTINGS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout_ms': 5000,
+    'cache_size_kb': 20480,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+    'wal_autocheckpoint': 1000,  # 页数
+    'checkpoint_interval': 60,  # 秒，0 表示不执行定期检查点
+    'checkpoint_truncate_bytes': 67108864
+}
+
+# 取值为关键字的 PRAGMA 的合法值
+ALLOWED_VALUES = {
+    'journal_mode': ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'),
+    'synchronous': ('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    'temp_store': ('DEFAULT', 'FILE', 'MEMORY')
+}
+
+
+class SQLiteTuning:
+    """SQLite 连接参数与检查点策略"""
+    def __init__(self, config=None):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(config or {})
+        for name, allowed in ALLOWED_VALUES.items():
+            value = str(self.settings[name]).upper()
+            if value not in allowed:
+                print(f"⚠️ 不支持的 {name}: {self.settings[name]}，可选: {', '.join(allowed)}，使用 {DEFAULT_SETTINGS[name]}")
+                value = DEFAULT_SETTINGS[name]
+            self.settings[name] = value
+        self.engine = None
+        self.lock = threading.Lock()
+        self._thread = None
+        self.stats = {
+            'checkpoints': 0,
+            'truncate_checkpoints': 0,
+            'busy_checkpoints': 0,
+            'failed_checkpoints': 0,
+            'last_checkpoint_ms': 0,
+            'last_checkpoint_frames': 0
+        }
+
+    def install(self, engine):
+        """在引擎上注册连接初始化钩子（需在第一个连接建立之前调用），非SQLite引擎不做处理"""
+        if engine.dialect.name != 'sqlite':
+            return False
+        self.engine = engine
+        event.listen(engine, 'connect', self._on_connect)
+        return True
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        s = self.settings
+        cursor = dbapi_connection.cursor()
+        try:
+            # busy_timeout 放在最前面：切换 journal_mode 时也可能需要等待锁
+            cursor.execute(f"PRAGMA busy_timeout = {int(s['busy_timeout_ms'])}")
+            # journal_mode=WAL 保存在数据库文件中，之后的连接上执行只是确认
+            cursor.execute(f"PRAGMA journal_mode = {s['journal_mode']}")
+            cursor.execute(f"PRAGMA synchronous = {s['synchronous']}")
+            cursor.execute(f"PRAGMA cache_size = {-int(s['cache_size_kb'])}")
+            cursor.execute(f"PRAGMA mmap_size = {int(s['mmap_size'])}")
+            cursor.execute(f"PRAGMA temp_store = {s['temp_store']}")
+            cursor.execute(f"PRAGMA wal_autocheckpoint = {int(s['wal_autocheckpoint'])}")
+        finally:
+            cursor.close()
+
+    @property
+    def wal_path(self):
+        return f'{self.engine.url.database}-wal' if self.engine else None
+
+    def wal_size(self):
+        try:
+            return os.path.getsize(self.wal_path)
+        except (OSError, TypeError):
+            return 0
+
+    def checkpoint(self, mode=None):
+        """
+        执行一次检查点：默认 PASSIVE，WAL文件超过阈值时 TRUNCATE
+
+        :return: (busy, WAL总帧数, 已回写帧数)
+        """
+        if mode is None:
+            mode = 'TRUNCATE' if self.wal_size() >= self.settings['checkpoint_truncate_bytes'] else 'PASSIVE'
+        started = time.monotonic()
+        with self.engine.connect() as conn:
+            busy, log_frames, checkpointed = conn.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        with self.lock:
+            self.stats['checkpoints'] += 1
+            if mode == 'TRUNCATE':
+                self.stats['truncate_checkpoints'] += 1
+            if busy:
+                # 有读事务或写事务未结束，部分帧留到下一次
+                self.stats['busy_checkpoints'] += 1
+            self.stats['last_checkpoint_ms'] = int((time.monotonic() - started) * 1000)
+            self.stats['last_checkpoint_frames'] = checkpointed
+        return busy, log_frames, checkpointed
+
+    def start_checkpointer(self):
+        """启动定期检查点线程（仅WAL模式）"""
+        interval = self.settings['checkpoint_interval']
+        if not self.engine or self.settings['journal_mode'] != 'WAL' or not interval:
+            return False
+        with self.lock:
+            if self._thread is not None:
+                return True
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='sqlite-checkpoint', daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.checkpoint()
+            except Exception as e:
+                with self.lock:
+                    self.stats['failed_checkpoints'] += 1
+                print(f"❌ WAL检查点失败: {e}")
+
+    def get_stats(self):
+        """当前设置与检查点指标"""
+        with self.lock:
+            return dict(
+                self.stats,
+                journal_mode=self.settings['journal_mode'],
+                synchronous=self.settings['synchronous'],
+                wal_size=self.wal_size() if self.engine else 0
+            )
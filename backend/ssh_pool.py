@@ -0,0 +1,285 @@
+"""
+SSH连接池模块 - 按设备复用已认证的SSH传输层
+
+终端、登录信息采集和SFTP上传都通过同一个 paramiko.Transport 打开新的通道，
+避免每次都重新进行TCP握手、密钥交换和密码认证。
+"""
+import hmac
+import threading
+import time
+import paramiko
+
+
+class PooledTransport:
+    """连接池中的一条已认证SSH传输"""
+    def __init__(self, key, client, password):
+        self.key = key  # (host, port, username)
+        self.client = client
+        self.transport = client.get_transport()
+        self.password = password
+        self.sessions = 0  # 当前借出的会话数
+        self.capacity = None  # 服务端拒绝开新通道时记录的实际会话上限
+        self.last_used = time.monotonic()
+        self.created_at = time.monotonic()
+
+    def is_active(self):
+        return self.transport is not None and self.transport.is_active()
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+class SSHLease:
+    """
+    从连接池借出的传输层
+
+    使用完毕后必须调用 release()，也可以作为上下文管理器使用。
+    """
+    def __init__(self, pool, entry):
+        self.pool = pool
+        self.entry = entry
+        self.transport = entry.transport
+        self.released = False
+
+    def open_session(self, timeout=None):
+        """在共享传输上打开一个新通道"""
+        return self.transport.open_session(timeout=timeout)
+
+    def open_sftp(self):
+        """在共享传输上打开SFTP会话"""
+        return paramiko.SFTPClient.from_transport(self.transport)
+
+    def exec_command(self, command, timeout=None):
+        """执行命令并返回标准输出文本"""
+        channel = self.open_session(timeout=timeout)
+        try:
+            if timeout is not None:
+                channel.settimeout(timeout)
+            channel.exec_command(command)
+            stdout = channel.makefile('rb')
+            return stdout.read().decode('utf-8', errors='ignore')
+        finally:
+            channel.close()
+
+    def mark_full(self):
+        """服务端拒绝在该传输上再开通道（如超过MaxSessions），之后不再向其分配新会话"""
+        with self.pool.lock:
+            self.entry.capacity = max(1, self.entry.sessions - 1)
+
+    def discard(self):
+        """传输已损坏时丢弃，不再复用"""
+        if not self.released:
+            self.released = True
+            self.pool._release(self.entry, discard=True)
+
+    def release(self):
+        """归还到连接池"""
+        if not self.released:
+            self.released = True
+            self.pool._release(self.entry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class SSHTransportPool:
+    """
+    SSH传输连接池
+
+    以 (host, port, username) 为键缓存已认证的传输层，每条传输最多承载
+    max_sessions_per_transport 个会话（服务端拒绝开通道后以实际上限为准），
+    同一 (host, port, username) 最多 max_transports_per_host 条传输（不论密码），
+    都已满时先关闭一条空闲的传输腾出位置，没有空闲传输则等待会话归还，
+    空闲超过 idle_timeout 秒的传输由后台线程关闭。
+    """
+    def __init__(self, config=None):
+        config = config or {}
+        self.max_transports_per_host = config.get('max_transports_per_host', 4)
+        # OpenSSH 默认 MaxSessions 为10，这里留出余量
+        self.max_sessions_per_transport = config.get('max_sessions_per_transport', 8)
+        self.idle_timeout = config.get('idle_timeout', 300)
+        self.keepalive_interval = config.get('keepalive_interval', 30)
+        self.connect_timeout = config.get('connect_timeout', 10)
+        self.entries = {}  # key -> [PooledTransport]
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)  # 有会话归还或传输关闭
+        self.key_locks = {}  # key -> 建立连接时使用的锁，避免同一设备并发重复握手
+        self._evictor = None
+        self._stop = threading.Event()
+
+    def acquire(self, host, port, username, password, timeout=None):
+        """
+        借出一条到目标设备的已认证传输
+
+        认证/网络错误与 paramiko.SSHClient.connect 抛出的异常一致；
+        传输数已达上限且在 timeout 秒内没有空出位置时抛出 paramiko.SSHException。
+        """
+        key = (host, int(port), username)
+        lease = self._try_reuse(key, password)
+        if lease:
+            return lease
+
+        timeout = timeout or self.connect_timeout
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            deadline = time.monotonic() + timeout
+            with self.slot_freed:
+                while True:
+                    # 等待期间可能已有其他线程建立了连接或归还了会话
+                    lease = self._reuse_locked(key, password)
+                    if lease:
+                        return lease
+                    alive = self.entries.get(key, [])
+                    if len(alive) < self.max_transports_per_host:
+                        victim = None
+                        break
+                    # 传输数已达上限且都不可复用（会话已满或密码不同）：关闭最久未用的空闲传输腾出位置
+                    idle = [e for e in alive if e.sessions == 0]
+                    if idle:
+                        victim = min(idle, key=lambda e: e.last_used)
+                        alive.remove(victim)
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise paramiko.SSHException(
+                            f"到 {host}:{port} 的SSH连接数（{self.max_transports_per_host}）和会话数均已达上限，请稍后重试")
+                    self.slot_freed.wait(remaining)
+            if victim is not None:
+                victim.close()
+            entry = self._connect(key, password, timeout)
+            with self.lock:
+                self.entries.setdefault(key, []).append(entry)
+                entry.sessions += 1
+                entry.last_used = time.monotonic()
+        self._start_evictor()
+        return SSHLease(self, entry)
+
+    def _try_reuse(self, key, password):
+        """查找可复用的传输，找不到返回None"""
+        with self.lock:
+            return self._reuse_locked(key, password)
+
+    def _reuse_locked(self, key, password):
+        """_try_reuse 的实现，调用方需持有 self.lock"""
+        entries = self.entries.get(key, [])
+        alive = []
+        for entry in entries:
+            if entry.is_active():
+                alive.append(entry)
+            else:
+                entry.close()
+        self.entries[key] = alive
+
+        # 密码不一致时不能复用他人已认证的传输
+        candidates = [e for e in alive if hmac.compare_digest(e.password or '', password or '')]
+        available = [
+            e for e in candidates
+            if e.sessions < min(self.max_sessions_per_transport, e.capacity or self.max_sessions_per_transport)
+        ]
+        if not available:
+            return None
+        entry = min(available, key=lambda e: e.sessions)
+        entry.sessions += 1
+        entry.last_used = time.monotonic()
+        return SSHLease(self, entry)
+
+    def _connect(self, key, password, timeout):
+        """建立新的SSH传输"""
+        host, port, username = key
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            client.connect(
+                host,
+                port=port,
+                username=username,
+                password=password,
+                timeout=timeout,
+                banner_timeout=timeout,
+                auth_timeout=timeout
+            )
+        except Exception:
+            # 认证失败等情况下传输层线程已启动，需要显式关闭
+            client.close()
+            raise
+        if self.keepalive_interval:
+            client.get_transport().set_keepalive(self.keepalive_interval)
+        return PooledTransport(key, client, password)
+
+    def _release(self, entry, discard=False):
+        with self.lock:
+            entry.sessions = max(0, entry.sessions - 1)
+            entry.last_used = time.monotonic()
+            if discard:
+                entries = self.entries.get(entry.key, [])
+                if entry in entries:
+                    entries.remove(entry)
+            self.slot_freed.notify_all()
+        if discard:
+            entry.close()
+
+    def _start_evictor(self):
+        if self._evictor is None:
+            self._evictor = threading.Thread(target=self._evict_loop, name='ssh-pool-evictor', daemon=True)
+            self._evictor.start()
+
+    def _evict_loop(self):
+        """定期关闭空闲或失效的传输"""
+        interval = max(1, min(30, self.idle_timeout / 2))
+        while not self._stop.wait(interval):
+            self.evict_idle()
+
+    def evict_idle(self):
+        """关闭空闲超时或已断开的传输，返回关闭的数量"""
+        now = time.monotonic()
+        closing = []
+        with self.lock:
+            for key, entries in list(self.entries.items()):
+                keep = []
+                for entry in entries:
+                    if not entry.is_active() or (entry.sessions == 0 and now - entry.last_used > self.idle_timeout):
+                        closing.append(entry)
+                    else:
+                        keep.append(entry)
+                if keep:
+                    self.entries[key] = keep
+                else:
+                    del self.entries[key]
+            if closing:
+                self.slot_freed.notify_all()
+        for entry in closing:
+            entry.close()
+        return len(closing)
+
+    def get_stats(self):
+        """连接池状态（用于排查）"""
+        now = time.monotonic()
+        with self.lock:
+            return [
+                {
+                    'host': key[0],
+                    'port': key[1],
+                    'username': key[2],
+                    'sessions': entry.sessions,
+                    'active': entry.is_active(),
+                    'idle_seconds': round(now - entry.last_used, 1)
+                }
+                for key, entries in self.entries.items()
+                for entry in entries
+            ]
+
+    def close_all(self):
+        """关闭所有传输"""
+        self._stop.set()
+        with self.lock:
+            entries = [e for es in self.entries.values() for e in es]
+            self.entries = {}
+        for entry in entries:
+            entry.close()
@@ -0,0 +1,76 @@
+"""
+表变更版本模块
+
+监听SQLAlchemy会话：flush 时记录本次事务修改过的表（包括 Query.update/delete 批量操作和直接执行的写语句），
+事务提交成功后把这些表的版本号加一，回滚则丢弃。列表接口用相关表的版本号生成强ETag，
+客户端的 If-None-Match 与之一致时直接返回 304，无需查询和序列化。
+"""
+import threading
+import uuid
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class TableVersions:
+    """按表记录的变更版本号（进程内）"""
+    def __init__(self):
+        # 服务重启后版本号重新计数，ETag中带上epoch避免与重启前的缓存混淆
+        self.epoch = uuid.uuid4().hex[:8]
+        self.versions = {}
+        self.lock = threading.Lock()
+        self._installed = False
+
+    def install(self):
+        """注册会话事件（对所有会话生效，包括后台线程中的会话）"""
+        if self._installed:
+            return
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'do_orm_execute', self._on_orm_execute)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+        self._installed = True
+
+    def etag(self, *tables):
+        """由相关表的版本号组成的ETag"""
+        with self.lock:
+            return '-'.join([self.epoch] + [str(self.versions.get(table, 0)) for table in tables])
+
+    def bump(self, *tables):
+        """手动标记表已变化（用于绕过ORM直接执行的SQL）"""
+        with self.lock:
+            for table in tables:
+                self.versions[table] = self.versions.get(table, 0) + 1
+
+    @staticmethod
+    def _touched(session):
+        return session.info.setdefault('touched_tables', set())
+
+    def _after_flush(self, session, flush_context):
+        # after_flush 中 new/dirty/deleted 仍是本次 flush 之前的状态
+        touched = self._touched(session)
+        for obj in session.new:
+            touched.add(obj.__table__.name)
+        for obj in session.deleted:
+            touched.add(obj.__table__.name)
+        for obj in session.dirty:
+            if session.is_modified(obj, include_collections=False):
+                touched.add(obj.__table__.name)
+
+    def _on_orm_execute(self, orm_execute_state):
+        # Query.update() / Query.delete() 批量操作以及直接执行的 insert/update/delete 语句都不经过 flush
+        if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        if orm_execute_state.bind_mapper is not None:
+            name = orm_execute_state.bind_mapper.local_table.name
+        else:
+            name = getattr(getattr(orm_execute_state.statement, 'table', None), 'name', None)
+        if name:
+            self._touched(orm_execute_state.session).add(name)
+
+    def _after_commit(self, session):
+        touched = session.info.pop('touched_tables', None)
+        if touched:
+            self.bump(*touched)
+
+    def _after_rollback(self, session):
+        session.info.pop('touched_tables', None)
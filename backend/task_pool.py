@@ -0,0 +1,163 @@
+"""
+后台任务池模块
+
+固定数量的工作线程 + 有界队列，用于占用设备时采集登录信息等后台任务：
+- 同一个 key 的任务在队列中只保留一个，并且不会并发执行
+- 记录队列深度、任务耗时等指标
+- 进程退出时停止接收新任务，并在超时时间内执行完已排队的任务
+"""
+import atexit
+import threading
+import time
+from collections import deque
+
+
+class BackgroundTask:
+    """排队中的后台任务"""
+    def __init__(self, fn, args, kwargs, key):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.submitted_at = time.monotonic()
+
+
+class BackgroundTaskPool:
+    """有界后台任务池"""
+    def __init__(self, max_workers=4, max_queue=200, shutdown_timeout=10, name='background'):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.shutdown_timeout = shutdown_timeout
+        self.name = name
+        self.pending = deque()
+        self.pending_keys = set()
+        self.running_keys = set()
+        self.running = 0
+        self.idle = 0  # 正在等待任务的工作线程数
+        self.cond = threading.Condition()
+        self.workers = []
+        self.shutting_down = False
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'deduplicated': 0,
+            'rejected': 0,
+            'total_duration_ms': 0,
+            'max_duration_ms': 0,
+            'max_wait_ms': 0
+        }
+        atexit.register(self.shutdown)
+
+    def submit(self, fn, *args, key=None, **kwargs):
+        """
+        提交任务
+
+        :param key: 去重键，同一个键在队列中只保留一个任务，且不会与正在执行的同键任务并发
+        :return: True 表示已排队（或已有相同任务在排队），False 表示队列已满或正在关闭
+        """
+        with self.cond:
+            if self.shutting_down:
+                self.stats['rejected'] += 1
+                return False
+            if key is not None and key in self.pending_keys:
+                self.stats['deduplicated'] += 1
+                return True
+            if len(self.pending) >= self.max_queue:
+                self.stats['rejected'] += 1
+                return False
+            self.pending.append(BackgroundTask(fn, args, kwargs, key))
+            if key is not None:
+                self.pending_keys.add(key)
+            self.stats['submitted'] += 1
+            self._ensure_workers()
+            self.cond.notify()
+        return True
+
+    def _ensure_workers(self):
+        """按需启动工作线程（调用方需持有锁）"""
+        if len(self.pending) > self.idle and len(self.workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._worker,
+                name=f'{self.name}-worker-{len(self.workers) + 1}',
+                daemon=True
+            )
+            self.workers.append(worker)
+            worker.start()
+
+    def _next_task(self):
+        """取出第一个键不在执行中的任务（调用方需持有锁）"""
+        for task in self.pending:
+            if task.key is None or task.key not in self.running_keys:
+                self.pending.remove(task)
+                if task.key is not None:
+                    self.pending_keys.discard(task.key)
+                    self.running_keys.add(task.key)
+                return task
+        return None
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                task = self._next_task()
+                while task is None:
+                    if self.shutting_down and not self.pending:
+                        return
+                    self.idle += 1
+                    self.cond.wait()
+                    self.idle -= 1
+                    task = self._next_task()
+                self.running += 1
+
+            started = time.monotonic()
+            failed = False
+            try:
+                task.fn(*task.args, **task.kwargs)
+            except Exception as e:
+                failed = True
+                print(f"[ERROR] 后台任务执行失败 ({task.key}): {type(e).__name__}: {e}")
+            duration_ms = int((time.monotonic() - started) * 1000)
+            wait_ms = int((started - task.submitted_at) * 1000)
+
+            with self.cond:
+                self.running -= 1
+                if task.key is not None:
+                    self.running_keys.discard(task.key)
+                self.stats['failed' if failed else 'completed'] += 1
+                self.stats['total_duration_ms'] += duration_ms
+                self.stats['max_duration_ms'] = max(self.stats['max_duration_ms'], duration_ms)
+                self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+                # 可能有等待同键任务结束的任务
+                self.cond.notify_all()
+
+    def get_stats(self):
+        """任务池指标"""
+        with self.cond:
+            finished = self.stats['completed'] + self.stats['failed']
+            return dict(
+                self.stats,
+                queue_depth=len(self.pending),
+                running=self.running,
+                workers=len(self.workers),
+                max_workers=self.max_workers,
+                max_queue=self.max_queue,
+                avg_duration_ms=int(self.stats['total_duration_ms'] / finished) if finished else 0
+            )
+
+    def shutdown(self, wait=True):
+        """停止接收新任务，等待已排队的任务完成（最多 shutdown_timeout 秒）"""
+        with self.cond:
+            if self.shutting_down:
+                return
+            self.shutting_down = True
+            self.cond.notify_all()
+        if wait:
+            deadline = time.monotonic() + self.shutdown_timeout
+            for worker in self.workers:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                worker.join(remaining)
+            with self.cond:
+                if self.pending or self.running:
+                    print(f"⚠️ 后台任务池关闭超时，放弃 {len(self.pending)} 个排队任务")
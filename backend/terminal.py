@@ -1,61 +1,75 @@
 """
 Web终端模块 - 支持SSH和Telnet连接
 """
+import codecs
 import paramiko
+import selectors
 import socket
 import threading
 import time
 from flask_socketio import emit
+from ssh_pool import SSHTransportPool
 
 class SSHConnection:
     """SSH连接管理"""
-    def __init__(self, host, port, username, password):
+    def __init__(self, host, port, username, password, recv_size=32768, pool=None):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
-        self.client = None
+        self.recv_size = recv_size  # 单次读取的最大字节数
+        self.pool = pool or SSHTransportPool()
+        self.lease = None  # 从连接池借出的已认证传输
         self.channel = None
         self.connected = False
+        # 增量解码，避免多字节UTF-8字符被读取边界截断后丢失
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
         
     def connect(self):
         """建立SSH连接"""
         try:
-            self.client = paramiko.SSHClient()
-            self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self.client.connect(
-                self.host,
-                port=self.port,
-                username=self.username,
-                password=self.password,
-                timeout=10
-            )
+            # 同一设备已有认证过的传输时直接复用，只需新开一个通道
+            self.lease = self.pool.acquire(self.host, self.port, self.username, self.password, timeout=10)
+            try:
+                self.channel = self.lease.open_session(timeout=10)
+            except paramiko.ChannelException:
+                # 共享传输上的会话数已达服务端上限，换一条传输
+                self.lease.mark_full()
+                self.lease.release()
+                self.lease = self.pool.acquire(self.host, self.port, self.username, self.password, timeout=10)
+                self.channel = self.lease.open_session(timeout=10)
             # 创建伪终端，设置终端类型和大小
-            self.channel = self.client.invoke_shell(
+            self.channel.get_pty(
                 term='xterm',  # 设置终端类型为xterm
                 width=80,      # 终端宽度
                 height=24      # 终端高度
             )
+            self.channel.invoke_shell()
             self.channel.settimeout(0.1)
             self.connected = True
             return True, "连接成功"
         except paramiko.AuthenticationException:
+            self.close()
             error_msg = f"SSH认证失败: 用户名或密码错误"
             print(error_msg)
             return False, error_msg
         except paramiko.SSHException as e:
+            self.close()
             error_msg = f"SSH连接错误: {str(e)}"
             print(error_msg)
             return False, error_msg
         except socket.timeout:
+            self.close()
             error_msg = f"SSH连接超时: 无法连接到 {self.host}:{self.port}"
             print(error_msg)
             return False, error_msg
         except socket.error as e:
+            self.close()
             error_msg = f"网络错误: {str(e)}"
             print(error_msg)
             return False, error_msg
         except Exception as e:
+            self.close()
             error_msg = f"SSH连接失败: {str(e)}"
             print(error_msg)
             return False, error_msg
@@ -77,35 +91,45 @@ class SSHConnection:
         if self.channel and self.connected:
             try:
                 if self.channel.recv_ready():
-                    return self.channel.recv(1024).decode('utf-8', errors='ignore')
+                    return self.decoder.decode(self.channel.recv(self.recv_size))
+                if self.channel.closed or self.channel.eof_received:
+                    # 远端已关闭（如执行了exit）
+                    self.connected = False
             except Exception as e:
                 if 'timed out' not in str(e):
                     print(f"接收数据失败: {e}")
                     self.connected = False
         return None
     
+    def fileno(self):
+        """返回可用于select/epoll的文件描述符（paramiko通道有数据时变为可读）"""
+        return self.channel.fileno()
+    
+    def open_sftp(self):
+        """在同一条SSH传输上打开SFTP会话"""
+        return self.lease.open_sftp()
+    
     def close(self):
-        """关闭连接"""
+        """关闭连接（只关闭通道，传输归还连接池）"""
         self.connected = False
         if self.channel:
             try:
                 self.channel.close()
             except:
                 pass
-        if self.client:
-            try:
-                self.client.close()
-            except:
-                pass
+        if self.lease:
+            self.lease.release()
 
 
 class TelnetConnection:
     """Telnet连接管理（使用原始socket）"""
-    def __init__(self, host, port):
+    def __init__(self, host, port, recv_size=32768):
         self.host = host
         self.port = port
+        self.recv_size = recv_size  # 单次读取的最大字节数
         self.client = None
         self.connected = False
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
         
     def connect(self):
         """建立Telnet连接"""
@@ -149,9 +173,11 @@ class TelnetConnection:
         """接收数据"""
         if self.client and self.connected:
             try:
-                data = self.client.recv(4096)
+                data = self.client.recv(self.recv_size)
                 if data:
-                    return data.decode('utf-8', errors='ignore')
+                    return self.decoder.decode(data)
+                # recv返回空表示对端已关闭连接
+                self.connected = False
             except BlockingIOError:
                 # 非阻塞模式下没有数据
                 return None
@@ -161,6 +187,10 @@ class TelnetConnection:
                     self.connected = False
         return None
     
+    def fileno(self):
+        """返回socket的文件描述符"""
+        return self.client.fileno()
+    
     def close(self):
         """关闭连接"""
         self.connected = False
@@ -171,12 +201,155 @@ class TelnetConnection:
                 pass
 
 
+class TerminalReactor:
+    """
+    终端I/O多路复用器
+    
+    单个线程通过selectors（Linux下为epoll）等待所有会话的文件描述符，
+    只有可读时才回调处理，空闲会话不占用CPU。gevent模式下线程、selectors和socket
+    均已被替换为协程实现，反应器作为一个协程运行。
+    注册/注销操作通过队列交给反应器线程执行，保证selector只在一个线程中被修改。
+    """
+    def __init__(self, on_readable, on_timer=None):
+        self.on_readable = on_readable  # 回调: on_readable(session_id) -> 是否继续监听
+        self.on_timer = on_timer  # 回调: on_timer() -> 距下次定时处理的秒数，None表示无定时任务
+        self.selector = selectors.DefaultSelector()
+        self.fds = {}  # session_id -> 已注册的文件描述符
+        self._pending = []  # 待执行的 (操作, session_id, 连接对象)
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self._thread = None
+    
+    def start(self):
+        """启动反应器线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='terminal-reactor', daemon=True)
+            self._thread.start()
+    
+    def register(self, session_id, conn):
+        """开始监听会话的可读事件"""
+        self._submit('register', session_id, conn)
+    
+    def unregister(self, session_id):
+        """停止监听会话"""
+        self._submit('unregister', session_id, None)
+    
+    def wakeup(self):
+        """唤醒反应器线程，使其立即执行一次定时处理"""
+        self._submit('wakeup', None, None)
+    
+    def _submit(self, op, session_id, conn):
+        with self._lock:
+            self._pending.append((op, session_id, conn))
+        self.start()
+        try:
+            self._wakeup_w.send(b'\0')
+        except OSError:
+            pass
+    
+    def _apply_pending(self):
+        """在反应器线程中按顺序执行注册/注销操作"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for op, session_id, conn in pending:
+            if op == 'wakeup':
+                continue
+            old_fd = self.fds.pop(session_id, None)
+            if old_fd is not None:
+                self._safe_unregister(old_fd)
+            if op == 'register':
+                try:
+                    # 直接注册整数fd，连接关闭后注销时无需再调用fileno()
+                    fd = conn.fileno()
+                    self.selector.register(fd, selectors.EVENT_READ, session_id)
+                    self.fds[session_id] = fd
+                except (ValueError, KeyError, OSError) as e:
+                    print(f"注册终端会话失败: {session_id}: {e}")
+    
+    def _safe_unregister(self, fd):
+        try:
+            self.selector.unregister(fd)
+        except (ValueError, KeyError, OSError):
+            pass
+    
+    def _run(self):
+        """反应器主循环"""
+        while True:
+            self._apply_pending()
+            timeout = None
+            if self.on_timer:
+                try:
+                    timeout = self.on_timer()
+                except Exception as e:
+                    print(f"终端定时任务失败: {e}")
+            try:
+                events = self.selector.select(timeout)
+            except OSError as e:
+                print(f"终端多路复用等待失败: {e}")
+                continue
+            for key, _ in events:
+                if key.data is None:
+                    # 唤醒通知，清空唤醒管道
+                    try:
+                        while self._wakeup_r.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                session_id = key.data
+                if self.fds.get(session_id) != key.fd:
+                    continue
+                try:
+                    keep = self.on_readable(session_id)
+                except Exception as e:
+                    print(f"处理终端输出失败: {session_id}: {e}")
+                    keep = False
+                if not keep:
+                    self.fds.pop(session_id, None)
+                    self._safe_unregister(key.fd)
+            if events:
+                # 协程模式下让出执行权，避免持续输出的会话独占事件循环（线程模式下只是释放GIL）
+                time.sleep(0)
+
+
+class OutputBuffer:
+    """会话输出合并缓冲区"""
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.deadline = None  # 计划发送时间（time.monotonic）
+        self.last_flush = 0.0  # 上次发送时间
+        self.unacked = 0  # 已发送但客户端尚未确认的字符数
+        self.paused = False  # 是否因客户端处理过慢而暂停
+        self.dropped = 0  # 暂停期间丢弃的字符数
+
+
 class TerminalManager:
     """终端管理器"""
-    def __init__(self, socketio):
+    def __init__(self, socketio, config=None, ssh_pool=None):
+        config = config or {}
         self.socketio = socketio
+        self.ssh_pool = ssh_pool or SSHTransportPool()
         self.connections = {}  # session_id -> connection
-        self.read_threads = {}  # session_id -> thread
+        self.bytes_emitted = {}  # session_id -> 已推送到房间的字节数
+        self.output_buffers = {}  # session_id -> OutputBuffer
+        # 输出合并窗口和单帧上限：高速输出时合并为较大的帧，减少Socket.IO消息数量
+        self.coalesce_window = config.get('output_coalesce_ms', 10) / 1000.0
+        self.max_batch_size = config.get('output_max_batch_bytes', 65536)
+        self.recv_size = config.get('recv_buffer_size', 32768)
+        # 流控：未确认输出超过高水位时暂停，回落到低水位后恢复
+        # block - 停止读取通道，由SSH窗口/TCP流控反压到设备
+        # drop - 继续读取但丢弃新输出
+        # truncate - 继续读取，只保留最近高水位大小的输出
+        self.flow_control_policy = config.get('flow_control_policy', 'block')
+        self.high_water = config.get('output_high_water_bytes', 1048576)
+        self.low_water = config.get('output_low_water_bytes', self.high_water // 2)
+        self.lock = threading.RLock()
+        self.on_close = None  # 回调: on_close(session_id)，会话关闭后调用（包括远端断开）
+        # 所有会话共用一个I/O多路复用线程，替代每个会话一个轮询线程
+        self.reactor = TerminalReactor(self._handle_readable, self._flush_due_output)
         
     def create_ssh_connection(self, session_id, host, port, username, password):
         """创建SSH连接"""
@@ -184,18 +357,12 @@ class TerminalManager:
         self.close_connection(session_id)
         
         # 创建新连接
-        conn = SSHConnection(host, port, username, password)
+        conn = SSHConnection(host, port, username, password, recv_size=self.recv_size, pool=self.ssh_pool)
         success, message = conn.connect()
         if success:
             self.connections[session_id] = conn
-            # 启动读取线程
-            thread = threading.Thread(
-                target=self._read_loop,
-                args=(session_id,),
-                daemon=True
-            )
-            thread.start()
-            self.read_threads[session_id] = thread
+            # 交给多路复用器监听输出
+            self.reactor.register(session_id, conn)
             return True, message
         return False, message
     
@@ -205,18 +372,12 @@ class TerminalManager:
         self.close_connection(session_id)
         
         # 创建新连接
-        conn = TelnetConnection(host, port)
+        conn = TelnetConnection(host, port, recv_size=self.recv_size)
         success, message = conn.connect()
         if success:
             self.connections[session_id] = conn
-            # 启动读取线程
-            thread = threading.Thread(
-                target=self._read_loop,
-                args=(session_id,),
-                daemon=True
-            )
-            thread.start()
-            self.read_threads[session_id] = thread
+            # 交给多路复用器监听输出
+            self.reactor.register(session_id, conn)
             return True, message
         return False, message
     
@@ -241,34 +402,185 @@ class TerminalManager:
                 return False
         return False
     
-    def close_connection(self, session_id):
-        """关闭连接"""
-        conn = self.connections.get(session_id)
-        if conn:
-            conn.close()
-            del self.connections[session_id]
+    def close_connection(self, session_id, conn=None):
+        """
+        关闭连接（客户端关闭和远端断开共用）
+
+        :param conn: 远端断开时传入已断开的连接，会话已换成新连接时不做处理
+        """
+        with self.lock:
+            current = self.connections.get(session_id)
+            if conn is not None and current is not conn:
+                return
+            self.connections.pop(session_id, None)
+        if current:
+            # 先注销再关闭，避免文件描述符被复用后误注销
+            self.reactor.unregister(session_id)
+            current.close()
+            # 连接已关闭，不再需要流控：暂停期间积压的输出也一并发出
+            self._flush_output(session_id, force=True)
+            self.socketio.emit('terminal_disconnected', {
+                'session_id': session_id
+            }, to=session_id)
         
-        if session_id in self.read_threads:
-            # 线程会自动结束，因为连接已关闭
-            del self.read_threads[session_id]
+        with self.lock:
+            self.output_buffers.pop(session_id, None)
+            self.bytes_emitted.pop(session_id, None)
+        if self.on_close:
+            try:
+                self.on_close(session_id)
+            except Exception as e:
+                print(f"清理终端会话失败: {session_id}: {e}")
+    
+    def get_stats(self):
+        """获取各会话的输出统计（用于验证房间推送流量）"""
+        return {
+            session_id: {
+                'type': 'ssh' if isinstance(conn, SSHConnection) else 'telnet',
+                'connected': conn.connected,
+                'bytes_emitted': self.bytes_emitted.get(session_id, 0),
+                'unacked': self.output_buffers[session_id].unacked if session_id in self.output_buffers else 0,
+                'paused': self.output_buffers[session_id].paused if session_id in self.output_buffers else False
+            }
+            for session_id, conn in list(self.connections.items())
+        }
     
-    def _read_loop(self, session_id):
-        """读取循环"""
+    def ack_output(self, session_id, size):
+        """客户端确认已处理的输出，低于低水位时恢复读取"""
         conn = self.connections.get(session_id)
         if not conn:
             return
+        with self.lock:
+            out = self.output_buffers.get(session_id)
+            if out is None:
+                return
+            out.unacked = max(0, out.unacked - size)
+            if out.paused and out.unacked <= self.low_water:
+                self._resume(session_id, conn, out)
+    
+    def reset_flow_control(self, session_id):
+        """客户端重新接入会话时，之前未确认的输出已不可能再确认，清零后恢复"""
+        conn = self.connections.get(session_id)
+        if not conn:
+            return
+        with self.lock:
+            out = self.output_buffers.get(session_id)
+            if out is None:
+                return
+            out.unacked = 0
+            if out.paused:
+                self._resume(session_id, conn, out)
+    
+    def _pause(self, session_id, out):
+        """未确认输出超过高水位，暂停会话"""
+        out.paused = True
+        if self.flow_control_policy == 'block':
+            self.reactor.unregister(session_id)
+    
+    def _resume(self, session_id, conn, out):
+        """恢复会话输出"""
+        out.paused = False
+        if out.dropped:
+            out.chunks.insert(0, f'\r\n[输出过快，已丢弃 {out.dropped} 个字符]\r\n')
+            out.dropped = 0
+        if self.flow_control_policy == 'block':
+            self.reactor.register(session_id, conn)
+        if out.chunks:
+            # 交给反应器线程发送暂停期间积压的输出
+            out.deadline = time.monotonic()
+            self.reactor.wakeup()
+    
+    def _handle_readable(self, session_id):
+        """会话可读时由多路复用器调用，返回False表示停止监听"""
+        conn = self.connections.get(session_id)
+        if not conn:
+            return False
         
-        while conn.connected:
-            data = conn.receive()
-            if data:
-                # 通过SocketIO发送数据到客户端
-                self.socketio.emit('terminal_output', {
-                    'session_id': session_id,
-                    'data': data
-                })
-            time.sleep(0.01)  # 避免CPU占用过高
+        data = conn.receive()
+        if data:
+            self._buffer_output(session_id, data)
         
-        # 连接断开，通知客户端
-        self.socketio.emit('terminal_disconnected', {
-            'session_id': session_id
-        })
+        if not conn.connected:
+            # 远端断开，与客户端关闭走同样的清理（发出剩余输出后通知客户端）
+            self.close_connection(session_id, conn)
+            return False
+        return True
+    
+    def _buffer_output(self, session_id, data):
+        """缓存输出，按时间窗口或大小上限合并后再发送"""
+        with self.lock:
+            out = self.output_buffers.get(session_id)
+            if out is None:
+                out = self.output_buffers[session_id] = OutputBuffer()
+            
+            if out.paused:
+                # 暂停期间（drop/truncate策略仍在读取通道）
+                if self.flow_control_policy == 'drop':
+                    out.dropped += len(data)
+                    return
+                out.chunks.append(data)
+                out.size += len(data)
+                if out.size > self.high_water:
+                    # 只保留最近的输出
+                    tail = ''.join(out.chunks)[-self.high_water:]
+                    out.dropped += out.size - len(tail)
+                    out.chunks = [tail]
+                    out.size = len(tail)
+                return
+            
+            out.chunks.append(data)
+            out.size += len(data)
+            
+            now = time.monotonic()
+            if out.size >= self.max_batch_size:
+                self._flush_output(session_id)
+            elif out.deadline is None:
+                if now - out.last_flush >= self.coalesce_window:
+                    # 空闲后的首批输出（如交互输入的回显）立即发送，不增加延迟
+                    self._flush_output(session_id)
+                else:
+                    out.deadline = now + self.coalesce_window
+    
+    def _flush_output(self, session_id, force=False):
+        """
+        把缓冲区中的输出合并为一帧发送到会话房间
+
+        :param force: 会话关闭时为 True，暂停中也发送
+        """
+        with self.lock:
+            out = self.output_buffers.get(session_id)
+            if out is None or (out.paused and not force):
+                return
+            out.deadline = None
+            out.last_flush = time.monotonic()
+            if not out.chunks:
+                return
+            data = ''.join(out.chunks)
+            out.chunks = []
+            out.size = 0
+            # 只推送到该会话的房间，避免广播给所有浏览器
+            # size用于客户端回传确认（terminal_ack）
+            self.socketio.emit('terminal_output', {
+                'session_id': session_id,
+                'data': data,
+                'size': len(data)
+            }, to=session_id)
+            self.bytes_emitted[session_id] = self.bytes_emitted.get(session_id, 0) + len(data.encode('utf-8'))
+            out.unacked += len(data)
+            if out.unacked >= self.high_water and not force:
+                self._pause(session_id, out)
+    
+    def _flush_due_output(self):
+        """发送已到期的缓冲输出，返回距下一个到期时间的秒数"""
+        now = time.monotonic()
+        next_deadline = None
+        for session_id, out in list(self.output_buffers.items()):
+            if out.deadline is None:
+                continue
+            if out.deadline <= now:
+                self._flush_output(session_id)
+            elif next_deadline is None or out.deadline < next_deadline:
+                next_deadline = out.deadline
+        if next_deadline is None:
+            return None
+        return max(0, next_deadline - now)
@@ -0,0 +1,209 @@
+"""
+使用时长汇总模块
+
+使用记录结束（手动释放或到期释放）时，在同一个事务中把它的时长按整点切分，累加到汇总表：
+- device_daily_usage: 设备每天的使用秒数和使用次数
+- device_hourly_usage: 设备每天每小时的使用秒数
+- user_daily_usage: 使用人每天的使用秒数和使用次数（部门在查询时通过授权用户关联）
+
+跨越零点的记录分别计入各自的日期；尚未结束的记录不写入汇总表，统计时按当前时间临时切分后合并。
+历史数据通过 rebuild() 生成，完成后写入 data_markers 标记；migrate_db.py 在没有标记时自动执行
+（不能以汇总表是否为空判断：升级后第一次释放就会写入汇总行）。
+"""
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import and_
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, UsageRecord, DeviceDailyUsage, DeviceHourlyUsage, UserDailyUsage, DataMarker
+
+# 重新生成汇总时每批读取/写入的行数
+REBUILD_BATCH_SIZE = 5000
+# 已从历史记录生成汇总的标记
+BACKFILL_MARKER = 'usage_rollup_backfilled'
+
+
+def split_by_hour(start, end):
+    """把 [start, end) 按整点切分，返回 [(日期, 小时, 秒数)]"""
+    parts = []
+    if not start or not end or end <= start:
+        return parts
+    cursor = start
+    while cursor < end:
+        stop = min(cursor.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1), end)
+        parts.append((cursor.date(), cursor.hour, (stop - cursor).total_seconds()))
+        cursor = stop
+    return parts
+
+
+def user_key(record):
+    """汇总使用人的键：账号，旧记录没有账号时用中文名"""
+    return record.user_account or record.user_name or ''
+
+
+class Contributions:
+    """一批使用记录对三张汇总表的增量"""
+    def __init__(self):
+        self.device_daily = defaultdict(lambda: [0.0, 0])   # (device_id, day) -> [秒数, 次数]
+        self.device_hourly = defaultdict(float)             # (device_id, day, hour) -> 秒数
+        self.user_daily = defaultdict(lambda: [0.0, 0])     # (user_key, day) -> [秒数, 次数]
+        self.user_names = {}
+
+    def add(self, record, end=None):
+        """
+        累加一条记录
+
+        :param end: 结束时间，默认为记录的 end_time（未结束的记录传入当前时间）
+        """
+        end = end or record.end_time
+        if not record.start_time or not end:
+            return
+        key = user_key(record)
+        self.user_names[key] = record.user_name
+        start_day = record.start_time.date()
+        # 使用次数计入开始的日期
+        self.device_daily[(record.device_id, start_day)][1] += 1
+        self.user_daily[(key, start_day)][1] += 1
+        for day, hour, seconds in split_by_hour(record.start_time, end):
+            self.device_daily[(record.device_id, day)][0] += seconds
+            self.device_hourly[(record.device_id, day, hour)] += seconds
+            self.user_daily[(key, day)][0] += seconds
+
+
+def increment(model, keys, values, extra=None):
+    """按主键累加一行汇总（不存在时插入）"""
+    table = model.__table__
+    extra = extra or {}
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(table).values(**keys, **values, **extra)
+        update = {name: table.c[name] + insert.excluded[name] for name in values}
+        update.update(extra)
+        db.session.execute(insert.on_conflict_do_update(index_elements=list(keys), set_=update))
+        return
+    condition = and_(*(table.c[name] == value for name, value in keys.items()))
+    update = {name: table.c[name] + value for name, value in values.items()}
+    update.update(extra)
+    if not db.session.execute(table.update().where(condition).values(update)).rowcount:
+        db.session.execute(table.insert().values(**keys, **values, **extra))
+
+
+def apply(contributions, sign=1, devices=True, users=True):
+    """把增量写入汇总表（调用方负责提交事务），sign=-1 时扣减"""
+    if devices:
+        for (device_id, day), (seconds, sessions) in contributions.device_daily.items():
+            increment(DeviceDailyUsage, {'device_id': device_id, 'day': day},
+                       {'seconds': sign * seconds, 'sessions': sign * sessions})
+        for (device_id, day, hour), seconds in contributions.device_hourly.items():
+            increment(DeviceHourlyUsage, {'device_id': device_id, 'day': day, 'hour': hour},
+                       {'seconds': sign * seconds})
+    if users:
+        for (key, day), (seconds, sessions) in contributions.user_daily.items():
+            increment(UserDailyUsage, {'user_key': key, 'day': day},
+                       {'seconds': sign * seconds, 'sessions': sign * sessions},
+                       {'user_name': contributions.user_names.get(key)})
+
+
+def record_closed(records, end=None):
+    """
+    使用记录已结束，在当前事务中累加到汇总表
+
+    :param end: 结束时间，默认为记录的 end_time（批量 UPDATE 结束的记录传入该时间）
+    """
+    contributions = Contributions()
+    for record in records:
+        contributions.add(record, end=end)
+    apply(contributions)
+
+
+def remove_devices(device_ids):
+    """删除设备前扣除其已结束记录在使用人汇总中的时长，并删除设备汇总（调用方负责提交事务）"""
+    if not device_ids:
+        return
+    contributions = Contributions()
+    for record in closed_records_query().filter(UsageRecord.device_id.in_(device_ids)).yield_per(REBUILD_BATCH_SIZE):
+        contributions.add(record)
+    apply(contributions, sign=-1, devices=False)
+    DeviceDailyUsage.query.filter(DeviceDailyUsage.device_id.in_(device_ids)).delete(synchronize_session=False)
+    DeviceHourlyUsage.query.filter(DeviceHourlyUsage.device_id.in_(device_ids)).delete(synchronize_session=False)
+
+
+def _records_query():
+    """汇总所需的字段（不加载整行）"""
+    return db.session.query(
+        UsageRecord.device_id, UsageRecord.user_account, UsageRecord.user_name,
+        UsageRecord.start_time, UsageRecord.end_time
+    )
+
+
+def closed_records_query():
+    """已结束的使用记录"""
+    return _records_query().filter(UsageRecord.end_time.isnot(None))
+
+
+def open_records_query():
+    """尚未结束的使用记录"""
+    return _records_query().filter(UsageRecord.end_time.is_(None))
+
+
+def open_contributions(now, device_id=None):
+    """尚未结束的记录截至当前时间的时长（统计时与汇总表合并）"""
+    contributions = Contributions()
+    query = open_records_query()
+    if device_id is not None:
+        query = query.filter(UsageRecord.device_id == device_id)
+    for record in query:
+        contributions.add(record, end=now)
+    return contributions
+
+
+def needs_rebuild():
+    """
+    是否需要从历史记录生成汇总（尚无生成标记且已有结束的使用记录）
+
+    还没有结束的使用记录时没有历史数据需要生成，直接写入标记，之后的记录都在结束时累加
+    """
+    if DataMarker.get(BACKFILL_MARKER) is not None:
+        return False
+    if closed_records_query().first() is not None:
+        return True
+    DataMarker.set(BACKFILL_MARKER, '0')
+    db.session.commit()
+    return False
+
+
+def rebuild():
+    """
+    清空汇总表并从全部已结束的使用记录重新生成，同时写入生成标记（在一个事务中完成）
+
+    :return: 汇总的记录数
+    """
+    contributions = Contributions()
+    count = 0
+    for record in closed_records_query().yield_per(REBUILD_BATCH_SIZE):
+        contributions.add(record)
+        count += 1
+
+    DeviceDailyUsage.query.delete(synchronize_session=False)
+    DeviceHourlyUsage.query.delete(synchronize_session=False)
+    UserDailyUsage.query.delete(synchronize_session=False)
+    rows = {
+        DeviceDailyUsage: [
+            {'device_id': device_id, 'day': day, 'seconds': seconds, 'sessions': sessions}
+            for (device_id, day), (seconds, sessions) in contributions.device_daily.items()
+        ],
+        DeviceHourlyUsage: [
+            {'device_id': device_id, 'day': day, 'hour': hour, 'seconds': seconds}
+            for (device_id, day, hour), seconds in contributions.device_hourly.items()
+        ],
+        UserDailyUsage: [
+            {'user_key': key, 'day': day, 'user_name': contributions.user_names.get(key),
+             'seconds': seconds, 'sessions': sessions}
+            for (key, day), (seconds, sessions) in contributions.user_daily.items()
+        ]
+    }
+    for model, items in rows.items():
+        for i in range(0, len(items), REBUILD_BATCH_SIZE):
+            db.session.execute(model.__table__.insert(), items[i:i + REBUILD_BATCH_SIZE])
+    DataMarker.set(BACKFILL_MARKER, str(count))
+    db.session.commit()
+    return count
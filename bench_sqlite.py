@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+SQLite 并发读写压测脚本
+在临时数据库上模拟服务的混合负载，依次对比：
+- 默认配置: 回滚日志、每次操作打开新连接（NullPool，Flask-SQLAlchemy 对SQLite文件的默认行为）
+- config.json 中的 SQLite 连接参数（WAL等），仍为 NullPool
+- 连接参数 + 连接池（服务实际使用的配置）
+负载:
+- 读线程: 使用记录列表分页查询、设备列表查询
+- 写线程: 占用设备（更新设备 + 插入使用记录）、释放设备（查找未结束记录 + 更新），每次一个短事务
+- 批量写线程: 每秒在一个事务中写入一批审计日志（模拟清理任务、批量操作等较长的写事务）
+输出每秒读/写次数、延迟和 "database is locked" 次数。
+
+示例:
+    python3 bench_sqlite.py
+    python3 bench_sqlite.py --readers 8 --writers 4 --duration 10 --records 50000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(basedir, 'backend'))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
+from models import db
+from db_backend import DatabaseBackend
+from sqlite_tuning import SQLiteTuning
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def prepare(path, devices, records):
+    """创建表并写入测试数据"""
+    engine = create_engine('sqlite:///' + path, poolclass=NullPool)
+    db.metadata.create_all(engine)
+    now = datetime.now()
+    with engine.begin() as conn:
+        conn.execute(db.metadata.tables['devices'].insert(), [
+            {'name': f'device-{i}', 'ip': f'10.0.{i // 250}.{i % 250}', 'port': 22,
+             'username': 'root', 'password': 'x', 'status': 'available'}
+            for i in range(devices)
+        ])
+        rows = []
+        for i in range(records):
+            start = now - timedelta(minutes=records - i)
+            rows.append({'device_id': random.randint(1, devices), 'user_name': f'用户{i % 50}',
+                         'user_account': f'user{i % 50}', 'purpose': '压测',
+                         'start_time': start, 'end_time': start + timedelta(minutes=random.randint(1, 30))})
+        conn.execute(db.metadata.tables['usage_records'].insert(), rows)
+    engine.dispose()
+
+
+def read_once(conn):
+    conn.execute(text(
+        "SELECT r.id, r.user_name, r.start_time, r.end_time, d.name FROM usage_records r "
+        "LEFT JOIN devices d ON d.id = r.device_id ORDER BY r.start_time DESC, r.id DESC LIMIT 50"
+    )).fetchall()
+    conn.execute(text("SELECT id, name, status, current_user_account, occupy_until FROM devices")).fetchall()
+
+
+def write_once(conn, device_id, account):
+    """占用或释放一台设备（一个事务）"""
+    now = datetime.now()
+    with conn.begin():
+        status = conn.execute(text("SELECT status FROM devices WHERE id = :id"), {'id': device_id}).scalar()
+        if status == 'available':
+            conn.execute(text(
+                "UPDATE devices SET status = 'occupied', current_user_account = :account, occupy_until = :until "
+                "WHERE id = :id"), {'id': device_id, 'account': account, 'until': now + timedelta(hours=1)})
+            conn.execute(text(
+                "INSERT INTO usage_records (device_id, user_name, user_account, purpose, start_time) "
+                "VALUES (:id, :account, :account, '压测', :now)"), {'id': device_id, 'account': account, 'now': now})
+        else:
+            record_id = conn.execute(text(
+                "SELECT id FROM usage_records WHERE device_id = :id AND end_time IS NULL "
+                "ORDER BY start_time DESC LIMIT 1"), {'id': device_id}).scalar()
+            if record_id:
+                conn.execute(text("UPDATE usage_records SET end_time = :now WHERE id = :rid"),
+                             {'now': now, 'rid': record_id})
+            conn.execute(text(
+                "UPDATE devices SET status = 'available', current_user_account = NULL, occupy_until = NULL "
+                "WHERE id = :id"), {'id': device_id})
+
+
+def bulk_write_once(conn, rows):
+    """一个较长的写事务"""
+    now = datetime.now()
+    with conn.begin():
+        conn.execute(db.metadata.tables['audit_logs'].insert(), [
+            {'action_type': 'bench', 'operator': 'bench', 'details': '压测批量写入', 'created_at': now}
+            for _ in range(rows)
+        ])
+
+
+def run(name, path, args, tuning=None, pool=None):
+    if pool:
+        options = DatabaseBackend({'database': {'url': 'sqlite:///' + path, 'pool': pool}}, basedir).engine_options()
+    else:
+        options = {'poolclass': NullPool}
+    engine = create_engine('sqlite:///' + path, **options)
+    if tuning:
+        tuning.install(engine)
+    stop = threading.Event()
+    lock = threading.Lock()
+    result = {'reads': 0, 'writes': 0, 'read_ms': [], 'write_ms': [], 'locked': 0, 'errors': 0}
+
+    def worker(kind, index):
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                with engine.connect() as conn:
+                    if kind == 'reads':
+                        read_once(conn)
+                    else:
+                        write_once(conn, random.randint(1, args.devices), f'bench{index}')
+            except OperationalError as e:
+                with lock:
+                    result['locked' if 'locked' in str(e) else 'errors'] += 1
+                continue
+            elapsed = (time.monotonic() - started) * 1000
+            with lock:
+                result[kind] += 1
+                result['read_ms' if kind == 'reads' else 'write_ms'].append(elapsed)
+
+    def bulk_writer():
+        while not stop.wait(1):
+            try:
+                with engine.connect() as conn:
+                    bulk_write_once(conn, args.bulk_rows)
+            except OperationalError as e:
+                with lock:
+                    result['locked' if 'locked' in str(e) else 'errors'] += 1
+
+    def checkpointer():
+        while not stop.wait(args.checkpoint_interval):
+            try:
+                tuning.checkpoint()
+            except OperationalError:
+                pass
+
+    threads = [threading.Thread(target=worker, args=('reads', i)) for i in range(args.readers)]
+    threads += [threading.Thread(target=worker, args=('writes', i)) for i in range(args.writers)]
+    if args.bulk_rows:
+        threads.append(threading.Thread(target=bulk_writer))
+    if tuning and tuning.settings['journal_mode'] == 'WAL':
+        threads.append(threading.Thread(target=checkpointer))
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    # 关闭最后一个连接时WAL文件会被删除，先取指标
+    stats = tuning.get_stats() if tuning else None
+    engine.dispose()
+
+    print(f"\n[{name}]")
+    print(f"  读: {result['reads'] / args.duration:.0f} 次/秒, p50 {percentile(result['read_ms'], 50):.1f}ms, "
+          f"p99 {percentile(result['read_ms'], 99):.1f}ms")
+    print(f"  写: {result['writes'] / args.duration:.0f} 次/秒, p50 {percentile(result['write_ms'], 50):.1f}ms, "
+          f"p99 {percentile(result['write_ms'], 99):.1f}ms")
+    print(f"  database is locked: {result['locked']} 次, 其他错误: {result['errors']} 次")
+    if stats:
+        print(f"  检查点: {stats['checkpoints']} 次, WAL文件 {stats['wal_size'] // 1024}KB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite 并发读写压测')
+    parser.add_argument('--readers', type=int, default=8, help='读线程数')
+    parser.add_argument('--writers', type=int, default=4, help='写线程数')
+    parser.add_argument('--duration', type=float, default=10, help='每种配置运行的秒数')
+    parser.add_argument('--devices', type=int, default=200, help='测试设备数')
+    parser.add_argument('--records', type=int, default=50000, help='预先写入的使用记录数')
+    parser.add_argument('--bulk-rows', type=int, default=20000, help='批量写线程每秒一个事务写入的行数，0 表示不启用')
+    parser.add_argument('--checkpoint-interval', type=float, default=2, help='压测期间执行检查点的间隔（秒）')
+    parser.add_argument('--config', default=os.path.join(basedir, 'config.json'), help='读取 database.sqlite 和 database.pool 的配置文件')
+    args = parser.parse_args()
+
+    settings = {}
+    pool = {}
+    try:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            database = json.load(f).get('database', {})
+            settings = database.get('sqlite', {})
+            pool = database.get('pool', {})
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 读取配置文件失败: {e}，使用默认SQLite参数")
+
+    workdir = tempfile.mkdtemp(prefix='bench_sqlite_')
+    try:
+        template = os.path.join(workdir, 'template.db')
+        print(f"准备测试数据: {args.devices} 台设备, {args.records} 条使用记录...")
+        prepare(template, args.devices, args.records)
+        print(f"读线程 {args.readers}, 写线程 {args.writers}, 每种配置 {args.duration} 秒")
+
+        configs = (
+            ('默认（回滚日志，NullPool）', None, None),
+            ('config.json SQLite参数（NullPool）', SQLiteTuning(settings), None),
+            ('config.json SQLite参数 + 连接池', SQLiteTuning(settings), dict(pool, pool_size=pool.get('pool_size') or 10)),
+        )
+        for name, tuning, pool_settings in configs:
+            path = os.path.join(workdir, 'bench.db')
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            shutil.copy(template, path)
+            run(name, path, args, tuning, pool_settings)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
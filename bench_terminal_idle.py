@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Web终端空闲会话压测脚本
+在子进程中启动一个本地SSH服务（paramiko）和一个Telnet服务（只接受连接、不发送数据），
+本进程通过 TerminalManager 打开 N 个空闲会话，采样一段时间内本进程的CPU占用和线程数，依次对比：
+- reactor: 当前实现，所有会话共用一个多路复用线程（TerminalReactor）
+- thread: 旧实现，每个会话一个读取线程，每10毫秒轮询一次
+服务端运行在另一个进程中，不计入测量结果。以普通线程模式运行（不使用gevent）。
+
+依赖: paramiko（服务端的主机密钥在启动时临时生成）
+
+示例:
+    python3 bench_terminal_idle.py
+    python3 bench_terminal_idle.py --sessions 10,50,200 --sample 5 --protocol ssh
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(basedir, 'backend'))
+
+import paramiko
+from ssh_pool import SSHTransportPool
+from terminal import TerminalManager
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+
+# ==================== 服务端（子进程） ====================
+
+class IdleSSHServer(paramiko.ServerInterface):
+    """接受任意会话和shell请求，之后不发送任何数据"""
+    def check_auth_password(self, username, password):
+        if username == USERNAME and password == PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        return True
+
+
+def listen():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1024)
+    return sock
+
+
+def serve(conn):
+    """子进程入口：启动两个服务，把端口通过管道发回父进程"""
+    # 客户端关闭会话时服务端会记录连接重置，不影响测量
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    host_key = paramiko.RSAKey.generate(2048)
+    ssh_sock = listen()
+    telnet_sock = listen()
+    keep = []  # 保持所有连接打开
+
+    def accept_ssh():
+        while True:
+            client, _ = ssh_sock.accept()
+            transport = paramiko.Transport(client)
+            transport.add_server_key(host_key)
+            try:
+                transport.start_server(server=IdleSSHServer())
+            except paramiko.SSHException:
+                continue
+            keep.append(transport)
+
+    def accept_telnet():
+        while True:
+            client, _ = telnet_sock.accept()
+            keep.append(client)
+
+    threading.Thread(target=accept_ssh, daemon=True).start()
+    threading.Thread(target=accept_telnet, daemon=True).start()
+    conn.send((ssh_sock.getsockname()[1], telnet_sock.getsockname()[1]))
+    conn.recv()  # 父进程通知退出
+
+
+# ==================== 测量（本进程） ====================
+
+class NullSocketIO:
+    """不推送任何消息的 SocketIO 替身"""
+    def emit(self, *args, **kwargs):
+        pass
+
+
+def legacy_read_loop(conn):
+    """旧实现的读取循环：每个会话一个线程，每10毫秒轮询一次"""
+    while conn.connected:
+        conn.receive()
+        time.sleep(0.01)
+
+
+def thread_count():
+    """本进程的线程数（Linux读取/proc，其他平台只统计Python线程）"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return threading.active_count()
+
+
+def cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+
+def measure(mode, protocol, sessions, port, args):
+    """打开 sessions 个空闲会话，返回 (CPU占用百分比, 线程数)"""
+    pool = SSHTransportPool({
+        'max_transports_per_host': max(1, -(-sessions // args.sessions_per_transport)),
+        'max_sessions_per_transport': args.sessions_per_transport,
+        'keepalive_interval': 0
+    })
+    manager = TerminalManager(NullSocketIO(), ssh_pool=pool)
+    if mode == 'thread':
+        manager.reactor.register = lambda session_id, conn: threading.Thread(
+            target=legacy_read_loop, args=(conn,), daemon=True).start()
+        manager.reactor.unregister = lambda session_id: None
+
+    session_ids = [f'bench-{mode}-{protocol}-{i}' for i in range(sessions)]
+    try:
+        for session_id in session_ids:
+            if protocol == 'ssh':
+                ok, message = manager.create_ssh_connection(session_id, '127.0.0.1', port, USERNAME, PASSWORD)
+            else:
+                ok, message = manager.create_telnet_connection(session_id, '127.0.0.1', port)
+            if not ok:
+                raise RuntimeError(f"打开会话失败: {message}")
+        time.sleep(args.settle)
+
+        started_cpu, started = cpu_seconds(), time.monotonic()
+        time.sleep(args.sample)
+        cpu = (cpu_seconds() - started_cpu) / (time.monotonic() - started) * 100
+        return cpu, thread_count()
+    finally:
+        for session_id in session_ids:
+            manager.close_connection(session_id)
+        pool.close_all()
+        time.sleep(0.5)  # 等待旧实现的读取线程退出
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Web终端空闲会话CPU占用压测')
+    parser.add_argument('--sessions', default='10,50,200', help='空闲会话数，逗号分隔（默认: 10,50,200）')
+    parser.add_argument('--modes', default='thread,reactor', help='对比的实现，逗号分隔（默认: thread,reactor）')
+    parser.add_argument('--protocol', choices=['ssh', 'telnet', 'both'], default='both', help='会话类型（默认: both）')
+    parser.add_argument('--sample', type=float, default=5, help='每组采样秒数（默认: 5）')
+    parser.add_argument('--settle', type=float, default=1, help='打开会话后等待的秒数（默认: 1）')
+    parser.add_argument('--sessions-per-transport', type=int, default=1,
+                        help='每条SSH传输承载的会话数（默认: 1，即每个会话一条传输）')
+    args = parser.parse_args()
+
+    counts = [int(n) for n in args.sessions.split(',') if n.strip()]
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    protocols = ['ssh', 'telnet'] if args.protocol == 'both' else [args.protocol]
+
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(child,), daemon=True)
+    server.start()
+    ssh_port, telnet_port = parent.recv()
+    print(f"本地服务已启动: SSH 127.0.0.1:{ssh_port}, Telnet 127.0.0.1:{telnet_port}")
+    print(f"空闲基线: 线程数 {thread_count()}")
+
+    results = {}
+    try:
+        for protocol in protocols:
+            port = ssh_port if protocol == 'ssh' else telnet_port
+            for sessions in counts:
+                for mode in modes:
+                    cpu, threads = measure(mode, protocol, sessions, port, args)
+                    results[(protocol, sessions, mode)] = (cpu, threads)
+                    print(f"  {protocol:6} {sessions:5} 个会话  {mode:7}  CPU {cpu:5.1f}%  线程 {threads}")
+    finally:
+        parent.send('stop')
+        server.join(5)
+
+    print(f"\n{'='*60}")
+    print(f"空闲会话CPU占用（采样 {args.sample:g} 秒）")
+    print(f"{'='*60}")
+    print(f"{'协议':6} {'会话数':>6}  " + '  '.join(f"{mode:>18}" for mode in modes))
+    for protocol in protocols:
+        for sessions in counts:
+            cells = []
+            for mode in modes:
+                cpu, threads = results[(protocol, sessions, mode)]
+                cells.append(f"{cpu:5.1f}% ({threads:4} 线程)")
+            print(f"{protocol:6} {sessions:>8}  " + '  '.join(f"{cell:>18}" for cell in cells))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,54 +3,74 @@
 数据库检查和修复脚本
 检查数据库是否包含所有必需的字段，并自动修复缺失的字段
 """
-import sqlite3
 import os
 import sys
+import json
 
 # 获取项目根目录
 project_root = os.path.dirname(os.path.abspath(__file__))
-db_path = os.path.join(project_root, 'backend', 'device_manager.db')
+sys.path.insert(0, os.path.join(project_root, 'backend'))
+
+from sqlalchemy import create_engine, inspect, text
+from db_backend import DatabaseBackend
+from models import UsageRecord
+
+# 读取配置（database.url 为空时使用 database.path 指定的SQLite文件）
+try:
+    with open(os.path.join(project_root, 'config.json'), 'r', encoding='utf-8') as f:
+        CONFIG = json.load(f)
+except Exception:
+    CONFIG = {"database": {"path": "backend/device_manager.db"}}
+db_backend = DatabaseBackend(CONFIG, project_root)
 
 print(f"{'='*60}")
 print(f"数据库检查和修复脚本")
 print(f"{'='*60}")
-print(f"数据库路径: {db_path}")
-print(f"数据库存在: {os.path.exists(db_path)}")
+print(f"数据库: {db_backend.display_url}")
+if db_backend.is_sqlite:
+    print(f"数据库存在: {os.path.exists(db_backend.sqlite_path or '')}")
 print()
 
-if not os.path.exists(db_path):
+if db_backend.is_sqlite and not os.path.exists(db_backend.sqlite_path or ''):
     print("❌ 数据库文件不存在")
     print("   请先运行系统初始化数据库或启动应用程序")
     sys.exit(1)
 
 try:
     # 连接数据库
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    engine = create_engine(db_backend.url)
+    db_backend.sqlite_tuning.install(engine)
+    inspector = inspect(engine)
     
     # 检查所有表
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-    tables = cursor.fetchall()
+    tables = inspector.get_table_names()
     
     print(f"✅ 数据库包含 {len(tables)} 个表:")
     for table in tables:
-        print(f"   • {table[0]}")
+        print(f"   • {table}")
     print()
     
+    if 'usage_records' not in tables:
+        print("❌ 缺少 usage_records 表，请运行 python3 migrate_db.py")
+        sys.exit(1)
+    
+    def print_columns(columns):
+        for col in columns:
+            print(f"   • {col['name']} ({col['type']}){'' if col['nullable'] else ' - NOT NULL'}")
+    
     # 检查 usage_records 表的字段
     print("检查 usage_records 表结构...")
-    cursor.execute("PRAGMA table_info(usage_records)")
-    columns = cursor.fetchall()
-    column_names = [column[1] for column in columns]
+    columns = inspector.get_columns('usage_records')
+    column_names = [column['name'] for column in columns]
     
     print(f"当前字段 ({len(column_names)}):")
-    for col in columns:
-        print(f"   • {col[1]} ({col[2]}){' - NOT NULL' if col[3] else ''}")
+    print_columns(columns)
     print()
     
-    # 需要的字段列表
+    # 需要的字段列表：模型中定义的可为空字段（可直接 ADD COLUMN，类型按数据库方言生成）
     required_fields = {
-        'login_info': ('TEXT', '登录信息字段（用于存储Linux登录信息）')
+        column.name: (column.type.compile(dialect=engine.dialect), '使用记录字段')
+        for column in UsageRecord.__table__.columns if column.nullable and not column.primary_key
     }
     
     # 检查缺失的字段
@@ -68,21 +88,19 @@ try:
         print("正在自动修复...")
         for field_name, field_type, description in missing_fields:
             try:
-                cursor.execute(f"ALTER TABLE usage_records ADD COLUMN {field_name} {field_type}")
-                conn.commit()
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE usage_records ADD COLUMN {field_name} {field_type}"))
                 print(f"✅ 已添加字段: {field_name}")
             except Exception as e:
                 print(f"❌ 添加字段失败 {field_name}: {e}")
         print()
         
         # 再次验证
-        cursor.execute("PRAGMA table_info(usage_records)")
-        columns = cursor.fetchall()
-        column_names = [column[1] for column in columns]
+        columns = inspect(engine).get_columns('usage_records')
+        column_names = [column['name'] for column in columns]
         
         print("修复后的表结构:")
-        for col in columns:
-            print(f"   • {col[1]} ({col[2]}){' - NOT NULL' if col[3] else ''}")
+        print_columns(columns)
         print()
         
         # 检查是否所有字段都已添加
@@ -99,27 +117,13 @@ try:
     print()
     print("数据库统计信息:")
     
-    cursor.execute("SELECT COUNT(*) FROM devices")
-    device_count = cursor.fetchone()[0]
-    print(f"   • 设备数量: {device_count}")
-    
-    cursor.execute("SELECT COUNT(*) FROM users")
-    user_count = cursor.fetchone()[0]
-    print(f"   • 用户数量: {user_count}")
-    
-    cursor.execute("SELECT COUNT(*) FROM usage_records")
-    record_count = cursor.fetchone()[0]
-    print(f"   • 使用记录: {record_count}")
-    
-    cursor.execute("SELECT COUNT(*) FROM allowed_users")
-    allowed_count = cursor.fetchone()[0]
-    print(f"   • 授权用户: {allowed_count}")
-    
-    cursor.execute("SELECT COUNT(*) FROM audit_logs")
-    log_count = cursor.fetchone()[0]
-    print(f"   • 审计日志: {log_count}")
+    with engine.connect() as conn:
+        for table, label in (('devices', '设备数量'), ('users', '用户数量'), ('usage_records', '使用记录'),
+                             ('allowed_users', '授权用户'), ('audit_logs', '审计日志')):
+            count = conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+            print(f"   • {label}: {count}")
     
-    conn.close()
+    engine.dispose()
     
     print()
     print(f"{'='*60}")
@@ -79,7 +79,7 @@ cat > config.json << EOF
     "password": "$ADMIN_PASS"
   },
   "database": {
-    "path": "backend/device_manager.db"
+    "path": "data/device_manager.db"
   },
   "user": {
     "default_password": "123456"
@@ -92,6 +92,13 @@ cat > config.json << EOF
 }
 EOF
 
+# 数据库目录（WAL模式下 -wal/-shm 文件需与数据库文件在同一个持久化目录中）
+mkdir -p data
+if [ -f backend/device_manager.db ] && [ ! -f data/device_manager.db ]; then
+    mv backend/device_manager.db* data/
+    echo -e "${YELLOW}已将数据库文件移动到 data/ 目录${NC}"
+fi
+
 # 创建docker-compose.yml
 cat > docker-compose.yml << EOF
 version: '3.8'
@@ -103,7 +110,7 @@ services:
     ports:
       - "$PORT:$PORT"
     volumes:
-      - ./backend/device_manager.db:/app/backend/device_manager.db
+      - ./data:/app/data
       - ./config.json:/app/config.json
     restart: unless-stopped
     environment:
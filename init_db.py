@@ -12,7 +12,9 @@ import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
 
 from flask import Flask
-from models import db, User, Device, UsageRecord, AllowedUser, AuditLog, QuickCommand
+from db_backend import DatabaseBackend
+from models import db, User, Device, UsageRecord, UsageRecordLoginInfo, DeviceDailyUsage, DeviceHourlyUsage, UserDailyUsage, AllowedUser, AuditLog, QuickCommand
+from audit_search import AuditSearch
 import json
 
 # 读取配置
@@ -28,35 +30,42 @@ except:
 
 # 创建 Flask 应用
 app = Flask(__name__)
-db_path = os.path.join(os.path.dirname(__file__), CONFIG['database']['path'])
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db_backend = DatabaseBackend(CONFIG, os.path.dirname(os.path.abspath(__file__)))
+db_path = db_backend.sqlite_path
 
 # 初始化数据库
-db.init_app(app)
+db_backend.init_app(app, db)
 
 with app.app_context():
     print(f"\n{'='*60}")
-    print(f"开始初始化数据库: {db_path}")
+    print(f"开始初始化数据库: {db_backend.display_url}")
     print(f"{'='*60}\n")
     
-    # 1. 删除旧数据库文件（包括可能的备份文件）
-    if os.path.exists(db_path):
-        os.remove(db_path)
-        print(f"✅ 已删除旧数据库: {db_path}")
-    
-    # 删除可能的临时文件
-    for ext in ['-shm', '-wal', '-journal']:
-        temp_file = db_path + ext
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-            print(f"✅ 已删除临时文件: {temp_file}")
+    # 1. 删除旧数据库
+    if db_path:
+        # SQLite: 删除数据库文件（包括可能的临时文件）
+        db.engine.dispose()
+        if os.path.exists(db_path):
+            os.remove(db_path)
+            print(f"✅ 已删除旧数据库: {db_path}")
+        
+        for ext in ['-shm', '-wal', '-journal']:
+            temp_file = db_path + ext
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+                print(f"✅ 已删除临时文件: {temp_file}")
+    elif db_backend.exists(db.engine):
+        # 其他数据库: 删除模型中定义的所有表
+        db.drop_all()
+        print(f"✅ 已删除旧数据表")
     
     print()
     
     # 2. 创建所有表
     print("正在创建数据库表...")
     db.create_all()
+    if AuditSearch().create(db.engine, rebuild=False):
+        print(f"✅ 审计日志全文索引创建完成")
     print(f"✅ 数据库表创建完成")
     print()
     
@@ -69,7 +78,7 @@ with app.app_context():
     print()
     
     # 4. 检查必需的表
-    required_tables = ['devices', 'users', 'usage_records', 'allowed_users', 'audit_logs', 'quick_commands']
+    required_tables = ['devices', 'users', 'usage_records', 'usage_record_login_info', 'allowed_users', 'audit_logs', 'quick_commands']
     missing_tables = [t for t in required_tables if t not in table_names]
     
     if missing_tables:
@@ -104,7 +113,7 @@ with app.app_context():
     print(f"\n{'='*60}")
     print(f"数据库初始化成功!")
     print(f"{'='*60}")
-    print(f"\n数据库文件: {db_path}")
+    print(f"\n数据库: {db_backend.display_url}")
     print(f"管理员账号: {admin_username}")
     print(f"管理员密码: {admin_password}")
     print()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Socket.IO 并发压测脚本
+建立大量并发WebSocket连接并保持一段时间，期间测量Socket.IO往返延迟和HTTP接口延迟，
+可选地同时打开若干SSH终端测量回显延迟。
+
+依赖: pip install "python-socketio[asyncio_client]" (即 aiohttp)
+
+示例:
+    python3 load_test_socketio.py --url http://127.0.0.1:3001 --clients 1000 --hold 30
+    python3 load_test_socketio.py --clients 1000 --terminals 20 --ssh 10.0.0.5:22:root:password
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+try:
+    import aiohttp
+    import socketio
+except ImportError:
+    print("❌ 缺少依赖，请先安装: pip install \"python-socketio[asyncio_client]\"")
+    sys.exit(1)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def summary(name, values):
+    """格式化延迟统计（毫秒）"""
+    if not values:
+        return f"{name}: 无数据"
+    return (f"{name}: {len(values)} 次, p50 {percentile(values, 50):.1f}ms, "
+            f"p99 {percentile(values, 99):.1f}ms, 最大 {max(values):.1f}ms")
+
+
+def process_stats(pid):
+    """读取服务进程的线程数和内存（仅Linux）"""
+    stats = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Threads', 'VmRSS'):
+                    stats[key] = value.strip()
+    except OSError:
+        pass
+    return stats
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.clients = []
+        self.connect_ms = []
+        self.rtt_ms = []
+        self.http_ms = []
+        self.echo_ms = []
+        self.errors = 0
+
+    async def connect_client(self, semaphore):
+        client = socketio.AsyncClient(reconnection=False)
+        connected = asyncio.Event()
+
+        @client.on('connected')
+        async def on_connected(data):
+            connected.set()
+
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                await client.connect(self.args.url, transports=[self.args.transport], wait_timeout=30)
+                await asyncio.wait_for(connected.wait(), 30)
+            except Exception as e:
+                self.errors += 1
+                if self.errors <= 5:
+                    print(f"❌ 连接失败: {type(e).__name__}: {e}")
+                return None
+        self.connect_ms.append((time.monotonic() - started) * 1000)
+        self.clients.append(client)
+        return client
+
+    async def ping_loop(self, client, deadline):
+        """周期性发送带确认的事件，测量Socket.IO往返延迟"""
+        while time.monotonic() < deadline and client.connected:
+            await asyncio.sleep(self.args.interval * (0.5 + os.urandom(1)[0] / 255))
+            started = time.monotonic()
+            try:
+                await client.call('terminal_attach', {'session_id': ''}, timeout=30)
+                self.rtt_ms.append((time.monotonic() - started) * 1000)
+            except Exception:
+                self.errors += 1
+
+    async def http_loop(self, session, deadline):
+        """保持连接期间测量HTTP接口延迟"""
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                async with session.get(f"{self.args.url}/api/health") as resp:
+                    await resp.read()
+                self.http_ms.append((time.monotonic() - started) * 1000)
+            except Exception:
+                self.errors += 1
+            await asyncio.sleep(0.2)
+
+    async def terminal_loop(self, client, deadline):
+        """打开SSH终端并测量命令回显延迟"""
+        host, port, username, password = self.args.ssh.split(':', 3)
+        session_id = 'load_' + uuid.uuid4().hex[:12]
+        output = []
+        received = asyncio.Event()
+
+        @client.on('terminal_output')
+        async def on_output(data):
+            if data.get('session_id') == session_id:
+                output.append(data['data'])
+                received.set()
+                await client.emit('terminal_ack', {'session_id': session_id, 'size': data.get('size', 0)})
+
+        ready = asyncio.Event()
+        client.on('terminal_connected', lambda data: ready.set())
+        await client.emit('ssh_connect', {
+            'session_id': session_id, 'host': host, 'port': int(port),
+            'username': username, 'password': password
+        })
+        try:
+            await asyncio.wait_for(ready.wait(), 30)
+        except asyncio.TimeoutError:
+            self.errors += 1
+            return
+        while time.monotonic() < deadline and client.connected:
+            marker = uuid.uuid4().hex[:8]
+            output.clear()
+            received.clear()
+            started = time.monotonic()
+            await client.emit('terminal_input', {'session_id': session_id, 'data': f'echo {marker}\r'})
+            while marker not in ''.join(output) and time.monotonic() - started < 10:
+                try:
+                    await asyncio.wait_for(received.wait(), 10)
+                except asyncio.TimeoutError:
+                    break
+                received.clear()
+            if marker in ''.join(output):
+                self.echo_ms.append((time.monotonic() - started) * 1000)
+            else:
+                self.errors += 1
+            await asyncio.sleep(self.args.interval)
+        await client.emit('close_terminal', {'session_id': session_id})
+
+    async def run(self):
+        args = self.args
+        print(f"{'='*60}")
+        print(f"Socket.IO 并发压测: {args.url}")
+        print(f"客户端: {args.clients}  传输: {args.transport}  保持: {args.hold}秒")
+        print(f"{'='*60}")
+
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{args.url}/api/health") as resp:
+                health = await resp.json()
+            print(f"服务运行模式: {health.get('async_mode', '未知')}")
+
+            started = time.monotonic()
+            semaphore = asyncio.Semaphore(args.ramp)
+            await asyncio.gather(*(self.connect_client(semaphore) for _ in range(args.clients)))
+            print(f"✅ 已建立 {len(self.clients)}/{args.clients} 个连接，耗时 {time.monotonic() - started:.1f}秒")
+            if args.pid:
+                print(f"   服务进程: {process_stats(args.pid)}")
+
+            deadline = time.monotonic() + args.hold
+            tasks = [self.ping_loop(c, deadline) for c in self.clients]
+            tasks.append(self.http_loop(session, deadline))
+            if args.ssh:
+                tasks += [self.terminal_loop(c, deadline) for c in self.clients[:args.terminals]]
+            await asyncio.gather(*tasks)
+
+            alive = sum(1 for c in self.clients if c.connected)
+            if args.pid:
+                print(f"   服务进程: {process_stats(args.pid)}")
+        await asyncio.gather(*(c.disconnect() for c in self.clients), return_exceptions=True)
+
+        print()
+        print(summary('建立连接', self.connect_ms))
+        print(summary('Socket.IO往返', self.rtt_ms))
+        print(summary('HTTP /api/health', self.http_ms))
+        if args.ssh:
+            print(summary('终端回显', self.echo_ms))
+        print(f"结束时存活连接: {alive}/{args.clients}  错误: {self.errors}")
+        return 0 if alive == args.clients and not self.errors else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Socket.IO 并发压测')
+    parser.add_argument('--url', default='http://127.0.0.1:3001', help='服务地址')
+    parser.add_argument('--clients', type=int, default=1000, help='并发客户端数')
+    parser.add_argument('--ramp', type=int, default=100, help='同时进行握手的客户端数')
+    parser.add_argument('--hold', type=float, default=30, help='保持连接的秒数')
+    parser.add_argument('--interval', type=float, default=2, help='每个客户端发送事件的平均间隔（秒）')
+    parser.add_argument('--transport', default='websocket', choices=['websocket', 'polling'])
+    parser.add_argument('--ssh', help='同时测试终端: host:port:username:password')
+    parser.add_argument('--terminals', type=int, default=10, help='打开的SSH终端数量（需要 --ssh）')
+    parser.add_argument('--pid', type=int, help='服务进程PID，用于输出线程数和内存')
+    args = parser.parse_args()
+    sys.exit(asyncio.run(LoadTest(args).run()))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,19 +7,31 @@
 - 添加缺失的表和字段
 - 保留所有现有数据
 - 不删除任何表或字段
+- 分批把 usage_records.login_info 中的登录信息压缩后移到 usage_record_login_info 表
+- 尚未从历史记录生成使用时长汇总时自动生成（--rebuild-rollups 强制重新生成）
+- 创建模型中新增的索引，并检查热点查询的执行计划是否走索引
+- 建立审计日志全文索引（SQLite FTS5），首次建立时从现有日志生成
+- 尚未从历史日志生成审计日志每日计数时自动生成（--rebuild-audit-counts 强制重新生成）
 """
 
 import os
 import sys
 import json
+import time
 from datetime import datetime
 
 # 添加 backend 目录到路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
 
 from flask import Flask
-from models import db, User, Device, UsageRecord, AllowedUser, AuditLog, QuickCommand
-from sqlalchemy import inspect, text
+from db_backend import DatabaseBackend
+from models import db, User, Device, UsageRecord, UsageRecordLoginInfo, AllowedUser, AuditLog, QuickCommand
+from models import DeviceDailyUsage, DeviceHourlyUsage, UserDailyUsage, AuditActionDailyCount, DataMarker
+import usage_rollup
+import audit_counts
+import query_plans
+from audit_search import AuditSearch
+from sqlalchemy import inspect, text, bindparam
 
 # 读取配置
 config_path = os.path.join(os.path.dirname(__file__), 'config.json')
@@ -34,12 +46,10 @@ except:
 
 # 创建 Flask 应用
 app = Flask(__name__)
-db_path = os.path.join(os.path.dirname(__file__), CONFIG['database']['path'])
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db_backend = DatabaseBackend(CONFIG, os.path.dirname(os.path.abspath(__file__)))
 
 # 初始化数据库
-db.init_app(app)
+db_backend.init_app(app, db)
 
 def print_header(text):
     """打印标题"""
@@ -52,10 +62,10 @@ def print_section(text):
     print(f"\n--- {text} ---")
 
 def get_model_columns(model):
-    """获取模型定义的所有字段"""
+    """获取模型定义的所有字段（类型按当前数据库方言生成，如 DATETIME / TIMESTAMP WITHOUT TIME ZONE）"""
     columns = {}
     for column in model.__table__.columns:
-        col_type = str(column.type)
+        col_type = column.type.compile(dialect=db.engine.dialect)
         columns[column.name] = {
             'type': col_type,
             'nullable': column.nullable,
@@ -90,10 +100,11 @@ def add_column_to_table(table_name, column_name, column_info):
     # 不能添加 NOT NULL 约束（除非有 DEFAULT），也不能添加主键
     if not column_info['nullable'] and column_info['default'] is None:
         # 如果是 NOT NULL 但没有默认值，使用合理的默认值
-        if 'INTEGER' in col_type.upper():
-            default_value = '0'
-        elif 'BOOLEAN' in col_type.upper():
+        if 'INT' in col_type.upper() or 'FLOAT' in col_type.upper() or 'DOUBLE' in col_type.upper():
             default_value = '0'
+        elif 'BOOL' in col_type.upper():
+            # SQLite 3.23+ 和 PostgreSQL 都支持 FALSE
+            default_value = 'FALSE'
         else:
             default_value = "''"
         sql = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {col_type} NOT NULL DEFAULT {default_value}"
@@ -101,31 +112,84 @@ def add_column_to_table(table_name, column_name, column_info):
         sql = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {col_type}"
     
     try:
-        with db.engine.connect() as conn:
+        with db.engine.begin() as conn:
             conn.execute(text(sql))
-            conn.commit()
         return True, None
     except Exception as e:
         return False, str(e)
 
+def migrate_login_info(batch_size=500, pause=0.05):
+    """
+    把 usage_records.login_info 中的登录信息分批压缩写入 usage_record_login_info 表，并清空原字段
+
+    每批在一个短事务中完成，批次之间短暂停顿让出写锁，服务运行时也可以执行；
+    中断后重新运行会从剩余的记录继续。原字段保留（只清空），不删除任何字段。
+    :return: (迁移的记录数, 压缩前字节数, 压缩后字节数)
+    """
+    inspector = inspect(db.engine)
+    if 'login_info' not in [c['name'] for c in inspector.get_columns('usage_records')]:
+        return 0, 0, 0
+    
+    moved = raw_bytes = packed_bytes = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(text(
+            "SELECT id, login_info FROM usage_records "
+            "WHERE id > :last_id AND login_info IS NOT NULL ORDER BY id LIMIT :limit"
+        ), {'last_id': last_id, 'limit': batch_size}).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        ids = [row[0] for row in rows]
+        
+        # 已有快照的记录（如迁移中断后重跑）不覆盖
+        existing = {row[0] for row in db.session.query(UsageRecordLoginInfo.record_id).filter(
+            UsageRecordLoginInfo.record_id.in_(ids)
+        )}
+        snapshots = []
+        for record_id, login_info in rows:
+            if record_id in existing or not login_info:
+                continue
+            content = UsageRecordLoginInfo.compress(login_info)
+            raw_bytes += len(login_info.encode('utf-8'))
+            packed_bytes += len(content)
+            snapshots.append({'record_id': record_id, 'content': content, 'pending': False})
+        if snapshots:
+            db.session.execute(UsageRecordLoginInfo.__table__.insert(), snapshots)
+        db.session.execute(
+            text("UPDATE usage_records SET login_info = NULL WHERE id IN :ids").bindparams(bindparam('ids', expanding=True)),
+            {'ids': ids}
+        )
+        db.session.commit()
+        moved += len(snapshots)
+        print(f"  已迁移 {moved} 条登录信息（记录ID至 {last_id}）")
+        time.sleep(pause)
+    
+    return moved, raw_bytes, packed_bytes
+
 with app.app_context():
     print_header("数据库自动迁移工具")
-    print(f"数据库路径: {db_path}")
-    print(f"数据库存在: {os.path.exists(db_path)}")
+    # 检查数据库是否存在（SQLite看文件，其他数据库看是否已有表）
+    db_exists = db_backend.exists(db.engine)
+    print(f"数据库: {db_backend.display_url}")
+    print(f"数据库存在: {db_exists}")
     
     # 定义所有模型
     models = {
         'users': User,
         'devices': Device,
         'usage_records': UsageRecord,
+        'usage_record_login_info': UsageRecordLoginInfo,
+        'device_daily_usage': DeviceDailyUsage,
+        'device_hourly_usage': DeviceHourlyUsage,
+        'user_daily_usage': UserDailyUsage,
+        'data_markers': DataMarker,
         'allowed_users': AllowedUser,
         'audit_logs': AuditLog,
+        'audit_action_daily_counts': AuditActionDailyCount,
         'quick_commands': QuickCommand
     }
     
-    # 检查数据库是否存在
-    db_exists = os.path.exists(db_path)
-    
     if not db_exists:
         print_section("数据库不存在，创建新数据库")
         db.create_all()
@@ -136,6 +200,7 @@ with app.app_context():
         admin = User(username=admin_username, password=admin_password, is_admin=True)
         db.session.add(admin)
         db.session.commit()
+        AuditSearch().create(db.engine, rebuild=False)
         
         print(f"✅ 已创建新数据库")
         print(f"✅ 已创建所有表: {', '.join(models.keys())}")
@@ -152,6 +217,7 @@ with app.app_context():
         # 统计信息
         total_tables_added = 0
         total_columns_added = 0
+        total_indexes_added = 0
         total_tables_checked = 0
         errors = []
         
@@ -200,19 +266,99 @@ with app.app_context():
                         print(f"    ❌ {error_msg}")
             else:
                 print(f"  ✅ 表结构完整，无需更新")
+            
+            # 检查索引（逐个创建，每个索引一个短事务，服务运行期间也可执行）
+            db_indexes = {index['name'] for index in inspector.get_indexes(table_name)}
+            for index in sorted(model.__table__.indexes, key=lambda i: i.name):
+                if index.name in db_indexes:
+                    continue
+                print(f"    正在创建索引: {index.name} ({', '.join(c.name for c in index.columns)})")
+                try:
+                    started = time.time()
+                    index.create(db.engine, checkfirst=True)
+                    total_indexes_added += 1
+                    print(f"    ✅ 已创建索引: {index.name}，耗时 {time.time() - started:.2f}秒")
+                except Exception as e:
+                    error_msg = f"创建索引 {index.name} 失败: {e}"
+                    errors.append(error_msg)
+                    print(f"    ❌ {error_msg}")
+        
+        # 登录信息移到独立的压缩表
+        print_section("迁移登录信息: usage_records.login_info -> usage_record_login_info")
+        try:
+            moved, raw_bytes, packed_bytes = migrate_login_info()
+            if moved:
+                print(f"  ✅ 已迁移 {moved} 条登录信息，{raw_bytes} 字节压缩为 {packed_bytes} 字节")
+            else:
+                print(f"  ✅ 没有需要迁移的登录信息")
+        except Exception as e:
+            db.session.rollback()
+            error_msg = f"迁移登录信息失败: {e}"
+            errors.append(error_msg)
+            print(f"  ❌ {error_msg}")
+        
+        # 从历史记录生成使用时长汇总
+        print_section("使用时长汇总表")
+        try:
+            if '--rebuild-rollups' in sys.argv or usage_rollup.needs_rebuild():
+                started = time.time()
+                count = usage_rollup.rebuild()
+                print(f"  ✅ 已从 {count} 条已结束的使用记录生成汇总，耗时 {time.time() - started:.1f}秒")
+            else:
+                print(f"  ✅ 已生成过（如需从历史记录重新生成请加参数 --rebuild-rollups）")
+        except Exception as e:
+            db.session.rollback()
+            error_msg = f"生成使用时长汇总失败: {e}"
+            errors.append(error_msg)
+            print(f"  ❌ {error_msg}")
+        
+        # 审计日志每日计数（操作类型下拉框和按类型统计）
+        print_section("审计日志每日计数表")
+        try:
+            if '--rebuild-audit-counts' in sys.argv or audit_counts.needs_rebuild():
+                started = time.time()
+                count = audit_counts.rebuild()
+                print(f"  ✅ 已从历史日志生成 {count} 行计数，耗时 {time.time() - started:.1f}秒")
+            else:
+                print(f"  ✅ 已生成过（如需从历史日志重新生成请加参数 --rebuild-audit-counts）")
+        except Exception as e:
+            db.session.rollback()
+            error_msg = f"生成审计日志计数失败: {e}"
+            errors.append(error_msg)
+            print(f"  ❌ {error_msg}")
+        
+        # 审计日志全文索引（触发器随日志写入/清理同步维护，只需在首次建立时从现有日志生成）
+        print_section("审计日志全文索引")
+        if not db_backend.is_sqlite:
+            print(f"  跳过（仅支持SQLite，其他数据库使用 LIKE 搜索）")
+        else:
+            try:
+                audit_search = AuditSearch()
+                if audit_search.exists(db.engine) and '--rebuild-audit-fts' not in sys.argv:
+                    audit_search.create(db.engine, rebuild=False)
+                    print(f"  ✅ 全文索引已存在（如需重新生成请加参数 --rebuild-audit-fts）")
+                else:
+                    started = time.time()
+                    audit_search.create(db.engine, rebuild=True)
+                    print(f"  ✅ 已从 {AuditLog.query.count()} 条审计日志生成全文索引，耗时 {time.time() - started:.1f}秒")
+            except Exception as e:
+                error_msg = f"建立审计日志全文索引失败: {e}"
+                errors.append(error_msg)
+                print(f"  ❌ {error_msg}")
         
         # 显示汇总
         print_header("迁移汇总")
         print(f"检查的表数量: {total_tables_checked}")
         print(f"新创建的表: {total_tables_added}")
         print(f"新添加的字段: {total_columns_added}")
+        print(f"新创建的索引: {total_indexes_added}")
         
         if errors:
             print(f"\n⚠️  发现 {len(errors)} 个错误:")
             for error in errors:
                 print(f"  - {error}")
         
-        if total_tables_added > 0 or total_columns_added > 0:
+        if total_tables_added > 0 or total_columns_added > 0 or total_indexes_added > 0:
             print(f"\n✅ 数据库已成功升级到最新版本！")
         else:
             print(f"\n✅ 数据库结构已是最新，无需升级")
@@ -226,6 +372,26 @@ with app.app_context():
             columns = inspector.get_columns(table_name)
             print(f"  ✅ {table_name}: {len(columns)} 个字段")
     
+    # 更新统计信息后检查热点查询的执行计划
+    print_section("检查热点查询执行计划")
+    try:
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+    except Exception as e:
+        print(f"  ⚠️  无法更新统计信息: {e}")
+    if db_backend.is_sqlite:
+        try:
+            failed = 0
+            for name, ok, plan in query_plans.check_query_plans():
+                print(f"  {'✅' if ok else '⚠️ '} {name}: {'; '.join(plan)}")
+                failed += 0 if ok else 1
+            if failed:
+                print(f"  ⚠️  {failed} 个查询未使用索引")
+        except Exception as e:
+            print(f"  ⚠️  无法检查执行计划: {e}")
+    else:
+        print(f"  跳过（仅支持SQLite）")
+    
     # 显示数据统计
     print_section("数据库统计")
     try: